@@ -2,15 +2,15 @@
 import serial
 import time
 import os
-import threading
 from src.duty_forward_revers import VESCDutyController
 from src.relay import RelayController
 from src.reader_v2 import VESCReader
+from src.session_log import log_extension
 from src.toggle_switch import ToggleSwitchController
 from src.joystick import Joystick
-
-# シリアルポート排他制御用ロック（DutyController/Reader共有）
-serial_lock = threading.Lock()
+from src.transport import SerialTransport
+from src.metrics import MetricsServer
+from src.session_postprocess import make_session_hook
 
 # ===== 設定 =====
 SERIAL_PORT = "/dev/serial0"
@@ -38,7 +38,41 @@ JOYSTICK_INTERVAL = 0.05  # 50msごとにduty送信
 # ログ設定
 LOG_INTERVAL = 0.1
 USB_LOG_DIR = "/media/pi/B5EA-9E28/log"
+# time = 要求送信と応答受信の中間時刻（単調増加時刻、セッション開始から）
+# "t_send" / "t_recv" / "rtt" を追加すると送受信時刻・往復時間も記録
 CSV_FIELDS = ["time", "duty", "rpm", "v_in", "current_in", "current_motor", "temp_fet"]
+# CSV_FIELDSの値だけをCOMM_GET_VALUES_SELECTIVEで要求（応答を短縮、要ファームウェア対応）
+# 応答がない場合はCOMM_GET_VALUESに自動で切り替える
+SELECTIVE_TELEMETRY = False
+# 応答待ち: "event" = 応答到着まで待つ / "sleep" = 固定50ms待機（従来）
+RESPONSE_WAIT = "event"
+RESPONSE_TIMEOUT = 0.05
+# 同時に送信しておくGET_VALUES要求数（高レートでログを取る場合に2以上）
+PIPELINE_DEPTH = 1
+# ログ形式: "csv" = CSV / "bin" = 固定長バイナリ(.tslog、python -m src.session_log でCSVに変換)
+# binは書き込みが軽い（サイズはCSVの約0.6倍、容量を減らすならLOG_COMPRESSION）
+LOG_FORMAT = "csv"
+# ログ圧縮: None / "gzip" / "zstd"（zstandardがなければgzip）。1ブロック=1回のflush分
+LOG_COMPRESSION = None
+# ログは別スレッドで書き込み: flush間隔（秒） / fsync間隔（秒、Noneで無効）
+LOG_FLUSH_INTERVAL = 1.0
+LOG_FSYNC_INTERVAL = 10.0
+# 長時間のmanualログを分割（取得は止めずに _p002 などの次のファイルへ）。Noneで無効
+LOG_ROTATE_BYTES = 16 * 1024 * 1024
+LOG_ROTATE_SECONDS = 600
+# ステータス行の更新周期（Hz） / 表示レベル（0=なし, 1=ステータス行, 2=hex dump等の診断も表示）
+DISPLAY_RATE = 4.0
+VERBOSE = 1
+# メトリクス（Prometheus形式、http://127.0.0.1:9101/metrics）。Noneで無効
+METRICS_PORT = 9101
+# セッションカタログ（SQLite、ログを閉じるたびに集計して登録）。Noneで無効
+# 検索: python -m src.session_catalog <DB> query --mode auto --direction reverse --days 7 --min-peak 20
+CATALOG_DB = os.path.join(USB_LOG_DIR, "sessions.db")
+# 概観表示用のピラミッド（区間ごとのmin/max/mean、ログと同じ場所に.pyr.npz）。Noneで作らない
+LOG_PYRAMID_LEVELS = (1.0, 10.0, 60.0)
+# 時刻インデックスの間隔（秒、ログと同じ場所に.tsidx）。Noneで作らない
+# 区間の読み出し: python -m src.log_index <ログ> --window T0 T1
+LOG_INDEX_INTERVAL = 5.0
 
 # ログ取得時間（モーター動作時間 + マージン）
 LOG_DURATION = RUN_TIME_SEC + 3
@@ -46,9 +80,9 @@ LOG_DURATION = RUN_TIME_SEC + 3
 
 
 def make_log_filename(mode):
-    """ログファイル名を生成: {mode}_{YYYYMMDD}_{HHMMSS}.csv"""
+    """ログファイル名を生成: {mode}_{YYYYMMDD}_{HHMMSS}.csv（binary形式は.tslog、圧縮時は.gz等を付加）"""
     timestamp = time.strftime("%Y%m%d_%H%M%S")
-    return os.path.join(USB_LOG_DIR, f"{mode}_{timestamp}.csv")
+    return os.path.join(USB_LOG_DIR, f"{mode}_{timestamp}{log_extension(LOG_FORMAT, LOG_COMPRESSION)}")
 
 
 def main():
@@ -57,12 +91,15 @@ def main():
 
     ser = serial.Serial(SERIAL_PORT, BAUDRATE, timeout=0.1)
 
+    # シリアルI/O専有スレッド（停止 > Duty指令 > テレメトリ要求の優先順で送信）
+    transport = SerialTransport(ser)
+
     # VESC制御
     duty = VESCDutyController(
         ser,
         max_duty=MAX_DUTY,
         step_delay=STEP_DELAY,
-        serial_lock=serial_lock
+        transport=transport
     )
 
     # ログ取得
@@ -71,9 +108,25 @@ def main():
         interval=LOG_INTERVAL,
         csv_filename="",  # 都度設定する
         csv_fields=CSV_FIELDS,
-        serial_lock=serial_lock
+        transport=transport,
+        selective=SELECTIVE_TELEMETRY,
+        response_wait=RESPONSE_WAIT,
+        response_timeout=RESPONSE_TIMEOUT,
+        pipeline_depth=PIPELINE_DEPTH,
+        log_format=LOG_FORMAT,
+        log_flush_interval=LOG_FLUSH_INTERVAL,
+        log_fsync_interval=LOG_FSYNC_INTERVAL,
+        log_compression=LOG_COMPRESSION,
+        log_rotate_bytes=LOG_ROTATE_BYTES,
+        log_rotate_seconds=LOG_ROTATE_SECONDS,
+        display_rate=DISPLAY_RATE,
+        verbose=VERBOSE
     )
 
+    # ログを閉じたらインデックス・カタログ登録・ピラミッド作成（書き込みスレッドで行うので取得は止まらない）
+    reader.on_session_closed = make_session_hook(CATALOG_DB, MAX_DUTY, LOG_PYRAMID_LEVELS,
+                                                 LOG_INDEX_INTERVAL)
+
     # GPIO制御（autoモード用）
     relay = RelayController(
         pin_forward=GPIO_PIN_FORWARD,
@@ -106,28 +159,24 @@ def main():
         print("AUTO FORWARD START")
         print("=" * 50)
 
-        with serial_lock:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
+        transport.discard_pending()
         time.sleep(0.2)
 
         log_file = make_log_filename("auto_forward")
-        reader.start_temporary(LOG_DURATION, csv_filename=log_file)
+        reader.open_session(log_file, duration=LOG_DURATION)
         time.sleep(0.5)
 
         duty.ramp_and_hold(+MAX_DUTY, RUN_TIME_SEC)
 
-        print(f"Waiting for reader to auto-stop...")
+        print(f"Waiting for log session to end...")
         time.sleep(LOG_DURATION - RUN_TIME_SEC + 1)
 
-        reader.stop()
+        reader.close_session()
 
         print("Waiting for VESC stabilization...")
         time.sleep(3.0)
 
-        with serial_lock:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
+        transport.discard_pending()
 
         print("=" * 50)
         print("AUTO FORWARD COMPLETED")
@@ -143,28 +192,24 @@ def main():
         print("AUTO REVERSE START")
         print("=" * 50)
 
-        with serial_lock:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
+        transport.discard_pending()
         time.sleep(0.2)
 
         log_file = make_log_filename("auto_reverse")
-        reader.start_temporary(LOG_DURATION, csv_filename=log_file)
+        reader.open_session(log_file, duration=LOG_DURATION)
         time.sleep(0.5)
 
         duty.ramp_and_hold(-MAX_DUTY, RUN_TIME_SEC)
 
-        print(f"Waiting for reader to auto-stop...")
+        print(f"Waiting for log session to end...")
         time.sleep(LOG_DURATION - RUN_TIME_SEC + 1)
 
-        reader.stop()
+        reader.close_session()
 
         print("Waiting for VESC stabilization...")
         time.sleep(3.0)
 
-        with serial_lock:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
+        transport.discard_pending()
 
         print("=" * 50)
         print("AUTO REVERSE COMPLETED")
@@ -174,6 +219,22 @@ def main():
     relay.on_forward = forward_action
     relay.on_reverse = reverse_action
 
+    transport.start()
+    # テレメトリ取得は起動時から常に継続（ログはセッションごとにファイルを切り替えるだけ）
+    reader.start_polling()
+
+    # 実行中のメトリクス公開（ポートが使えなくても動作は続ける）
+    metrics = None
+    if METRICS_PORT is not None:
+        metrics = MetricsServer(port=METRICS_PORT)
+        for collector in (transport, duty, reader):
+            metrics.register(collector)
+        try:
+            metrics.start()
+        except OSError as e:
+            print(f"[Metrics] Disabled: {e}")
+            metrics = None
+
     try:
         # ジョイスティックキャリブレーション
         print("Calibrating joystick... Keep centered")
@@ -206,11 +267,11 @@ def main():
 
             # 電源OFF → モーター停止 & manualログ停止
             if power != "ON":
+                duty.set_duty(0)
                 if manual_logging:
-                    reader.stop()
+                    reader.close_session()
                     manual_logging = False
                     print("[LOG] Manual logging stopped (power OFF)")
-                duty.set_duty(0)
                 time.sleep(0.1)
                 continue
 
@@ -219,7 +280,7 @@ def main():
                 # manualログ開始（まだ開始していない場合）
                 if not manual_logging:
                     log_file = make_log_filename("manual")
-                    reader.start(csv_filename=log_file)
+                    reader.open_session(log_file)
                     manual_logging = True
                     print(f"[LOG] Manual logging started: {log_file}")
 
@@ -232,7 +293,7 @@ def main():
             else:
                 # manualログ停止
                 if manual_logging:
-                    reader.stop()
+                    reader.close_session()
                     manual_logging = False
                     print("[LOG] Manual logging stopped (mode changed)")
                 time.sleep(0.1)
@@ -243,6 +304,9 @@ def main():
         print("\nSYSTEM STOPPING...")
         reader.stop()
         duty.emergency_stop()
+        transport.stop()
+        if metrics is not None:
+            metrics.stop()
         joystick.close()
         ser.close()
         print("SYSTEM STOPPED")
@@ -0,0 +1,7 @@
+# main_async.py - asyncio版エントリポイント（設定値はmain.pyと共通）
+import main as config
+from src.aio_runtime import run
+
+
+if __name__ == "__main__":
+    run(config)
@@ -0,0 +1,567 @@
+# src/aio_runtime.py - asyncio版ランタイム（1つのイベントループで全体を制御）
+import asyncio
+import os
+import signal
+import time
+from collections import deque
+
+from src.vesc_codec import (
+    COMM_GET_VALUES,
+    COMM_GET_VALUES_SELECTIVE,
+    CURRENT_ZERO_FRAME,
+    DUTY_ZERO_FRAME,
+    GET_VALUES_FRAME,
+    DutyFrameTable,
+    FrameDecoder,
+    encode_get_values_selective,
+    parse_values,
+    selective_mask,
+)
+from src.metrics import Histogram, MetricsServer, collect_rx_metrics
+from src.reader_v2 import DISPLAY_FIELDS, SELECTIVE_FALLBACK_AFTER
+from src.session_log import TIMING_FIELDS, log_extension, open_session_writer
+from src.session_postprocess import make_session_hook
+
+
+class AsyncVESCTransport:
+    """
+    イベントループ上のシリアル送受信
+
+    - 受信はloop.add_reader()でfdが読めるときだけ処理（スレッド・ロック不要）
+    - request()は要求を送り、対応する応答をFutureで待つ
+    - 送信はUARTのOSバッファへの短い書き込みなのでその場で行う
+    - タイムアウトした要求の応答が遅れて届いても次の要求の応答とはしない
+      （さらにtimeout秒まで待って破棄し、その間は同じ応答IDの要求を送らない）
+    """
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.rx = FrameDecoder()
+        self._loop = None
+        # コマンドID → 応答待ちFutureの列（送信順）
+        self._waiters = {}
+        # コマンドID → タイムアウトした要求の遅れた応答を破棄する期限の列
+        self._timed_out = {}
+        self._subscribers = {}
+        self.sent_count = 0
+        self.timeout_count = 0
+        self.late_count = 0
+        self.unrouted_count = 0
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self.ser.fileno(), self._on_readable)
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self.ser.fileno())
+            self._loop = None
+
+    def subscribe(self, cmd_id, callback):
+        """request()で待っていない応答の購読（callback(payload, t_recv)）"""
+        self._subscribers.setdefault(cmd_id, []).append(callback)
+
+    def send(self, frame):
+        self.ser.write(frame)
+        self.sent_count += 1
+
+    async def request(self, frame, reply_id, timeout):
+        """
+        要求を送信して応答を待つ
+
+        Returns:
+            (payload, t_send, t_recv) タイムアウト時はNone
+        """
+        # タイムアウトした要求の応答が届く（か期限が過ぎる）まで送らない
+        stale = self._timed_out.get(reply_id)
+        while stale:
+            wait = stale[0] - time.monotonic()
+            if wait <= 0:
+                stale.popleft()
+                continue
+            await asyncio.sleep(min(wait, 0.005))
+
+        future = self._loop.create_future()
+        waiters = self._waiters.setdefault(reply_id, deque())
+        waiters.append(future)
+        t_send = time.monotonic()
+        self.send(frame)
+        try:
+            payload, t_recv = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.timeout_count += 1
+            self._timed_out.setdefault(reply_id, deque()).append(time.monotonic() + timeout)
+            return None
+        finally:
+            if future in waiters:
+                waiters.remove(future)
+        return payload, t_send, t_recv
+
+    def collect_metrics(self, w):
+        """MetricsServerから呼ばれる（別スレッド、読むだけ）"""
+        w.counter("vesc_transport_sent_total", "Frames written to the serial port", self.sent_count)
+        w.counter("vesc_transport_timeouts_total", "Requests that got no reply in time",
+                  self.timeout_count)
+        w.counter("vesc_transport_late_replies_total", "Replies discarded after their request timed out",
+                  self.late_count)
+        w.counter("vesc_transport_unrouted_total", "Received frames with no subscriber",
+                  self.unrouted_count)
+        collect_rx_metrics(w, self.rx)
+
+    def _on_readable(self):
+        waiting = self.ser.in_waiting
+        if waiting <= 0 or not self.rx.readinto(self.ser, waiting):
+            return
+        t_recv = time.monotonic()
+        for payload in self.rx.decode():
+            stale = self._timed_out.get(payload[0])
+            while stale and stale[0] < t_recv:
+                stale.popleft()
+            if stale:
+                # タイムアウトした要求への応答（送信順に届く）
+                stale.popleft()
+                self.late_count += 1
+                continue
+            waiters = self._waiters.get(payload[0])
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result((payload, t_recv))
+                    break
+            else:
+                callbacks = self._subscribers.get(payload[0])
+                if not callbacks:
+                    self.unrouted_count += 1
+                for callback in callbacks or ():
+                    callback(payload, t_recv)
+
+
+class AsyncDutyController:
+    """VESCDutyControllerと同じ動作のasync版（sleepはawait）"""
+
+    def __init__(self, transport, max_duty=10, step_delay=0.05):
+        self.transport = transport
+        self.max_duty = max_duty
+        self.step_delay = step_delay
+        self._duty_frames = DutyFrameTable(max_duty)
+        self._lock = asyncio.Lock()
+
+    def _send_duty(self, duty):
+        duty = max(-100.0, min(100.0, duty))
+        self.transport.send(self._duty_frames.frame(duty))
+
+    def set_duty(self, duty):
+        """Duty値を直接設定（manual制御用、ランプ・停止シーケンス中は送らない）"""
+        if self._lock.locked():
+            return
+        duty = max(-self.max_duty, min(self.max_duty, duty))
+        self._send_duty(duty)
+
+    async def _repeat(self, frame, count, interval):
+        for _ in range(count):
+            self.transport.send(frame)
+            await asyncio.sleep(interval)
+
+    async def ramp_and_hold(self, target_duty, hold_time):
+        """ランプアップ → 保持 → ランプダウン → 完全停止"""
+        async with self._lock:
+            step = 1 if target_duty > 0 else -1
+            d = 0
+            try:
+                print(f"Ramping up to {target_duty}%...")
+                while abs(d) < abs(target_duty):
+                    d += step
+                    self._send_duty(d)
+                    await asyncio.sleep(self.step_delay)
+
+                print(f"Holding at {target_duty}% for {hold_time}s...")
+                hold_end = time.monotonic() + hold_time
+                while time.monotonic() < hold_end:
+                    self._send_duty(target_duty)
+                    await asyncio.sleep(0.05)
+                self._send_duty(target_duty)
+
+                print(f"Ramping down to 0%...")
+                while abs(d) > 0:
+                    d -= step
+                    self._send_duty(d)
+                    await asyncio.sleep(self.step_delay)
+
+                print("Stopping immediately...")
+                await self._repeat(DUTY_ZERO_FRAME, 10, 0.01)
+            finally:
+                # キャンセルされた場合も必ず停止シーケンスを送る
+                await asyncio.shield(self._complete_stop())
+            print("Motor stopped")
+
+    async def _complete_stop(self):
+        """VESCDutyController._complete_stop()と同じ送信列（バッファクリアは不要）"""
+        print("[STOP] Sending Duty=0...")
+        await self._repeat(DUTY_ZERO_FRAME, 30, 0.005)
+        print("[STOP] Switching to current mode (0A)...")
+        await self._repeat(CURRENT_ZERO_FRAME, 20, 0.02)
+        print("[STOP] Re-sending Duty=0...")
+        await self._repeat(DUTY_ZERO_FRAME, 30, 0.005)
+        print("[STOP] Final current mode lock...")
+        await self._repeat(CURRENT_ZERO_FRAME, 20, 0.02)
+        print("[STOP] Waiting for VESC stabilization...")
+        await asyncio.sleep(2.0)
+        await self._repeat(CURRENT_ZERO_FRAME, 10, 0.02)
+        print("[STOP] Complete")
+
+    async def emergency_stop(self):
+        # 実行中の停止シーケンスと交互に送らないよう終わるのを待つ
+        async with self._lock:
+            print("EMERGENCY STOP")
+            await self._complete_stop()
+
+
+class AsyncVESCReader:
+    """
+    VESCReaderのasync版（セッション中だけGET_VALUESを要求してCSVに保存）
+
+    - open_session(filename, duration) でログ開始（durationで自動終了）
+    - close_session() で終了
+    """
+
+    def __init__(self, transport, interval=0.1, csv_fields=None,
+                 selective=False, response_timeout=0.05, log_format="csv",
+                 log_flush_interval=1.0, log_fsync_interval=None, log_compression=None,
+                 log_rotate_bytes=None, log_rotate_seconds=None):
+        self.transport = transport
+        self.interval = interval
+        self.response_timeout = response_timeout
+        self.csv_fields = csv_fields or ["time", "duty", "rpm"]
+        self.log_format = log_format
+        self.log_flush_interval = log_flush_interval
+        self.log_fsync_interval = log_fsync_interval
+        self.log_compression = log_compression
+        self.log_rotate_bytes = log_rotate_bytes
+        self.log_rotate_seconds = log_rotate_seconds
+        self._timing_columns = any(f in TIMING_FIELDS for f in self.csv_fields)
+        self._request_frame = GET_VALUES_FRAME
+        self._reply_id = COMM_GET_VALUES
+        if selective:
+            mask = selective_mask(self.csv_fields + DISPLAY_FIELDS)
+            self._request_frame = encode_get_values_selective(mask)
+            self._reply_id = COMM_GET_VALUES_SELECTIVE
+        # selective要求への応答を受け取ったか / 連続で応答がない回数
+        self._selective_confirmed = not selective
+        self._unanswered = 0
+
+        self._active = asyncio.Event()
+        self._log_writer = None
+        self._start_time = None
+        self._auto_close = None
+        self.count = 0
+        self.empty_count = 0
+        # メトリクス用（セッションをまたいで累積）
+        self._samples_total = 0
+        self._empty_total = 0
+        self.rtt_histogram = Histogram()
+        # ログを閉じた後に書き込みスレッドから呼ばれる（引数: ファイルパスのリスト）
+        self.on_session_closed = None
+
+    def open_session(self, csv_filename, duration=None):
+        if self._active.is_set():
+            self.close_session()
+        self._log_writer = open_session_writer(
+            csv_filename, self.csv_fields, self.log_format,
+            compression=self.log_compression,
+            rotate_bytes=self.log_rotate_bytes, rotate_seconds=self.log_rotate_seconds,
+            flush_interval=self.log_flush_interval, fsync_interval=self.log_fsync_interval,
+            on_closed=self.on_session_closed)
+        self._start_time = time.monotonic()
+        self.count = 0
+        self.empty_count = 0
+        if duration is not None:
+            loop = asyncio.get_running_loop()
+            self._auto_close = loop.call_later(duration, self.close_session)
+        self._active.set()
+        print(f"[CSV] Logging to: {csv_filename} ({self.log_format})")
+
+    def close_session(self, wait=False):
+        """セッション終了（wait=Falseなら書き込みスレッドの終了を待たない）"""
+        if self._auto_close is not None:
+            self._auto_close.cancel()
+            self._auto_close = None
+        if not self._active.is_set():
+            return
+        self._active.clear()
+        self._log_writer.close(wait=wait)
+        self._log_writer = None
+        print(f"[CSV] Closing. samples={self.count}, empty={self.empty_count}")
+
+    async def run(self):
+        """ポーリングタスク（キャンセルで終了）"""
+        try:
+            while True:
+                await self._active.wait()
+                t_next = time.monotonic() + self.interval
+                reply = await self.transport.request(
+                    self._request_frame, self._reply_id, self.response_timeout)
+                if reply is None:
+                    self.empty_count += 1
+                    self._empty_total += 1
+                    self._unanswered += 1
+                    if not self._selective_confirmed and self._unanswered >= SELECTIVE_FALLBACK_AFTER:
+                        self._fallback_to_full()
+                else:
+                    self._unanswered = 0
+                    self._selective_confirmed = True
+                    payload, t_send, t_recv = reply
+                    self.rtt_histogram.observe(t_recv - t_send)
+                    parsed = parse_values(payload)
+                    if parsed and self._active.is_set():
+                        self.count += 1
+                        self._samples_total += 1
+                        self._write_log(parsed, t_send, t_recv)
+                wait = t_next - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        finally:
+            # プログラム終了時は書き込み完了まで待つ
+            self.close_session(wait=True)
+
+    def _fallback_to_full(self):
+        """COMM_GET_VALUES_SELECTIVEに応答しないVESCは全値の要求に切り替える"""
+        self._request_frame = GET_VALUES_FRAME
+        self._reply_id = COMM_GET_VALUES
+        self._selective_confirmed = True
+        print(f"[Reader] No reply to COMM_GET_VALUES_SELECTIVE after {self._unanswered} requests, "
+              f"falling back to COMM_GET_VALUES")
+
+    def collect_metrics(self, w):
+        """MetricsServerから呼ばれる（カウンタはセッションをまたいで累積）"""
+        w.gauge("vesc_reader_active", "1 while a logging session is running",
+                int(self._active.is_set()))
+        w.counter("vesc_reader_samples_total", "Valid samples", self._samples_total)
+        w.counter("vesc_reader_empty_reads_total", "Requests with no reply",
+                  self._empty_total)
+        w.histogram("vesc_reader_rtt_seconds", "Request to reply round-trip time",
+                    self.rtt_histogram)
+
+    def _write_log(self, parsed, t_send, t_recv):
+        """時刻は送受信の中間（セッション開始からの経過秒）"""
+        start = self._start_time
+        timing = None
+        if self._timing_columns:
+            timing = {"t_send": t_send - start, "t_recv": t_recv - start, "rtt": t_recv - t_send}
+        self._log_writer.write((t_send + t_recv) / 2 - start, parsed, timing)
+
+
+class RigRuntime:
+    """
+    main.pyと同じmanual/auto動作を1つのイベントループで実行する
+
+    タスク:
+      - reader: セッション中のテレメトリ取得
+      - control: 電源/モード監視 + manual時のジョイスティック→Duty
+      - events: リレー入力（gpiozeroのスレッドからcall_soon_threadsafeで受け取る）
+    """
+
+    def __init__(self, config, ser, toggle, relay, joystick):
+        self.cfg = config
+        self.ser = ser
+        self.toggle = toggle
+        self.relay = relay
+        self.joystick = joystick
+
+        self.transport = AsyncVESCTransport(ser)
+        self.duty = None
+        self.reader = None
+        self._events = None
+        self._auto_task = None
+        # 停止シーケンスはキャンセル1回分しか保護されないので、キャンセルは1回だけ送る
+        self._auto_cancelled = False
+        self._manual_logging = False
+        self._log_format = getattr(config, "LOG_FORMAT", "csv")
+        self._log_compression = getattr(config, "LOG_COMPRESSION", None)
+
+    def _make_log_filename(self, mode):
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        return os.path.join(self.cfg.USB_LOG_DIR, f"{mode}_{timestamp}{log_extension(self._log_format, self._log_compression)}")
+
+    async def _auto_action(self, direction):
+        """正転/逆転動作（autoモード用・ログ付き）"""
+        cfg = self.cfg
+        name = "FORWARD" if direction > 0 else "REVERSE"
+        print("\n" + "=" * 50)
+        print(f"AUTO {name} START")
+        print("=" * 50)
+
+        log_file = self._make_log_filename(f"auto_{name.lower()}")
+        self.reader.open_session(log_file, duration=cfg.LOG_DURATION)
+        await asyncio.sleep(0.5)
+
+        await self.duty.ramp_and_hold(direction * cfg.MAX_DUTY, cfg.RUN_TIME_SEC)
+
+        print("Waiting for VESC stabilization...")
+        await asyncio.sleep(3.0)
+
+        print("=" * 50)
+        print(f"AUTO {name} COMPLETED")
+        print("=" * 50 + "\n")
+
+    async def _event_task(self):
+        while True:
+            direction = await self._events.get()
+            if not self.toggle.is_on():
+                print(f"{'FORWARD' if direction > 0 else 'REVERSE'} IGNORED (power OFF)")
+                continue
+            if self._auto_task is not None and not self._auto_task.done():
+                print("AUTO IGNORED (already running)")
+                continue
+            self._auto_task = asyncio.create_task(self._auto_action(direction))
+            self._auto_cancelled = False
+
+    def _stop_manual_logging(self, reason):
+        if self._manual_logging:
+            self.reader.close_session()
+            self._manual_logging = False
+            print(f"[LOG] Manual logging stopped ({reason})")
+
+    async def _control_task(self):
+        cfg = self.cfg
+        prev_power = None
+        prev_mode = None
+        while True:
+            power = self.toggle.get_power()
+            mode = self.toggle.get_mode()
+            if power != prev_power:
+                print(f"[POWER] {power}")
+                prev_power = power
+            if mode != prev_mode:
+                print(f"[MODE]  {mode}")
+                prev_mode = mode
+
+            auto_running = self._auto_task is not None and not self._auto_task.done()
+
+            if power != "ON":
+                self._stop_manual_logging("power OFF")
+                if auto_running:
+                    if not self._auto_cancelled:
+                        self._auto_task.cancel()
+                        self._auto_cancelled = True
+                else:
+                    self.duty.set_duty(0)
+                await asyncio.sleep(0.1)
+                continue
+
+            if mode == "manual" and not auto_running:
+                if not self._manual_logging:
+                    log_file = self._make_log_filename("manual")
+                    self.reader.open_session(log_file)
+                    self._manual_logging = True
+                    print(f"[LOG] Manual logging started: {log_file}")
+                y = self.joystick.read_y()
+                self.duty.set_duty(y * cfg.MAX_DUTY)
+                await asyncio.sleep(cfg.JOYSTICK_INTERVAL)
+            else:
+                self._stop_manual_logging("mode changed")
+                await asyncio.sleep(0.1)
+
+    async def run(self):
+        cfg = self.cfg
+        loop = asyncio.get_running_loop()
+        self._events = asyncio.Queue()
+        self.transport.start()
+        self.duty = AsyncDutyController(
+            self.transport, max_duty=cfg.MAX_DUTY, step_delay=cfg.STEP_DELAY)
+        self.reader = AsyncVESCReader(
+            self.transport,
+            interval=cfg.LOG_INTERVAL,
+            csv_fields=cfg.CSV_FIELDS,
+            selective=cfg.SELECTIVE_TELEMETRY,
+            response_timeout=cfg.RESPONSE_TIMEOUT,
+            log_format=self._log_format,
+            log_flush_interval=getattr(cfg, "LOG_FLUSH_INTERVAL", 1.0),
+            log_fsync_interval=getattr(cfg, "LOG_FSYNC_INTERVAL", None),
+            log_compression=self._log_compression,
+            log_rotate_bytes=getattr(cfg, "LOG_ROTATE_BYTES", None),
+            log_rotate_seconds=getattr(cfg, "LOG_ROTATE_SECONDS", None),
+        )
+        self.reader.on_session_closed = make_session_hook(
+            getattr(cfg, "CATALOG_DB", None), cfg.MAX_DUTY, getattr(cfg, "LOG_PYRAMID_LEVELS", None),
+            getattr(cfg, "LOG_INDEX_INTERVAL", None))
+
+        # gpiozeroのコールバックはイベントを積むだけ（スレッドをブロックしない）
+        self.relay.on_forward = lambda: loop.call_soon_threadsafe(self._events.put_nowait, +1)
+        self.relay.on_reverse = lambda: loop.call_soon_threadsafe(self._events.put_nowait, -1)
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        print("Calibrating joystick... Keep centered")
+        await asyncio.sleep(1)
+        await asyncio.to_thread(self.joystick.calibrate)
+
+        print("=" * 50)
+        print("SYSTEM READY (asyncio)")
+        print(f"  Power: {self.toggle.get_power()}")
+        print(f"  Mode:  {self.toggle.get_mode()}")
+        print("=" * 50 + "\n")
+
+        metrics = None
+        if getattr(cfg, "METRICS_PORT", None) is not None:
+            metrics = MetricsServer(port=cfg.METRICS_PORT)
+            metrics.register(self.transport)
+            metrics.register(self.reader)
+            try:
+                metrics.start()
+            except OSError as e:
+                print(f"[Metrics] Disabled: {e}")
+                metrics = None
+
+        tasks = [
+            asyncio.create_task(self.reader.run()),
+            asyncio.create_task(self._control_task()),
+            asyncio.create_task(self._event_task()),
+        ]
+        try:
+            await stop.wait()
+            print("\n\nStop requested")
+        finally:
+            print("\nSYSTEM STOPPING...")
+            for task in tasks:
+                task.cancel()
+            if self._auto_task is not None:
+                if not self._auto_cancelled:
+                    self._auto_task.cancel()
+                tasks.append(self._auto_task)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.duty.emergency_stop()
+            self.transport.close()
+            if metrics is not None:
+                metrics.stop()
+            print("SYSTEM STOPPED")
+
+
+def run(config):
+    """configはmain.pyと同じ設定値を持つモジュール/オブジェクト"""
+    import serial
+    from src.joystick import Joystick
+    from src.relay import RelayController
+    from src.toggle_switch import ToggleSwitchController
+
+    os.makedirs(config.USB_LOG_DIR, exist_ok=True)
+    ser = serial.Serial(config.SERIAL_PORT, config.BAUDRATE, timeout=0)
+    relay = RelayController(
+        pin_forward=config.GPIO_PIN_FORWARD,
+        pin_reverse=config.GPIO_PIN_REVERSE,
+        debounce_time=config.GPIO_DEBOUNCE,
+        cooldown_time=config.GPIO_COOLDOWN,
+    )
+    toggle = ToggleSwitchController(
+        pin_manual=config.GPIO_MANUAL,
+        pin_auto=config.GPIO_AUTO,
+        pin_on=config.GPIO_ON,
+        pin_off=config.GPIO_OFF,
+    )
+    joystick = Joystick()
+    try:
+        asyncio.run(RigRuntime(config, ser, toggle, relay, joystick).run())
+    finally:
+        joystick.close()
+        ser.close()
@@ -0,0 +1,456 @@
+# src/analysis.py - セッションログの一括読み込みと集計（NumPyでベクトル化）
+import glob
+import io
+import os
+import time
+
+import numpy as np
+
+from src.session_log import BINLOG_MAGIC, open_log, read_binlog_header
+
+# struct書式 → NumPy dtype（バイナリログの固定長レコード用）
+_STRUCT_DTYPES = {
+    "b": "i1", "B": "u1", "h": "i2", "H": "u2",
+    "i": "i4", "I": "u4", "q": "i8", "Q": "u8",
+    "f": "f4", "d": "f8",
+}
+
+# 一括処理の対象（圧縮ログも含む）
+LOG_PATTERNS = ("*.csv", "*.csv.gz", "*.csv.zst", "*.tslog", "*.tslog.gz", "*.tslog.zst")
+
+# Duty変化とみなす差分（1サンプル間）
+DUTY_STEP_MIN = 0.005
+# 応答を見る信号と「動いた」とみなす変化量（rpmがなければcurrent_motor）
+RESPONSE_SIGNALS = (("rpm", 50.0), ("current_motor", 0.5))
+# RPM整定: 目標値の±SETTLE_BAND以内（最低SETTLE_BAND_MIN rpm）に入ったまま出なくなるまで
+SETTLE_BAND = 0.05
+SETTLE_BAND_MIN = 50.0
+
+# 集計方法を変えたら上げる（analysis_cacheの作り直し）
+ANALYSIS_VERSION = 2
+
+# 異常検出: サンプル間隔がGAP_FACTOR倍の中央値（最低GAP_MIN秒）を超えたら欠落
+GAP_FACTOR = 5.0
+GAP_MIN = 0.5
+
+# summarize()が返す項目（CSV出力・表示の列順）
+SUMMARY_FIELDS = [
+    "file", "samples", "duration",
+    "current_motor_peak", "current_motor_mean", "current_in_peak", "current_in_mean",
+    "energy_j", "energy_wh",
+    "duty_peak", "duty_steps", "step_response_median", "step_response_max",
+    "rpm_settle_time", "rpm_target", "anomalies",
+]
+
+
+def _dtype(names):
+    return np.dtype([(name, "f8") for name in names])
+
+
+def _load_csv(path):
+    with open_log(path, "rt") as f:
+        text = f.read()
+    header, _, body = text.partition("\n")
+    return _parse_csv(path, header, body)
+
+
+def _parse_csv(path, header, body):
+    names = [name.strip() for name in header.strip().split(",")]
+    if not names or not all(name and name.isidentifier() for name in names):
+        raise ValueError(f"{path}: not a session log (header={header[:40]!r})")
+
+    # 電源断で途中までしか書かれていない末尾行は捨てる
+    if body and not body.endswith("\n"):
+        body = body[:body.rfind("\n") + 1]
+    if not body.strip():
+        return np.empty(0, dtype=_dtype(names))
+
+    try:
+        # 空欄のない通常のログは高速なloadtxtで一括変換
+        data = np.loadtxt(io.StringIO(body), delimiter=",", dtype=np.float64, ndmin=2)
+    except ValueError:
+        # 列数がヘッダと違う行（別設定のログが追記されたもの）は除外
+        lines = np.array(body.splitlines())
+        match = np.char.count(lines, ",") == len(names) - 1
+        if not match.all():
+            print(f"[Analysis] {path}: ignored {int((~match).sum())} rows with a different column count")
+        lines = lines[match]
+        if len(lines) == 0:
+            return np.empty(0, dtype=_dtype(names))
+        # 空欄（値が取れなかったフィールド）はNaN
+        data = np.genfromtxt(lines, delimiter=",", dtype=np.float64, ndmin=2)
+    if data.shape[1] != len(names):
+        raise ValueError(f"{path}: {data.shape[1]} columns, header has {len(names)}")
+    return np.rec.fromarrays(data.T, dtype=_dtype(names)).view(np.ndarray)
+
+
+def _load_binlog(path):
+    with open_log(path, "rb") as f:
+        header = read_binlog_header(f)
+        payload = f.read()
+    return _parse_binlog(path, header, payload)
+
+
+def _parse_binlog(path, header, payload):
+    fields = header["fields"]
+    record = np.dtype([("_ticks", "<i4")] +
+                      [(field["name"], "<" + _STRUCT_DTYPES[field["format"]]) for field in fields])
+    if record.itemsize != header["record_size"]:
+        raise ValueError(f"{path}: record size mismatch ({record.itemsize} != {header['record_size']})")
+    # 末尾の不完全なレコードは捨てる
+    usable = len(payload) - len(payload) % record.itemsize
+    raw = np.frombuffer(payload[:usable], dtype=record)
+
+    names = header["csv_fields"]
+    out = np.empty(len(raw), dtype=_dtype(names))
+    if "time" in out.dtype.names:
+        out["time"] = np.round(raw["_ticks"] * header["time_unit"], 3)
+    for field in fields:
+        if field["name"] not in out.dtype.names:
+            continue
+        values = raw[field["name"]].astype(np.float64)
+        out[field["name"]] = values if field["divisor"] is None else values / field["divisor"]
+    return out
+
+
+def load_session(path):
+    """
+    セッションログをNumPyの構造化配列として読み込む（CSV / .tslog、圧縮されていても可）
+
+    列名はログのヘッダそのまま（time, duty, rpm, ...）、値はすべてfloat64。
+    空欄はNaN、電源断などで途中までしか書かれていない末尾行は捨てる。
+
+    Raises:
+        ValueError: セッションログとして読めないファイル
+    """
+    with open_log(path, "rb") as f:
+        magic = f.read(len(BINLOG_MAGIC))
+    if magic == BINLOG_MAGIC:
+        return _load_binlog(path)
+    return _load_csv(path)
+
+
+def load_window(path, t0=None, t1=None, index=None):
+    """
+    load_session() の時間範囲 [t0, t1] 版
+
+    時刻インデックス（src.log_index、なければ作る）でt0付近までシークし、
+    t1を過ぎたところで読むのをやめる。
+    """
+    from src.log_index import iter_csv_window, open_index, read_binlog_window
+
+    index = index or open_index(path)
+    if index.header["format"] == "bin":
+        header, payload = read_binlog_window(path, t0, t1, index)
+        return _parse_binlog(path, header, payload)
+    lines = iter_csv_window(path, t0, t1, index)
+    header = next(lines).decode("utf-8")
+    return _parse_csv(path, header, b"".join(lines).decode("utf-8"))
+
+
+def drop_time_resets(data):
+    """時刻が前の行以前に戻った行（追記されたログ等）と時刻のない行を除く"""
+    t = data["time"]
+    keep = np.isfinite(t)
+    keep[keep] = np.concatenate(([True], np.diff(np.maximum.accumulate(t[keep])) > 0))
+    return data if keep.all() else data[keep]
+
+
+def resample(data, dt):
+    """
+    等間隔（dt秒）のグリッドに線形補間した配列を返す（セッション間の比較・重ね合わせ用）
+
+    時刻が戻っている部分（追記されたログ等）は捨てる。列の空欄は前後の値から補間。
+    """
+    data = drop_time_resets(data)
+    if len(data) < 2:
+        return data.copy()
+    t = data["time"]
+    grid = np.arange(t[0], t[-1] + dt / 2, dt)
+    out = np.empty(len(grid), dtype=data.dtype)
+    out["time"] = grid
+    for name in data.dtype.names:
+        if name == "time":
+            continue
+        values = data[name]
+        ok = np.isfinite(values)
+        out[name] = np.interp(grid, t[ok], values[ok]) if ok.any() else np.nan
+    return out
+
+
+def _column(data, name):
+    if name in data.dtype.names:
+        return data[name]
+    return None
+
+
+def _energy(t, v_in, current_in):
+    """入力電力 v_in*current_in の台形積分（J）"""
+    p = v_in * current_in
+    ok = np.isfinite(p) & np.isfinite(t)
+    t, p = t[ok], p[ok]
+    if len(t) < 2:
+        return np.nan
+    return float(np.sum(0.5 * (p[1:] + p[:-1]) * np.diff(t)))
+
+
+def duty_steps(duty):
+    """Dutyが保持状態から動き出したサンプル（ランプは開始点の1回だけ数える）"""
+    changed = np.abs(np.diff(duty)) > DUTY_STEP_MIN
+    onset = changed & ~np.concatenate(([False], changed[:-1]))
+    return np.flatnonzero(onset) + 1
+
+
+def step_response_times(t, duty, signal, threshold):
+    """
+    Duty変化から応答信号が変化幅の90%に達するまでの時間（Duty変化ごと）
+
+    区間 = Duty変化から次のDuty変化まで。区間内での signal の最大変化幅（変化開始時点の値から）
+    がthreshold未満のもの（応答なし）は含めない。
+
+    Returns:
+        (Duty変化のインデックス, 応答時間の配列)
+    """
+    steps = duty_steps(duty)
+    if len(steps) == 0:
+        return steps, np.empty(0)
+    # 各サンプルが属する区間と、区間開始時点からの変化量
+    seg = np.repeat(np.arange(len(steps)), np.diff(np.append(steps, len(t))))
+    idx = np.arange(steps[0], len(t))
+    excursion = np.abs(signal[idx] - signal[steps][seg])
+    excursion = np.where(np.isfinite(excursion), excursion, 0.0)
+    peak = np.maximum.reduceat(excursion, steps - steps[0])
+
+    # 区間ごとに、最大変化幅の90%に最初に達したサンプル
+    reached = np.flatnonzero(excursion >= 0.9 * peak[seg])
+    first = reached[np.searchsorted(reached, steps - steps[0])] + steps[0]
+    ok = peak >= threshold
+    return steps, t[first[ok]] - t[steps[ok]]
+
+
+def rpm_settle_time(t, duty, rpm):
+    """
+    最も長くDutyを保持した区間での、区間開始からRPMが整定するまでの時間
+
+    目標値は区間後半のRPM中央値。以降ずっと±SETTLE_BANDに収まる最初の時刻までを返す。
+
+    Returns:
+        (整定時間, 目標RPM)。区間がなければ (nan, nan)、整定しなければ (inf, 目標RPM)
+    """
+    if len(t) < 4:
+        return np.nan, np.nan
+    # Duty一定区間（変化点で区切る）のうち最長のもの
+    bounds = np.concatenate(([0], np.flatnonzero(np.abs(np.diff(duty)) > DUTY_STEP_MIN) + 1, [len(t)]))
+    lengths = t[bounds[1:] - 1] - t[bounds[:-1]]
+    j = int(np.argmax(lengths))
+    start, end = bounds[j], bounds[j + 1]
+    if end - start < 4:
+        return np.nan, np.nan
+
+    seg_t = t[start:end]
+    seg_rpm = rpm[start:end]
+    target = float(np.median(seg_rpm[len(seg_rpm) // 2:]))
+    band = max(abs(target) * SETTLE_BAND, SETTLE_BAND_MIN)
+    outside = np.flatnonzero(np.abs(seg_rpm - target) > band)
+    if len(outside) == 0:
+        return 0.0, target
+    last = outside[-1]
+    if last + 1 >= len(seg_t):
+        return np.inf, target
+    return float(seg_t[last + 1] - seg_t[0]), target
+
+
+def detect_anomalies(data, summary):
+    """
+    ログの異常（カタログ・一覧での絞り込み用）
+
+    - empty: サンプルなし
+    - missing_values: 空欄（取得できなかった値）がある
+    - time_reset: 時刻が戻っている（別のログが追記された等）
+    - gaps: サンプル間隔が大きく空いた（通信断・書き込み遅延）
+    - no_response: Duty変化に対して応答信号が動かなかった
+    - rpm_unsettled: Duty保持中にRPMが整定しなかった
+    """
+    if len(data) == 0:
+        return ["empty"]
+    found = []
+    if any(np.isnan(data[name]).any() for name in data.dtype.names):
+        found.append("missing_values")
+    t = _column(data, "time")
+    if t is not None and len(t) > 2:
+        dt = np.diff(t)
+        if (dt <= 0).any():
+            found.append("time_reset")
+        positive = dt[dt > 0]
+        if len(positive) and (positive > max(GAP_MIN, GAP_FACTOR * np.median(positive))).any():
+            found.append("gaps")
+    if summary["duty_steps"] > 0 and np.isnan(summary["step_response_median"]):
+        found.append("no_response")
+    if summary["rpm_settle_time"] == np.inf:
+        found.append("rpm_unsettled")
+    return found
+
+
+def summarize(data, name=""):
+    """
+    1セッション分の集計（SUMMARY_FIELDSの辞書）。ログにない列に依存する項目はNaN
+
+    - current_*_peak: 絶対値の最大、current_*_mean: 平均
+    - energy_j / energy_wh: v_in*current_in の時間積分
+    - duty_peak: Dutyの絶対値の最大
+    - step_response_*: Duty変化から応答（rpm、なければcurrent_motor）が変化幅の90%に達するまでの時間
+    - rpm_settle_time: 最長のDuty保持区間でRPMが±5%に整定するまでの時間
+    - anomalies: detect_anomalies() の結果をカンマ区切りで
+    """
+    summary = dict.fromkeys(SUMMARY_FIELDS, np.nan)
+    summary["file"] = name
+    summary["samples"] = len(data)
+    summary["duty_steps"] = 0
+    _summarize_values(data, summary)
+    summary["anomalies"] = ",".join(detect_anomalies(data, summary))
+    return summary
+
+
+def _summarize_values(data, summary):
+    t = _column(data, "time")
+    if t is None or len(data) == 0:
+        summary["duration"] = 0.0
+        return
+    summary["duration"] = float(np.nanmax(t) - np.nanmin(t))
+
+    for col in ("current_motor", "current_in"):
+        values = _column(data, col)
+        if values is not None and np.isfinite(values).any():
+            summary[f"{col}_peak"] = float(np.nanmax(np.abs(values)))
+            summary[f"{col}_mean"] = float(np.nanmean(values))
+
+    v_in = _column(data, "v_in")
+    current_in = _column(data, "current_in")
+    if v_in is not None and current_in is not None:
+        summary["energy_j"] = _energy(t, v_in, current_in)
+        summary["energy_wh"] = summary["energy_j"] / 3600.0
+
+    duty = _column(data, "duty")
+    if duty is None:
+        return
+    if np.isfinite(duty).any():
+        summary["duty_peak"] = float(np.nanmax(np.abs(duty)))
+    for col, threshold in RESPONSE_SIGNALS:
+        signal = _column(data, col)
+        if signal is None:
+            continue
+        steps, response = step_response_times(t, duty, signal, threshold)
+        summary["duty_steps"] = len(steps)
+        if len(response):
+            summary["step_response_median"] = float(np.median(response))
+            summary["step_response_max"] = float(np.max(response))
+        break
+
+    rpm = _column(data, "rpm")
+    if rpm is not None:
+        summary["rpm_settle_time"], summary["rpm_target"] = rpm_settle_time(t, duty, rpm)
+
+
+def find_logs(directory, patterns=LOG_PATTERNS):
+    """ディレクトリ内のセッションログ（ファイル名順）"""
+    paths = set()
+    for pattern in patterns:
+        paths.update(glob.glob(os.path.join(directory, pattern)))
+    return sorted(paths)
+
+
+def summarize_files(paths, verbose=True):
+    """
+    複数ファイルを集計（読めないファイルは飛ばす）
+
+    Returns:
+        集計辞書のリスト
+    """
+    summaries = []
+    for path in paths:
+        try:
+            data = load_session(path)
+        except (ValueError, OSError, RuntimeError, KeyError) as e:
+            if verbose:
+                print(f"[Analysis] Skipped: {e}")
+            continue
+        summaries.append(summarize(data, name=os.path.basename(path)))
+    return summaries
+
+
+def summarize_dir(directory, patterns=LOG_PATTERNS, verbose=True):
+    """ディレクトリ内のセッションログをすべて集計"""
+    return summarize_files(find_logs(directory, patterns), verbose=verbose)
+
+
+def summaries_to_array(summaries):
+    """集計結果を構造化配列に（セッション間の比較・ソート用）"""
+    kinds = {"file": "U128", "samples": "i8", "duty_steps": "i8", "anomalies": "U128"}
+    dtype = [(name, kinds.get(name, "f8")) for name in SUMMARY_FIELDS]
+    return np.array([tuple(s[name] for name in SUMMARY_FIELDS) for s in summaries], dtype=dtype)
+
+
+def write_summary_csv(summaries, path):
+    import csv
+
+    with open(path, mode="w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for s in summaries:
+            writer.writerow({k: (round(v, 6) if isinstance(v, float) else v) for k, v in s.items()})
+
+
+def _format_table(summaries):
+    columns = [
+        ("file", "{}"), ("samples", "{}"), ("duration", "{:.2f}"),
+        ("current_motor_peak", "{:.2f}"), ("current_motor_mean", "{:.2f}"),
+        ("current_in_peak", "{:.2f}"), ("energy_j", "{:.1f}"),
+        ("step_response_median", "{:.3f}"), ("rpm_settle_time", "{:.2f}"), ("anomalies", "{}"),
+    ]
+    rows = [[name for name, _ in columns]]
+    for s in summaries:
+        rows.append([fmt.format(s[name]) for name, fmt in columns])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join("  ".join(cell.rjust(w) for cell, w in zip(row, widths)) for row in rows)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="セッションログ（ディレクトリまたはファイル）を集計")
+    parser.add_argument("paths", nargs="+", help="ログファイルまたはディレクトリ")
+    parser.add_argument("--csv", help="集計結果をCSVに保存")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--cache", metavar="DIR", help="解析結果のキャッシュ（変更のないログは再解析しない）")
+    group.add_argument("--jobs", type=int, metavar="N", help="N個のプロセスで並列に集計（0でCPU数）")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    files = []
+    for p in args.paths:
+        files.extend(find_logs(p) if os.path.isdir(p) else [p])
+    cache = None
+    batch = None
+    if args.jobs is not None:
+        from src.analysis_batch import summarize_parallel
+
+        results, batch = summarize_parallel(files, workers=args.jobs or None)
+    elif args.cache:
+        from src.analysis_cache import AnalysisCache
+
+        cache = AnalysisCache(args.cache)
+        results = cache.summarize_files(files)
+        cache.save()
+    else:
+        results = summarize_files(files)
+    elapsed = time.perf_counter() - t0
+
+    print(_format_table(results))
+    print(f"[Analysis] {len(results)}/{len(files)} sessions in {elapsed:.2f}s")
+    if cache is not None:
+        print(cache.stats_line())
+    if batch is not None:
+        print(batch.stats_line())
+    if args.csv:
+        write_summary_csv(results, args.csv)
+        print(f"[Analysis] Saved: {args.csv}")
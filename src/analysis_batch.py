@@ -0,0 +1,117 @@
+# src/analysis_batch.py - セッションログの並列一括処理（ProcessPoolExecutor）
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from src.analysis import load_session, resample, summarize
+
+# ワーカー1プロセスが処理するチャンク数の上限（超えたら作り直してメモリを返す）
+MAX_TASKS_PER_CHILD = 32
+# 1チャンクのファイル数の上限
+MAX_CHUNK = 64
+
+
+def _process_chunk(paths, resample_dt):
+    """
+    ワーカープロセスで実行: 1ファイルずつ読んで集計（配列は返さず集計結果だけ返す）
+
+    Returns:
+        [(path, summary or None, error or None, rows, bytes), ...]
+    """
+    results = []
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            data = load_session(path)
+            rows = len(data)
+            if resample_dt is not None:
+                data = resample(data, resample_dt)
+            results.append((path, summarize(data, name=os.path.basename(path)), None, rows, size))
+        except (ValueError, OSError, RuntimeError, KeyError) as e:
+            results.append((path, None, str(e), 0, 0))
+        # 次のファイルを読む前に解放
+        data = None
+    return results
+
+
+class BatchStats:
+    """一括処理の件数と処理速度"""
+
+    def __init__(self, workers, chunksize):
+        self.workers = workers
+        self.chunksize = chunksize
+        self.files = 0
+        self.failed = 0
+        self.rows = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.elapsed = 0.0
+
+    def stats_line(self):
+        elapsed = self.elapsed or float("nan")
+        return (f"[Batch] {self.files - self.failed}/{self.files} files, {self.rows} rows, "
+                f"{self.bytes / 1e6:.1f}MB in {self.elapsed:.2f}s "
+                f"({self.files / elapsed:.0f} files/s, {self.rows / elapsed:.0f} rows/s, "
+                f"{self.bytes / 1e6 / elapsed:.1f}MB/s) workers={self.workers} chunk={self.chunksize}")
+
+
+def _make_executor(workers):
+    try:
+        return ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=MAX_TASKS_PER_CHILD)
+    except TypeError:
+        # Python 3.10以前はmax_tasks_per_childなし
+        return ProcessPoolExecutor(max_workers=workers)
+
+
+def summarize_parallel(paths, workers=None, chunksize=None, resample_dt=None, verbose=True):
+    """
+    analysis.summarize_files() の並列版（結果は入力と同じ順）
+
+    - ファイルをchunksize個ずつまとめてワーカーに渡す（プロセス間通信の回数を減らす）
+    - 同時に投入するチャンクはworkers*2個まで（未処理のパス・結果を溜め込まない）
+    - ワーカーはMAX_TASKS_PER_CHILDチャンクごとに作り直す
+
+    Args:
+        workers: プロセス数（省略時はCPU数）
+        chunksize: 1チャンクのファイル数（省略時はファイル数とプロセス数から決める）
+        resample_dt: 指定すると等間隔（秒）に補間してから集計
+
+    Returns:
+        (集計辞書のリスト, BatchStats)
+    """
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(MAX_CHUNK, len(paths) // (workers * 4)))
+    stats = BatchStats(workers, chunksize)
+    chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+    results = [None] * len(chunks)
+
+    t0 = time.perf_counter()
+    with _make_executor(workers) as pool:
+        pending = {}
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < workers * 2:
+                future = pool.submit(_process_chunk, chunks[next_chunk], resample_dt)
+                pending[future] = next_chunk
+                next_chunk += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+                stats.chunks += 1
+    stats.elapsed = time.perf_counter() - t0
+
+    summaries = []
+    for chunk in results:
+        for path, summary, error, rows, size in chunk:
+            stats.files += 1
+            if summary is None:
+                stats.failed += 1
+                if verbose:
+                    print(f"[Analysis] Skipped: {error}")
+                continue
+            stats.rows += rows
+            stats.bytes += size
+            summaries.append(summary)
+    return summaries, stats
@@ -0,0 +1,212 @@
+# src/analysis_cache.py - 解析結果のキャッシュ（変更のないセッションログは再解析しない）
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from src.analysis import ANALYSIS_VERSION, load_session, summarize
+
+INDEX_NAME = "index.json"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# check="hash" のときに読む単位
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_hash(path):
+    """ファイル内容のハッシュ（mtimeが当てにならないコピー後の照合用）"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """
+    セッションログごとの解析結果（読み込んだ配列・集計）をディレクトリに保存する
+
+    - キー: ログの絶対パス。パス + サイズ + mtime が一致すればキャッシュを使う
+      （check="hash" なら、サイズ/mtimeが違っても内容のハッシュが同じなら再利用）
+    - ANALYSIS_VERSION が変わったら（集計方法の変更）全件作り直し
+    - 合計サイズがmax_bytesを超えたら、最後に使ってから長いものから削除
+
+    使い方:
+        cache = AnalysisCache("log/.analysis_cache")
+        summaries = cache.summarize_files(paths)
+        cache.save()
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, check="stat"):
+        if check not in ("stat", "hash"):
+            raise ValueError(f"Unknown check: {check!r} (expected 'stat' or 'hash')")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.check = check
+        self.hit_count = 0
+        self.miss_count = 0
+        self.evict_count = 0
+        self._dirty = False
+        os.makedirs(cache_dir, exist_ok=True)
+        self._entries = self._read_index()
+
+    # ---------- インデックス ----------
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, INDEX_NAME)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path(), encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[Cache] Index unreadable, rebuilding: {e}")
+            return {}
+        if index.get("version") != ANALYSIS_VERSION:
+            print(f"[Cache] Analysis version changed ({index.get('version')} -> {ANALYSIS_VERSION}), rebuilding")
+            for entry in index.get("entries", {}).values():
+                self._remove_file(entry)
+            self._dirty = True
+            return {}
+        return index.get("entries", {})
+
+    def save(self):
+        """インデックスを書き出す（一時ファイルに書いてから置き換え）"""
+        if not self._dirty:
+            return
+        tmp = self._index_path() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": ANALYSIS_VERSION, "entries": self._entries}, f)
+        os.replace(tmp, self._index_path())
+        self._dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+
+    # ---------- 照合 ----------
+
+    @staticmethod
+    def _key(path):
+        return hashlib.sha1(path.encode("utf-8")).hexdigest()[:20]
+
+    def _array_path(self, entry):
+        return os.path.join(self.cache_dir, entry["key"] + ".npy")
+
+    def _remove_file(self, entry):
+        try:
+            os.remove(self._array_path(entry))
+        except OSError:
+            pass
+
+    def _lookup(self, path):
+        """
+        有効なキャッシュエントリを返す（なければNone）
+
+        Returns:
+            (絶対パス, os.stat結果, エントリ or None)
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self._entries.get(path)
+        if entry is None:
+            return path, st, None
+        if entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            return path, st, entry
+        if self.check == "hash" and entry.get("hash") == file_hash(path):
+            entry["size"] = st.st_size
+            entry["mtime_ns"] = st.st_mtime_ns
+            self._dirty = True
+            return path, st, entry
+        # 変更されたので作り直す
+        self._remove_file(entry)
+        del self._entries[path]
+        self._dirty = True
+        return path, st, None
+
+    def _store(self, path, st, data):
+        entry = {
+            "key": self._key(path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "hash": file_hash(path) if self.check == "hash" else None,
+            "summary": summarize(data, name=os.path.basename(path)),
+            "last_used": time.time(),
+        }
+        array_path = self._array_path(entry)
+        np.save(array_path, data, allow_pickle=False)
+        entry["bytes"] = os.path.getsize(array_path)
+        self._entries[path] = entry
+        self._dirty = True
+        self._evict(keep=path)
+        return entry
+
+    def _touch(self, entry):
+        entry["last_used"] = time.time()
+        self._dirty = True
+
+    def _evict(self, keep=None):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        for path, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self._remove_file(entry)
+            del self._entries[path]
+            total -= entry["bytes"]
+            self.evict_count += 1
+
+    # ---------- API ----------
+
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self._entries.values())
+
+    def load(self, path):
+        """load_session() のキャッシュ付き版"""
+        path, st, entry = self._lookup(path)
+        if entry is not None:
+            try:
+                data = np.load(self._array_path(entry), allow_pickle=False)
+                self.hit_count += 1
+                self._touch(entry)
+                return data
+            except (OSError, ValueError):
+                # 配列ファイルが消えている・壊れている場合は読み直す
+                pass
+        self.miss_count += 1
+        data = load_session(path)
+        self._store(path, st, data)
+        return data
+
+    def summary(self, path):
+        """summarize(load_session(path)) のキャッシュ付き版（配列ファイルは読まない）"""
+        path, st, entry = self._lookup(path)
+        if entry is not None:
+            self.hit_count += 1
+            self._touch(entry)
+            return entry["summary"]
+        self.miss_count += 1
+        return self._store(path, st, load_session(path))["summary"]
+
+    def summarize_files(self, paths, verbose=True):
+        """analysis.summarize_files() と同じ（新規・変更されたファイルだけ解析）"""
+        summaries = []
+        for path in paths:
+            try:
+                summaries.append(self.summary(path))
+            except (ValueError, OSError, RuntimeError, KeyError) as e:
+                if verbose:
+                    print(f"[Analysis] Skipped: {e}")
+        return summaries
+
+    def stats_line(self):
+        return (f"[Cache] hits={self.hit_count} misses={self.miss_count} evicted={self.evict_count} "
+                f"entries={len(self._entries)} size={self.total_bytes() / 1024:.0f}KiB")
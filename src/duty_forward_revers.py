@@ -1,31 +1,60 @@
 # src/duty_forward_revers.py - ランプダウン削除版
 import time
 import threading
-from pyvesc.messages.setters import SetDutyCycle, SetCurrent
-from pyvesc.interface import encode
+from src.metrics import TimedLock, collect_lock_metrics
+from src.vesc_codec import CURRENT_ZERO_FRAME, DutyFrameTable, encode_current
+from src.transport import PRIO_COMMAND, PRIO_STOP
 
 
 class VESCDutyController:
-    def __init__(self, ser, max_duty=10, step_delay=0.05, serial_lock=None):
+    def __init__(self, ser, max_duty=10, step_delay=0.05, serial_lock=None, transport=None):
+        """
+        transport: SerialTransportを渡すとserial_lockを使わずに送信キュー経由で送る
+        """
         self.ser = ser
+        self._transport = transport
         self.max_duty = max_duty
         self.step_delay = step_delay
         self._lock = threading.Lock()
-        # シリアルポート排他制御用（Readerと共有）
-        self._serial_lock = serial_lock if serial_lock else threading.Lock()
+        # Duty指令フレームの事前エンコード表（0.1%刻み）
+        self._duty_frames = DutyFrameTable(max_duty)
+        # シリアルポート排他制御用（Readerと共有、待ち時間を計測）
+        self._serial_lock = TimedLock(serial_lock)
+
+        # 統計（メトリクス用）
+        self.duty_count = 0
+        self.current_count = 0
+        self.last_duty = 0.0
     
-    def _send_duty(self, duty):
+    def _write(self, frame, priority):
+        """フレーム送信（transport経由 or serial_lockで直接）"""
+        if self._transport is not None:
+            self._transport.send(frame, priority)
+        else:
+            with self._serial_lock:
+                self.ser.write(frame)
+
+    def _clear_buffers(self):
+        """送受信バッファクリア（transport使用時は未送信の指令のみ破棄）"""
+        if self._transport is not None:
+            self._transport.discard_pending()
+        else:
+            with self._serial_lock:
+                self.ser.reset_input_buffer()
+                self.ser.reset_output_buffer()
+
+    def _send_duty(self, duty, priority=PRIO_COMMAND):
         """Duty指令を送信"""
         duty = max(-100.0, min(100.0, duty))
-        duty_int = int(duty * 1000)
-        with self._serial_lock:
-            self.ser.write(encode(SetDutyCycle(duty_int)))
+        self._write(self._duty_frames.frame(duty), priority)
+        self.duty_count += 1
+        self.last_duty = duty
     
-    def _send_current(self, current):
+    def _send_current(self, current, priority=PRIO_STOP):
         """電流指令を送信（単位：A）"""
-        current_mA = int(current * 1000)
-        with self._serial_lock:
-            self.ser.write(encode(SetCurrent(current_mA)))
+        frame = CURRENT_ZERO_FRAME if current == 0 else encode_current(current)
+        self._write(frame, priority)
+        self.current_count += 1
     
     def set_duty(self, duty):
         """Duty値を直接設定（manual制御用）"""
@@ -72,7 +101,7 @@ class VESCDutyController:
             # ===== ランプダウン完了後、即座に完全停止 =====
             print("Stopping immediately...")
             for _ in range(10):
-                self._send_duty(0)
+                self._send_duty(0, PRIO_STOP)
                 time.sleep(0.01)
             
             # 完全停止処理
@@ -88,14 +117,12 @@ class VESCDutyController:
         # ステップ1: 即座にDuty=0を連続送信
         print("[STOP] Sending Duty=0...")
         for _ in range(30):
-            self._send_duty(0)
+            self._send_duty(0, PRIO_STOP)
             time.sleep(0.005)
         
         # ステップ2: バッファクリア
         print("[STOP] Clearing buffers...")
-        with self._serial_lock:
-            self.ser.reset_input_buffer()
-            self.ser.reset_output_buffer()
+        self._clear_buffers()
         time.sleep(0.1)
         
         # ステップ3: 電流制御モード(0A)に強制切替
@@ -105,15 +132,13 @@ class VESCDutyController:
             time.sleep(0.02)
         
         # ステップ4: バッファ再クリア
-        with self._serial_lock:
-            self.ser.reset_input_buffer()
-            self.ser.reset_output_buffer()
+        self._clear_buffers()
         time.sleep(0.1)
         
         # ステップ5: 再度Duty=0を連続送信
         print("[STOP] Re-sending Duty=0...")
         for _ in range(30):
-            self._send_duty(0)
+            self._send_duty(0, PRIO_STOP)
             time.sleep(0.005)
         
         # ステップ6: 電流制御モード(0A)で完全固定
@@ -123,9 +148,7 @@ class VESCDutyController:
             time.sleep(0.02)
         
         # ステップ7: 最終バッファクリア
-        with self._serial_lock:
-            self.ser.reset_input_buffer()
-            self.ser.reset_output_buffer()
+        self._clear_buffers()
         
         # ステップ8: 長時間待機（VESCの完全安定化）
         print("[STOP] Waiting for VESC stabilization...")
@@ -144,9 +167,17 @@ class VESCDutyController:
             print("EMERGENCY STOP")
             self._complete_stop()
 
+    def collect_metrics(self, w):
+        """MetricsServerから呼ばれる（レートはPrometheus側でrate(vesc_commands_total[1m])）"""
+        w.counter("vesc_commands_total", "Command frames sent", self.duty_count, kind="duty")
+        w.counter("vesc_commands_total", "Command frames sent", self.current_count, kind="current")
+        w.gauge("vesc_command_duty_percent", "Last duty command (%)", self.last_duty)
+        if self._transport is None:
+            collect_lock_metrics(w, self._serial_lock, "controller")
+
 
 if __name__ == "__main__":
-    # テスト用
+    # テスト用（python -m src.duty_forward_revers で実行）
     import serial
     ser = serial.Serial("/dev/serial0", 115200, timeout=0.1)
     duty = VESCDutyController(ser, max_duty=10, step_delay=0.05)
@@ -0,0 +1,329 @@
+# src/log_index.py - セッションログの時刻インデックス（指定区間だけを読む）
+import bisect
+import json
+import math
+import os
+import struct
+
+from src.session_log import BINLOG_MAGIC, open_log, strip_log_extension
+
+INDEX_MAGIC = b"TSIDX1\n"
+INDEX_EXT = ".tsidx"
+INDEX_VERSION = 1
+# インデックスの間隔（秒）
+DEFAULT_INTERVAL = 5.0
+_HEADER_LEN = struct.Struct("<I")
+# (時刻, 先頭からのバイト位置)
+_ENTRY = struct.Struct("<dQ")
+_SKIP_CHUNK = 1024 * 1024
+
+
+def index_path(path):
+    """ログに対応するインデックスのファイル（manual_..._p002.csv → manual_..._p002.tsidx）"""
+    return strip_log_extension(path) + INDEX_EXT
+
+
+class LogIndex:
+    """
+    interval秒ごとに、その区間の最初の行のバイト位置を持つ疎なインデックス
+
+    バイト位置は展開後のデータの位置（圧縮ログは先頭から展開して読み飛ばすが、
+    行の解析はしないので全体を読むよりずっと速い）。
+    """
+
+    def __init__(self, header, entries):
+        self.header = header
+        self.entries = entries
+        self._times = [t for t, _ in entries]
+
+    @property
+    def interval(self):
+        return self.header["interval"]
+
+    def offset_for(self, t0):
+        """t0以前で最も近いインデックス位置（t0がどこにあっても、そこから読めば取りこぼさない）"""
+        i = bisect.bisect_right(self._times, t0) - 1
+        if i < 0:
+            return self.header["data_offset"]
+        return self.entries[i][1]
+
+    def is_current(self, path):
+        """元のログが変わっていないか"""
+        st = os.stat(path)
+        return (self.header["source_size"] == st.st_size
+                and self.header["source_mtime_ns"] == st.st_mtime_ns)
+
+    def save(self, dst):
+        header = json.dumps(self.header).encode("utf-8")
+        tmp = dst + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(INDEX_MAGIC + _HEADER_LEN.pack(len(header)) + header)
+            f.write(b"".join(_ENTRY.pack(t, offset) for t, offset in self.entries))
+        os.replace(tmp, dst)
+
+    @classmethod
+    def load(cls, src):
+        with open(src, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError(f"{src}: not a log index")
+            (length,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+            header = json.loads(f.read(length).decode("utf-8"))
+            body = f.read()
+        usable = len(body) - len(body) % _ENTRY.size
+        return cls(header, list(_ENTRY.iter_unpack(body[:usable])))
+
+
+class _Marker:
+    """interval秒の境界を越えた最初の行を記録"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.entries = []
+        self.rows = 0
+        self.monotonic = True
+        self._next = None
+        self._last = None
+
+    def add(self, t, offset):
+        if self._last is not None and t < self._last:
+            # 時刻が戻った（別のログが追記された等）: 区間読み出しは全体を走査する
+            self.monotonic = False
+        self._last = t if self._last is None else max(self._last, t)
+        if self._next is None or t >= self._next:
+            self.entries.append((t, offset))
+            self._next = (math.floor(t / self.interval) + 1) * self.interval
+        self.rows += 1
+
+
+def _scan_csv(f, marker):
+    header = f.readline()
+    names = header.decode("utf-8").strip().split(",")
+    if "time" not in names:
+        raise ValueError(f"no time column (header={header[:40]!r})")
+    col = names.index("time")
+    offset = len(header)
+    data_offset = offset
+    for line in f:
+        if not line.endswith(b"\n"):
+            break  # 書きかけの末尾行
+        try:
+            t = float(line.split(b",", col + 1)[col])
+        except (ValueError, IndexError):
+            offset += len(line)
+            continue
+        marker.add(t, offset)
+        offset += len(line)
+    return "csv", data_offset, names
+
+
+def _binlog_header(f):
+    """バイナリログのヘッダとレコード先頭のバイト位置"""
+    if f.read(len(BINLOG_MAGIC)) != BINLOG_MAGIC:
+        raise ValueError("not a binary session log")
+    (length,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+    header = json.loads(f.read(length).decode("utf-8"))
+    return header, len(BINLOG_MAGIC) + _HEADER_LEN.size + length
+
+
+def _is_binlog(path):
+    with open_log(path, "rb") as f:
+        return f.read(len(BINLOG_MAGIC)) == BINLOG_MAGIC
+
+
+def _scan_binlog(f, marker):
+    header, data_offset = _binlog_header(f)
+    size = header["record_size"]
+    time_unit = header["time_unit"]
+    ticks = struct.Struct("<i")
+    offset = data_offset
+    while True:
+        chunk = f.read(size * 4096)
+        usable = len(chunk) - len(chunk) % size
+        for pos in range(0, usable, size):
+            marker.add(round(ticks.unpack_from(chunk, pos)[0] * time_unit, 3), offset + pos)
+        offset += usable
+        if usable < size * 4096:
+            break
+    return "bin", data_offset, header["csv_fields"]
+
+
+def build_index(path, interval=DEFAULT_INTERVAL):
+    """
+    ログを1回走査してインデックスを作り、ログと同じ場所に保存する
+
+    Returns:
+        LogIndex
+    """
+    st = os.stat(path)
+    marker = _Marker(interval)
+    binary = _is_binlog(path)
+    with open_log(path, "rb") as f:
+        if binary:
+            fmt, data_offset, fields = _scan_binlog(f, marker)
+        else:
+            fmt, data_offset, fields = _scan_csv(f, marker)
+    header = {
+        "version": INDEX_VERSION,
+        "format": fmt,
+        "interval": interval,
+        "fields": fields,
+        "data_offset": data_offset,
+        "rows": marker.rows,
+        "monotonic": marker.monotonic,
+        "source_size": st.st_size,
+        "source_mtime_ns": st.st_mtime_ns,
+    }
+    index = LogIndex(header, marker.entries)
+    index.save(index_path(path))
+    return index
+
+
+def open_index(path, build=True, interval=DEFAULT_INTERVAL):
+    """
+    ログのインデックスを読む（ない・古い場合はbuild=Trueなら作り直す、FalseならNone）
+    """
+    try:
+        index = LogIndex.load(index_path(path))
+        if index.header.get("version") == INDEX_VERSION and index.is_current(path):
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_index(path, interval) if build else None
+
+
+def _skip(f, target, pos):
+    """posバイト目からtargetバイト目まで進む（圧縮ログは展開して読み捨てる）"""
+    if f.seekable():
+        f.seek(target)
+        return
+    n = target - pos
+    while n > 0:
+        chunk = f.read(min(n, _SKIP_CHUNK))
+        if not chunk:
+            break
+        n -= len(chunk)
+
+
+def _start_offset(index, t0):
+    if t0 is None or not index.header["monotonic"]:
+        return index.header["data_offset"]
+    return index.offset_for(t0)
+
+
+def iter_csv_window(path, t0=None, t1=None, index=None):
+    """
+    CSVログの [t0, t1] の行をそのまま（bytes）返す。最初にヘッダ行を返す
+
+    インデックスの位置までシークしてから読み、t1を過ぎたら止める。
+    """
+    index = index or open_index(path)
+    if index.header["format"] != "csv":
+        raise ValueError(f"{path}: not a CSV log")
+    col = index.header["fields"].index("time")
+    monotonic = index.header["monotonic"]
+    with open_log(path, "rb") as f:
+        header = f.readline()
+        yield header
+        _skip(f, _start_offset(index, t0), len(header))
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                t = float(line.split(b",", col + 1)[col])
+            except (ValueError, IndexError):
+                continue
+            if t0 is not None and t < t0:
+                continue
+            if t1 is not None and t > t1:
+                if monotonic:
+                    break
+                continue
+            yield line
+
+
+def read_binlog_window(path, t0=None, t1=None, index=None):
+    """
+    バイナリログの [t0, t1] のレコード
+
+    Returns:
+        (ヘッダ, 連続したレコードのbytes)
+    """
+    index = index or open_index(path)
+    if index.header["format"] != "bin":
+        raise ValueError(f"{path}: not a binary log")
+    with open_log(path, "rb") as f:
+        header, data_offset = _binlog_header(f)
+        record = struct.Struct(header["record_format"])
+        _skip(f, _start_offset(index, t0), data_offset)
+        ticks = struct.Struct("<i")
+        out = []
+        while True:
+            chunk = f.read(record.size * 4096)
+            usable = len(chunk) - len(chunk) % record.size
+            done = False
+            for pos in range(0, usable, record.size):
+                t = round(ticks.unpack_from(chunk, pos)[0] * header["time_unit"], 3)
+                if t0 is not None and t < t0:
+                    continue
+                if t1 is not None and t > t1:
+                    if index.header["monotonic"]:
+                        done = True
+                        break
+                    continue
+                out.append(chunk[pos:pos + record.size])
+            if done or usable < record.size * 4096:
+                break
+    return header, b"".join(out)
+
+
+def read_window(path, t0=None, t1=None, index=None):
+    """
+    ログ（CSV / .tslog、圧縮可）の [t0, t1] の行を順に返す
+
+    Yields:
+        {列名: 値} の辞書（CSVの空欄はNone）。時刻の単位・桁はCSVと同じ
+    """
+    index = index or open_index(path)
+    if index.header["format"] == "csv":
+        lines = iter_csv_window(path, t0, t1, index)
+        names = next(lines).decode("utf-8").strip().split(",")
+        for line in lines:
+            values = line.decode("utf-8").rstrip("\r\n").split(",")
+            yield {name: (float(v) if v else None) for name, v in zip(names, values)}
+        return
+
+    header, body = read_binlog_window(path, t0, t1, index)
+    record = struct.Struct(header["record_format"])
+    fields = header["fields"]
+    for values in record.iter_unpack(body):
+        row = {"time": round(values[0] * header["time_unit"], 3)}
+        for field, value in zip(fields, values[1:]):
+            row[field["name"]] = value if field["divisor"] is None else value / field["divisor"]
+        yield row
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description="セッションログの時刻インデックス作成・区間の読み出し")
+    parser.add_argument("files", nargs="+", help="ログファイル")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="インデックス間隔（秒）")
+    parser.add_argument("--window", type=float, nargs=2, metavar=("T0", "T1"),
+                        help="[T0, T1]秒の行をCSVで出力（インデックスがなければ作る）")
+    args = parser.parse_args()
+
+    for path in args.files:
+        if args.window:
+            index = open_index(path, interval=args.interval)
+            writer = csv.DictWriter(sys.stdout, fieldnames=index.header["fields"])
+            writer.writeheader()
+            for row in read_window(path, *args.window, index=index):
+                writer.writerow(row)
+        else:
+            t_start = time.perf_counter()
+            index = build_index(path, args.interval)
+            print(f"{path} -> {index_path(path)} ({index.header['rows']} rows, "
+                  f"{len(index.entries)} entries, {time.perf_counter() - t_start:.2f}s)")
@@ -0,0 +1,245 @@
+# src/log_pyramid.py - 長いログの概観用ピラミッド（時間区間ごとのmin/max/mean）
+import json
+import os
+
+import numpy as np
+
+from src.analysis import drop_time_resets, find_logs, load_session, load_window
+from src.session_log import strip_log_extension
+
+PYRAMID_EXT = ".pyr.npz"
+# 区間の長さ（秒）
+DEFAULT_LEVELS = (1.0, 10.0, 60.0)
+PYRAMID_VERSION = 1
+
+
+def pyramid_path(path):
+    """ログに対応するピラミッドのファイル（manual_..._p002.csv → manual_..._p002.pyr.npz）"""
+    return strip_log_extension(path) + PYRAMID_EXT
+
+
+def _level_dtype(columns):
+    fields = [("time", "f8"), ("count", "i4")]
+    for col in columns:
+        fields += [(f"{col}_min", "f8"), (f"{col}_max", "f8"), (f"{col}_mean", "f8")]
+    return np.dtype(fields)
+
+
+def _level_key(seconds):
+    return f"level_{seconds:g}"
+
+
+def downsample(data, seconds, t0=None):
+    """
+    seconds秒ごとの区間で各列のmin/max/meanをとる（空欄は除いて計算）
+
+    Returns:
+        構造化配列（time = 区間の開始時刻, count = 区間の行数, {列}_min/_max/_mean）
+    """
+    columns = [name for name in data.dtype.names if name != "time"]
+    data = drop_time_resets(data)
+    if len(data) == 0:
+        return np.empty(0, dtype=_level_dtype(columns))
+    t = data["time"]
+    t0 = t[0] if t0 is None else t0
+    bucket = np.floor((t - t0) / seconds).astype(np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(bucket) != 0)))
+
+    out = np.empty(len(starts), dtype=_level_dtype(columns))
+    out["time"] = t0 + bucket[starts] * seconds
+    out["count"] = np.diff(np.append(starts, len(t)))
+    for col in columns:
+        values = data[col]
+        finite = np.isfinite(values)
+        n = np.add.reduceat(finite.astype(np.int64), starts)
+        total = np.add.reduceat(np.where(finite, values, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[f"{col}_mean"] = np.where(n > 0, total / n, np.nan)
+        out[f"{col}_min"] = np.fmin.reduceat(values, starts)
+        out[f"{col}_max"] = np.fmax.reduceat(values, starts)
+    return out
+
+
+def build_pyramid(path, levels=DEFAULT_LEVELS, data=None):
+    """
+    ログを読んでピラミッドを作り、ログと同じ場所に保存する
+
+    Args:
+        data: 読み込み済みの配列（省略時はload_session(path)）
+
+    Returns:
+        保存したファイルのパス
+    """
+    st = os.stat(path)
+    if data is None:
+        data = load_session(path)
+    levels = sorted(float(level) for level in levels)
+    t = drop_time_resets(data)["time"]
+    meta = {
+        "version": PYRAMID_VERSION,
+        "levels": levels,
+        "columns": [name for name in data.dtype.names if name != "time"],
+        "source_size": st.st_size,
+        "source_mtime_ns": st.st_mtime_ns,
+        "rows": len(data),
+        "t0": float(t[0]) if len(t) else None,
+        "t1": float(t[-1]) if len(t) else None,
+    }
+    arrays = {_level_key(level): downsample(data, level, meta["t0"]) for level in levels}
+    dst = pyramid_path(path)
+    # 途中で止まっても壊れたファイルが残らないよう一時ファイルから置き換え
+    tmp = dst + ".tmp.npz"
+    np.savez(tmp, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp, dst)
+    return dst
+
+
+class PyramidReader:
+    """
+    ピラミッドから表示幅に合った解像度のデータを読む
+
+    read(t0, t1, width) は区間がwidth個以上になる範囲で最も粗いレベルを選び、
+    そのレベルの配列だけを読み込む（npzは配列ごとに遅延読み込み）。
+    どのレベルでも粗すぎる（短い範囲を拡大した）ときだけ元のログを
+    時刻インデックス（src.log_index）で範囲の行だけ読む。
+
+    使い方:
+        reader = PyramidReader("manual_20261017_101530.csv")
+        level, rows = reader.read(0, 3600, width=1200, columns=["rpm", "current_motor"])
+        rows["time"], rows["rpm_min"], rows["rpm_max"], rows["rpm_mean"]
+    """
+
+    def __init__(self, path, build=True, levels=DEFAULT_LEVELS):
+        """
+        Args:
+            build: ピラミッドがない・元のログより古いときに作り直す（Falseなら元のログだけで読む）
+        """
+        self.path = path
+        self.pyramid_file = pyramid_path(path)
+        self._npz = None
+        self._cache = {}
+        self.meta = self._open(build, levels)
+
+    def _open(self, build, levels):
+        meta = self._load_meta()
+        if meta is None and build:
+            build_pyramid(self.path, levels)
+            meta = self._load_meta()
+        return meta
+
+    def _load_meta(self):
+        self.close()
+        try:
+            npz = np.load(self.pyramid_file, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        meta = json.loads(str(npz["meta"]))
+        st = os.stat(self.path)
+        if (meta.get("version") != PYRAMID_VERSION or meta["source_size"] != st.st_size
+                or meta["source_mtime_ns"] != st.st_mtime_ns):
+            npz.close()
+            return None
+        self._npz = npz
+        return meta
+
+    def close(self):
+        if self._npz is not None:
+            self._npz.close()
+            self._npz = None
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def levels(self):
+        return self.meta["levels"] if self.meta else []
+
+    def choose_level(self, t0, t1, width):
+        """区間数がwidth以上になる最も粗いレベル（秒）。なければ0（元のログ）"""
+        span = t1 - t0
+        chosen = 0.0
+        for level in self.levels:
+            if span / level >= width:
+                chosen = level
+        return chosen
+
+    def level(self, seconds):
+        """1レベル分の配列（初回だけnpzから読む）"""
+        if seconds not in self._cache:
+            self._cache[seconds] = self._npz[_level_key(seconds)]
+        return self._cache[seconds]
+
+    def _raw(self, columns=None, t0=None, t1=None):
+        """元のログ（[t0, t1]の範囲だけ）をピラミッドと同じ形（min = max = mean）にする"""
+        data = drop_time_resets(load_window(self.path, t0, t1))
+        if columns is None:
+            columns = [name for name in data.dtype.names if name != "time"]
+        out = np.empty(len(data), dtype=_level_dtype(columns))
+        out["time"] = data["time"]
+        out["count"] = 1
+        for col in columns:
+            for stat in ("min", "max", "mean"):
+                out[f"{col}_{stat}"] = data[col]
+        return out
+
+    def read(self, t0=None, t1=None, width=1000, columns=None):
+        """
+        時間範囲 [t0, t1) を表示幅width（ピクセル数）で読む
+
+        Returns:
+            (使ったレベルの秒数（0 = 元のログ）, 構造化配列)
+            レベル > 0 なら time は区間の開始時刻（t0を含む区間から）
+        """
+        level = 0.0
+        if self.meta is not None and self.meta["t0"] is not None:
+            span_t0 = self.meta["t0"] if t0 is None else t0
+            span_t1 = self.meta["t1"] if t1 is None else t1
+            level = self.choose_level(span_t0, span_t1, width)
+        if level:
+            data = self.level(level)
+            if columns is not None:
+                data = data[["time", "count"] + [f"{c}_{s}" for c in columns for s in ("min", "max", "mean")]]
+        else:
+            # 拡大表示: 時刻インデックスで範囲の行だけ読む
+            data = self._raw(columns, t0, t1)
+
+        t = data["time"]
+        lo = 0
+        if t0 is not None:
+            # 粗いレベルではt0を含む区間から
+            lo = max(0, np.searchsorted(t, t0, side="right") - 1) if level else np.searchsorted(t, t0)
+        hi = len(t) if t1 is None else np.searchsorted(t, t1)
+        return level, data[lo:hi]
+
+
+def build_pyramids(paths, levels=DEFAULT_LEVELS):
+    """複数のログのピラミッドを作る（読めないログは飛ばす）"""
+    built = []
+    for path in paths:
+        try:
+            built.append(build_pyramid(path, levels))
+        except (ValueError, OSError, RuntimeError, KeyError) as e:
+            print(f"[Pyramid] Skipped: {e}")
+    return built
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="セッションログの概観用ピラミッド（min/max/mean）を作る")
+    parser.add_argument("paths", nargs="+", help="ログファイルまたはディレクトリ")
+    parser.add_argument("--levels", type=float, nargs="+", default=list(DEFAULT_LEVELS),
+                        help="区間の長さ（秒）")
+    args = parser.parse_args()
+
+    files = []
+    for p in args.paths:
+        files.extend(find_logs(p) if os.path.isdir(p) else [p])
+    t_start = time.perf_counter()
+    built = build_pyramids(files, args.levels)
+    print(f"[Pyramid] {len(built)}/{len(files)} built in {time.perf_counter() - t_start:.2f}s")
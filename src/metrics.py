@@ -0,0 +1,204 @@
+# src/metrics.py - Prometheus形式のメトリクスをHTTPで公開（実行中の劣化を見るため）
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# RTTヒストグラムのバケット（秒）
+RTT_BUCKETS = (0.0005, 0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.1)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    累積ヒストグラム（observe()はバケット1つを加算するだけ）
+
+    書き込みは1スレッドから行う前提（読み取り側は多少ずれた値でも問題ない）
+    """
+
+    def __init__(self, buckets=RTT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class TimedLock:
+    """
+    ロック取得待ち時間を計測するラッパー（with文で使う）
+
+    Reader/DutyControllerが同じserial_lockをそれぞれTimedLockで包めば、
+    誰がどれだけ待たされたかを別々に計測できる。
+    """
+
+    def __init__(self, lock=None):
+        self.lock = lock if lock is not None else threading.Lock()
+        self.acquire_count = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+
+    def __enter__(self):
+        t0 = time.monotonic()
+        self.lock.acquire()
+        wait = time.monotonic() - t0
+        self.acquire_count += 1
+        self.wait_sum += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+class MetricsWriter:
+    """Prometheusテキスト形式の組み立て（HELP/TYPEは名前ごとに1回だけ出力）"""
+
+    def __init__(self):
+        self._lines = []
+        self._declared = set()
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._declared:
+            self._declared.add(name)
+            self._lines.append(f"# HELP {name} {help_text}")
+            self._lines.append(f"# TYPE {name} {kind}")
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        inner = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+        return "{" + inner + "}"
+
+    def counter(self, name, help_text, value, **labels):
+        self._declare(name, "counter", help_text)
+        self._lines.append(f"{name}{self._labels(labels)} {value}")
+
+    def gauge(self, name, help_text, value, **labels):
+        self._declare(name, "gauge", help_text)
+        self._lines.append(f"{name}{self._labels(labels)} {value}")
+
+    def histogram(self, name, help_text, hist, **labels):
+        self._declare(name, "histogram", help_text)
+        cumulative = 0
+        for bound, n in zip(hist.buckets, hist.counts):
+            cumulative += n
+            self._lines.append(f"{name}_bucket{self._labels(dict(labels, le=bound))} {cumulative}")
+        cumulative += hist.counts[-1]
+        self._lines.append(f"{name}_bucket{self._labels(dict(labels, le='+Inf'))} {cumulative}")
+        self._lines.append(f"{name}_sum{self._labels(labels)} {hist.sum}")
+        self._lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+
+    def text(self):
+        return "\n".join(self._lines) + "\n"
+
+
+def collect_rx_metrics(w, rx, **labels):
+    """受信デコーダ（FrameDecoder）の統計"""
+    w.counter("vesc_rx_packets_total", "Frames decoded with a valid CRC", rx.packet_count, **labels)
+    w.counter("vesc_rx_crc_failures_total", "Frames dropped because of a CRC mismatch",
+              rx.crc_fail_count, **labels)
+    w.counter("vesc_rx_skipped_bytes_total", "Bytes skipped while resynchronising to a frame start",
+              rx.skipped_bytes, **labels)
+    w.counter("vesc_rx_overflow_total", "Receive buffer overflows", rx.overflow_count, **labels)
+    w.counter("vesc_rx_discarded_bytes_total", "Bytes dropped on receive buffer overflow",
+              rx.discarded_bytes, **labels)
+
+
+def collect_lock_metrics(w, lock, owner):
+    """TimedLockの待ち時間"""
+    w.counter("vesc_serial_lock_acquisitions_total", "Serial lock acquisitions",
+              lock.acquire_count, owner=owner)
+    w.counter("vesc_serial_lock_wait_seconds_total", "Time spent waiting for the serial lock",
+              lock.wait_sum, owner=owner)
+    w.gauge("vesc_serial_lock_wait_max_seconds", "Longest wait for the serial lock",
+            lock.wait_max, owner=owner)
+
+
+class MetricsServer:
+    """
+    /metrics をPrometheus形式で返すHTTPサーバ（別スレッド）
+
+    登録したオブジェクトの collect_metrics(w) をリクエストごとに呼ぶだけなので、
+    取得ループ側のコストはカウンタの加算のみ。
+
+    使い方:
+        metrics = MetricsServer(port=9101)
+        metrics.register(reader)
+        metrics.start()
+        ... curl http://127.0.0.1:9101/metrics ...
+        metrics.stop()
+    """
+
+    def __init__(self, port=9101, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self._collectors = []
+        self._server = None
+        self._thread = None
+        self.scrape_count = 0
+
+    def register(self, collector):
+        self._collectors.append(collector)
+
+    def unregister(self, collector):
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self):
+        """全コレクタのメトリクスをテキストで返す"""
+        w = MetricsWriter()
+        for collector in list(self._collectors):
+            try:
+                collector.collect_metrics(w)
+            except Exception as e:
+                print(f"[Metrics] {type(collector).__name__}: {e}")
+        self.scrape_count += 1
+        w.counter("vesc_metrics_scrapes_total", "Metrics requests served", self.scrape_count)
+        return w.text()
+
+    def start(self):
+        if self._server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"[Metrics] Serving on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(timeout=1.0)
+        self._server = None
+        self._thread = None
@@ -1,127 +1,14 @@
 # src/reader.py - モーター動作中のみログ取得版
-import struct
 import time
 import threading
 import csv
 import os
 
-COMM_GET_VALUES = 4
-
-
-# CRC16計算
-def _make_crc16_table():
-    poly = 0x1021
-    table = []
-    for i in range(256):
-        crc = 0
-        c = i << 8
-        for _ in range(8):
-            if (crc ^ c) & 0x8000:
-                crc = ((crc << 1) ^ poly) & 0xFFFF
-            else:
-                crc = (crc << 1) & 0xFFFF
-            c = (c << 1) & 0xFFFF
-        table.append(crc)
-    return table
-
-CRC16_TABLE = _make_crc16_table()
-
-
-def crc16(data: bytes) -> int:
-    crc = 0
-    for b in data:
-        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[((crc >> 8) ^ b) & 0xFF]
-    return crc & 0xFFFF
-
-
-def build_packet(payload: bytes) -> bytes:
-    if len(payload) <= 256:
-        header = bytes([0x02, len(payload)])
-    else:
-        header = bytes([0x03, (len(payload) >> 8) & 0xFF, len(payload) & 0xFF])
-    crc = crc16(payload)
-    crc_bytes = bytes([(crc >> 8) & 0xFF, crc & 0xFF])
-    return header + payload + crc_bytes + bytes([0x03])
-
-
-def extract_packets(buf: bytes):
-    packets = []
-    consumed = 0
-    i = 0
-    while i < len(buf):
-        if buf[i] == 0x02:
-            if i + 2 > len(buf):
-                break
-            length = buf[i + 1]
-            packet_len = 2 + length + 2 + 1
-            if i + packet_len > len(buf):
-                break
-            if buf[i + packet_len - 1] == 0x03:
-                payload = buf[i + 2:i + 2 + length]
-                crc_received = (buf[i + 2 + length] << 8) | buf[i + 2 + length + 1]
-                if crc16(payload) == crc_received:
-                    packets.append(payload)
-                    consumed = i + packet_len
-                    i = consumed
-                else:
-                    i += 1
-            else:
-                i += 1
-        else:
-            i += 1
-    return packets, buf[consumed:]
-
-
-def parse_getvalues(payload):
-    try:
-        if payload[0] == COMM_GET_VALUES:
-            payload = payload[1:]
-        if len(payload) < 46:
-            return None
-        
-        offset = 0
-        temp_fet = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
-        offset += 2
-        temp_motor = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
-        offset += 2
-        current_motor = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        current_in = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        id_val = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        iq_val = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        duty_now = struct.unpack('>h', payload[offset:offset+2])[0] / 1000.0
-        offset += 2
-        rpm = struct.unpack('>i', payload[offset:offset+4])[0]
-        offset += 4
-        v_in = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
-        offset += 2
-        amp_hours = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-        amp_hours_charged = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-        watt_hours = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-        watt_hours_charged = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-        
-        return {
-            'temp_fet': temp_fet,
-            'temp_motor': temp_motor,
-            'current_motor': current_motor,
-            'current_in': current_in,
-            'duty': duty_now,
-            'rpm': rpm,
-            'v_in': v_in,
-            'amp_hours': amp_hours,
-            'amp_hours_charged': amp_hours_charged,
-            'watt_hours': watt_hours,
-            'watt_hours_charged': watt_hours_charged,
-        }
-    except Exception:
-        return None
+from src.vesc_codec import (
+    GET_VALUES_FRAME,
+    extract_packets,
+    parse_getvalues,
+)
 
 
 class VESCReader:
@@ -193,9 +80,8 @@ class VESCReader:
         while not self._stop_flag.is_set():
             try:
                 # COMM_GET_VALUES送信（排他制御を最小化）
-                pkt = build_packet(bytes([COMM_GET_VALUES]))
                 with self._serial_lock:
-                    self.ser.write(pkt)
+                    self.ser.write(GET_VALUES_FRAME)
 
                 # ロック外で待機（Dutyコマンドが割り込めるように）
                 time.sleep(0.02)
@@ -297,7 +183,7 @@ class VESCReader:
 
 
 if __name__ == "__main__":
-    # テスト用
+    # テスト用（python -m src.reader で実行）
     import serial
     ser = serial.Serial("/dev/serial0", 115200, timeout=0.1)
     
@@ -1,128 +1,33 @@
 # src/reader_v2.py - 診断ログ付き・状態リセット修正版
-import struct
 import time
 import threading
-import csv
-import os
+import queue
+import select
+from collections import deque
 import traceback
 
-COMM_GET_VALUES = 4
-
-
-# CRC16計算
-def _make_crc16_table():
-    poly = 0x1021
-    table = []
-    for i in range(256):
-        crc = 0
-        c = i << 8
-        for _ in range(8):
-            if (crc ^ c) & 0x8000:
-                crc = ((crc << 1) ^ poly) & 0xFFFF
-            else:
-                crc = (crc << 1) & 0xFFFF
-            c = (c << 1) & 0xFFFF
-        table.append(crc)
-    return table
-
-CRC16_TABLE = _make_crc16_table()
-
-
-def crc16(data: bytes) -> int:
-    crc = 0
-    for b in data:
-        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[((crc >> 8) ^ b) & 0xFF]
-    return crc & 0xFFFF
-
-
-def build_packet(payload: bytes) -> bytes:
-    if len(payload) <= 256:
-        header = bytes([0x02, len(payload)])
-    else:
-        header = bytes([0x03, (len(payload) >> 8) & 0xFF, len(payload) & 0xFF])
-    crc = crc16(payload)
-    crc_bytes = bytes([(crc >> 8) & 0xFF, crc & 0xFF])
-    return header + payload + crc_bytes + bytes([0x03])
-
-
-def extract_packets(buf: bytes):
-    packets = []
-    consumed = 0
-    i = 0
-    while i < len(buf):
-        if buf[i] == 0x02:
-            if i + 2 > len(buf):
-                break
-            length = buf[i + 1]
-            packet_len = 2 + length + 2 + 1
-            if i + packet_len > len(buf):
-                break
-            if buf[i + packet_len - 1] == 0x03:
-                payload = buf[i + 2:i + 2 + length]
-                crc_received = (buf[i + 2 + length] << 8) | buf[i + 2 + length + 1]
-                if crc16(payload) == crc_received:
-                    packets.append(payload)
-                    consumed = i + packet_len
-                    i = consumed
-                else:
-                    i += 1
-            else:
-                i += 1
-        else:
-            i += 1
-    return packets, buf[consumed:]
-
-
-def parse_getvalues(payload):
-    try:
-        if payload[0] == COMM_GET_VALUES:
-            payload = payload[1:]
-        if len(payload) < 46:
-            return None
-
-        offset = 0
-        temp_fet = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
-        offset += 2
-        temp_motor = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
-        offset += 2
-        current_motor = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        current_in = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        id_val = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        iq_val = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
-        offset += 4
-        duty_now = struct.unpack('>h', payload[offset:offset+2])[0] / 1000.0
-        offset += 2
-        rpm = struct.unpack('>i', payload[offset:offset+4])[0]
-        offset += 4
-        v_in = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
-        offset += 2
-        amp_hours = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-        amp_hours_charged = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-        watt_hours = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-        watt_hours_charged = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
-        offset += 4
-
-        return {
-            'temp_fet': temp_fet,
-            'temp_motor': temp_motor,
-            'current_motor': current_motor,
-            'current_in': current_in,
-            'duty': duty_now,
-            'rpm': rpm,
-            'v_in': v_in,
-            'amp_hours': amp_hours,
-            'amp_hours_charged': amp_hours_charged,
-            'watt_hours': watt_hours,
-            'watt_hours_charged': watt_hours_charged,
-        }
-    except Exception:
-        return None
+from src.session_log import TIMING_FIELDS, open_session_writer
+from src.status_display import StatusDisplay
+from src.metrics import Histogram, TimedLock, collect_lock_metrics, collect_rx_metrics
+from src.transport import PRIO_POLL
+from src.vesc_codec import (
+    COMM_GET_VALUES,
+    COMM_GET_VALUES_SELECTIVE,
+    GET_VALUES_FRAME,
+    encode_get_values_selective,
+    selective_mask,
+    FrameDecoder,
+    parse_values,
+)
+
+# コンソール表示に使うフィールド（selectiveモードでも必ず要求する）
+DISPLAY_FIELDS = ["duty", "rpm", "v_in", "current_in", "current_motor", "temp_fet"]
+# selectiveモードで応答が一度もないまま連続でこの回数応答がなければ
+# 対応していないファームウェアとみなしてCOMM_GET_VALUESに切り替える
+SELECTIVE_FALLBACK_AFTER = 20
+# セッションごとに0に戻る統計（メトリクスでは前のセッションまでの分を足して累積値にする）
+_SESSION_COUNTERS = ("count", "_diag_read_count", "_diag_empty_count", "_diag_packet_count",
+                     "_diag_parse_fail_count", "_diag_late_count", "_diag_lost_count")
 
 
 class VESCReader:
@@ -130,226 +35,627 @@ class VESCReader:
     VESCからデータを読み取ってCSVに保存するクラス
 
     使い方:
-    1. start() で連続ログ開始、stop() で停止
-    2. start_temporary(duration) で一時的ログ（自動停止）
+    1. start_polling() で取得スレッドを起動（ログなしで取得・表示を継続）
+    2. open_session(filename, duration=None) でログ開始、close_session() で終了
+       （取得は止めずに出力ファイルだけを切り替えるので、切り替え時の欠損がない）
+    3. stop() でログを閉じて取得スレッドも停止
+
+    従来のAPIも使える:
+    - start() = open_session()（取得スレッドが止まっていれば起動）
+    - start_temporary(duration) = open_session(duration=duration)
+
+    selective=True の場合、csv_fieldsに必要な値だけを
+    COMM_GET_VALUES_SELECTIVEで要求する（応答が短くなる）。
+    一度も応答がないままSELECTIVE_FALLBACK_AFTER回続けて応答がなければ
+    COMM_GET_VALUESに切り替える
+
+    time列は要求送信と応答受信の中間時刻（VESCが値を取った時刻の推定、
+    セッション開始からの単調増加時刻）。csv_fieldsに "t_send" / "t_recv" / "rtt"
+    を入れるとそれぞれの時刻も記録する。transport使用時の送信時刻は
+    キュー待ちを含まない実際の書き込み時刻。response_wait="sleep"でtransportなしの場合、
+    受信時刻は固定待ち後に読み取った時刻なので、time列は従来どおり読み取った時刻にする。
     """
 
     def __init__(self, ser, interval=0.05,
-                 csv_filename="vesc_data.csv", csv_fields=None, serial_lock=None):
+                 csv_filename="vesc_data.csv", csv_fields=None, serial_lock=None,
+                 selective=False, response_wait="sleep", response_timeout=0.05,
+                 pipeline_depth=1, transport=None, log_format="csv",
+                 log_flush_interval=1.0, log_fsync_interval=None,
+                 display_rate=4.0, verbose=1, log_compression=None,
+                 log_rotate_bytes=None, log_rotate_seconds=None):
+        """
+        Args:
+            interval: 要求の周期（秒）。response_wait="event"で0以下なら応答後すぐ次を要求
+            response_wait: "sleep" = 送信後に固定時間待って読む（従来動作）
+                           "event" = 完全な応答が届くかタイムアウトまで待つ
+            response_timeout: 応答待ち時間（秒）
+            pipeline_depth: response_wait="event"で同時に送信しておく要求数
+                            （2以上で応答待ちの間に次の要求を送る）
+            transport: SerialTransportを渡すとserial_lockを使わず、
+                       要求は低優先度で送信キューへ、応答は購読で受け取る
+            log_format: "csv" = 従来のCSV
+                        "bin" = 固定長バイナリ（src.session_logでCSVに変換）
+            log_flush_interval: ログのflush間隔（秒、書き込みは別スレッド）
+            log_fsync_interval: fsync間隔（秒、Noneならfsyncしない）
+            log_compression: None / "gzip" / "zstd"（flushごとにブロックを閉じる）
+            log_rotate_bytes / log_rotate_seconds: 1ファイルの上限サイズ・時間
+                            （超えたら取得を止めずに _p002 などの次のファイルへ）
+            display_rate: ステータス行の更新周期（Hz）
+            verbose: 0 = ステータス行なし
+                     1 = ステータス行のみ（サンプルごとの表示はしない）
+                     2 = 1 + 受信データのhex dump・応答なしの診断出力
+        """
         self.ser = ser
         self.interval = interval
-        self._buffer = b''
+        self.response_wait = response_wait
+        self.response_timeout = response_timeout
+        self.pipeline_depth = max(1, int(pipeline_depth))
+        self._rx = FrameDecoder()
         self._stop_flag = threading.Event()
         self._thread = None
         self.count = 0
 
+        # 表示（取得ループとは別スレッドで一定周期に描画）
+        self.verbose = verbose
+        self._display = StatusDisplay(rate=display_rate) if verbose >= 1 else None
+
         # CSV設定
         self.csv_filename = csv_filename
         self.csv_fields = csv_fields or ["time", "duty", "rpm"]
-        self._csv_file = None
-        self._csv_writer = None
+        self.log_format = log_format
+        self.log_flush_interval = log_flush_interval
+        self.log_fsync_interval = log_fsync_interval
+        self.log_compression = log_compression
+        self.log_rotate_bytes = log_rotate_bytes
+        self.log_rotate_seconds = log_rotate_seconds
+        self._log_writer = None
         self._start_time = None
-
-        # 一時的使用のためのタイマー
-        self._duration = None
-        self._timer_thread = None
+        self._start_mono = None
+        # セッション（ログ出力先）の切り替えは取得スレッドと排他
+        self._session_lock = threading.Lock()
+        self._session_id = 0
+        # 統計をリセット済みのセッション通番（取得スレッドだけが進める）
+        self._stats_session = 0
+        self._session_timer = None
+        self._timing_columns = any(f in TIMING_FIELDS for f in self.csv_fields)
+        # ログを閉じた後に書き込みスレッドから呼ばれる（引数: ファイルパスのリスト、カタログ登録等）
+        self.on_session_closed = None
+
+        # 要求フレーム（selectiveモードではcsv_fieldsからマスクを生成）
+        self.selective = selective
+        self._request_frame = GET_VALUES_FRAME
+        if selective:
+            mask = selective_mask(self.csv_fields + DISPLAY_FIELDS)
+            self._request_frame = encode_get_values_selective(mask)
+        # selective要求への応答を受け取ったか / 連続で応答がない回数
+        self._selective_confirmed = False
+        self._unanswered = 0
 
         # 診断カウンタ
         self._diag_read_count = 0
         self._diag_empty_count = 0
         self._diag_packet_count = 0
         self._diag_parse_fail_count = 0
-
-        # シリアルポート排他制御用（DutyControllerと共有）
-        self._serial_lock = serial_lock if serial_lock else threading.Lock()
+        self._diag_late_count = 0
+        self._diag_lost_count = 0
+
+        # 応答待ちの要求の送信時刻（送信順、pipelineモード用）
+        self._inflight = deque()
+        self._next_send = 0.0
+
+        # 往復時間（要求送信 → 応答受信、秒）
+        self.last_rtt = None
+        self._rtt_count = 0
+        self._rtt_sum = 0.0
+        self._rtt_min = None
+        self._rtt_max = None
+        # メトリクス用（セッションをまたいで累積）
+        self.rtt_histogram = Histogram()
+        self._totals = dict.fromkeys(_SESSION_COUNTERS, 0)
+
+        # シリアルポート排他制御用（DutyControllerと共有、待ち時間を計測）
+        self._serial_lock = TimedLock(serial_lock)
+
+        # 送受信スレッド経由の場合は応答をキューで受け取る
+        self._transport = transport
+        self._replies = queue.Queue()
+        self._held_replies = []
+        if transport is not None:
+            transport.subscribe(COMM_GET_VALUES, self._on_reply)
+            transport.subscribe(COMM_GET_VALUES_SELECTIVE, self._on_reply)
+
+    def _on_reply(self, payload, t_recv):
+        """SerialTransportからの応答（I/Oスレッドで呼ばれる）"""
+        self._replies.put((payload, t_recv))
 
     def _reset_state(self):
-        """セッション間の状態リセット"""
-        self._buffer = b''
+        """取得スレッド起動時の状態リセット"""
+        self._rx.reset()
+        self._held_replies.clear()
+        while not self._replies.empty():
+            self._replies.get_nowait()
+        self._inflight.clear()
+        self._next_send = 0.0
+        self._reset_session_stats()
+
+    def _reset_session_stats(self):
+        """
+        セッションごとの統計をリセット（取得は継続したまま）
+
+        カウンタを増やすのは取得スレッドだけなので、取得中は取得スレッドから
+        _sync_session_stats()経由で呼ぶ（他のスレッドで0に戻すと、同時に増やした分が失われる）
+        """
+        for name in _SESSION_COUNTERS:
+            self._totals[name] += getattr(self, name)
         self.count = 0
-        self._csv_file = None
-        self._csv_writer = None
-        self._start_time = None
         self._diag_read_count = 0
         self._diag_empty_count = 0
         self._diag_packet_count = 0
         self._diag_parse_fail_count = 0
+        self._diag_late_count = 0
+        self._diag_lost_count = 0
+        self.last_rtt = None
+        self._rtt_count = 0
+        self._rtt_sum = 0.0
+        self._rtt_min = None
+        self._rtt_max = None
+
+    def _sync_session_stats(self):
+        """ログが切り替わっていれば統計をリセット（取得スレッドで_session_lockを持って呼ぶ）"""
+        if self._stats_session != self._session_id:
+            self._stats_session = self._session_id
+            self._reset_session_stats()
+
+    def _open_log(self):
+        """ログファイルを開く（呼び出し元のスレッドで開くので取得ループは止まらない）"""
+        return open_session_writer(
+            self.csv_filename, self.csv_fields, self.log_format,
+            compression=self.log_compression,
+            rotate_bytes=self.log_rotate_bytes, rotate_seconds=self.log_rotate_seconds,
+            flush_interval=self.log_flush_interval, fsync_interval=self.log_fsync_interval,
+            on_closed=self.on_session_closed)
+
+    def _write_log(self, parsed, t_send, t_recv, midpoint=True):
+        """ログ書き込み（時刻は送受信の中間、midpoint=Falseなら受信時刻、セッション開始からの経過秒）"""
+        with self._session_lock:
+            # 新しいログの最初の行の前に統計をリセット（サンプル数がログの行と揃う）
+            self._sync_session_stats()
+            writer = self._log_writer
+            if writer is None:
+                return
+            start = self._start_mono
+            timing = None
+            if self._timing_columns:
+                timing = {"t_send": t_send - start, "t_recv": t_recv - start, "rtt": t_recv - t_send}
+            t = (t_send + t_recv) / 2 if midpoint else t_recv
+            writer.write(t - start, parsed, timing)
+
+    def _summary_lines(self):
+        """セッションの統計（transport使用時は受信デコーダはtransport側）"""
+        rx = self._transport.rx if self._transport is not None else self._rx
+        lines = [f"[CSV] Closing. samples={self.count}, "
+                 f"reads={self._diag_read_count}, empty={self._diag_empty_count}, "
+                 f"packets={self._diag_packet_count}, parse_fail={self._diag_parse_fail_count}, "
+                 f"rx_overflow={rx.overflow_count}/{rx.discarded_bytes}B, "
+                 f"rx_skipped={rx.skipped_bytes}B, crc_fail={rx.crc_fail_count}"]
+        if self._rtt_count:
+            lines.append(f"[CSV] RTT avg={self._rtt_sum / self._rtt_count * 1000:.1f}ms "
+                         f"min={self._rtt_min * 1000:.1f}ms max={self._rtt_max * 1000:.1f}ms "
+                         f"(n={self._rtt_count}), late={self._diag_late_count}, "
+                         f"lost={self._diag_lost_count}")
+        return lines
+
+    def _finish_log(self, writer, lines):
+        """切り離したログを閉じる（取得スレッドの外で行う）"""
+        for line in lines:
+            print(line)
+        writer.close()
+        print(f"[CSV] Writer: {writer.stats_line()}")
+
+    def _send_request(self):
+        """
+        COMM_GET_VALUES(_SELECTIVE)送信（排他制御を最小化）
 
-    def _init_csv(self):
-        """CSV初期化"""
-        os.makedirs(os.path.dirname(self.csv_filename) or ".", exist_ok=True)
-        self._csv_file = open(self.csv_filename, mode="w", newline="")
-        self._csv_writer = csv.DictWriter(self._csv_file, fieldnames=self.csv_fields)
-        self._csv_writer.writeheader()
-        self._csv_file.flush()
+        Returns:
+            [送信時刻] transport使用時は積んだ時刻で、I/Oスレッドが書き込んだ時刻に
+            置き換える（応答はその後に届くので、応答の処理時には書き込み時刻になっている）
+        """
+        if self._transport is not None:
+            stamp = [time.monotonic()]
+            self._transport.send(self._request_frame, PRIO_POLL,
+                                 on_sent=lambda t_write: stamp.__setitem__(0, t_write))
+            return stamp
+        with self._serial_lock:
+            self.ser.write(self._request_frame)
+        return [time.monotonic()]
+
+    def _read_available(self):
+        """
+        受信済みデータを読み取りパケットを取り出す（ノンブロッキング）
 
-        self._start_time = time.time()
-        print(f"[CSV] Logging to: {self.csv_filename}")
+        Returns:
+            (受信バイト数, [(payload, 受信時刻), ...]) 受信時刻はtime.monotonic()
+        """
+        if self._transport is not None:
+            return self._take_replies()
 
-    def _write_csv(self, parsed):
-        """CSV書き込み"""
-        if self._csv_writer is None:
+        with self._serial_lock:
+            waiting = self.ser.in_waiting
+            if waiting > 0:
+                received = self._rx.readinto(self.ser, waiting)
+            else:
+                received = 0
+        t_recv = time.monotonic()
+
+        self._diag_read_count += 1
+        if not received:
+            return 0, []
+
+        # verbose>=2の場合、最初の10回だけ生データをhex dumpで表示
+        dump = self.verbose >= 2 and self._diag_read_count <= 10
+        if dump:
+            data = self._rx.view()[-received:]
+            print(f"[RAW] read#{self._diag_read_count}: {received}B: "
+                  f"{data[:40].hex(' ')}"
+                  f"{'...' if received > 40 else ''}")
+
+        packets = [(payload, t_recv) for payload in self._rx.extract()]
+
+        # パケットが見つからない場合、バッファの状態を表示
+        if not packets and dump:
+            pending = self._rx.view()
+            print(f"[RAW] buffer: {len(pending)}B: "
+                  f"{pending[:40].hex(' ')}"
+                  f"{'...' if len(pending) > 40 else ''}")
+        return received, packets
+
+    def _take_replies(self):
+        """SerialTransportから届いた応答を取り出す"""
+        packets = self._held_replies
+        self._held_replies = []
+        while True:
+            try:
+                packets.append(self._replies.get_nowait())
+            except queue.Empty:
+                break
+        self._diag_read_count += 1
+        return sum(len(p) for p, _ in packets), packets
+
+    def _wait_readable(self, timeout):
+        """シリアルに受信データが来るまで最大timeout秒待つ（ロックは取らない）"""
+        if self._transport is not None:
+            try:
+                self._held_replies.append(self._replies.get(timeout=timeout))
+            except queue.Empty:
+                pass
             return
 
-        elapsed = time.time() - self._start_time
-        row = {}
-        for field in self.csv_fields:
-            if field == "time":
-                row["time"] = round(elapsed, 3)
-            elif field in parsed:
-                row[field] = parsed[field]
+        try:
+            fd = self.ser.fileno()
+        except Exception:
+            fd = None
+        if fd is None:
+            # fdが取れないポートは短い間隔でポーリング
+            time.sleep(min(timeout, 0.002))
+            return
+        try:
+            select.select([fd], [], [], timeout)
+        except (OSError, ValueError):
+            time.sleep(min(timeout, 0.002))
+
+    def _record_rtt(self, rtt):
+        self.rtt_histogram.observe(rtt)
+        self.last_rtt = rtt
+        self._rtt_count += 1
+        self._rtt_sum += rtt
+        if self._rtt_min is None or rtt < self._rtt_min:
+            self._rtt_min = rtt
+        if self._rtt_max is None or rtt > self._rtt_max:
+            self._rtt_max = rtt
+
+    def _handle_packets(self, packets, t_send, midpoint=True):
+        """
+        受信パケットを解析してログ書き込み・表示、有効サンプル数を返す
 
-        self._csv_writer.writerow(row)
-        self._csv_file.flush()
+        Args:
+            packets: [(payload, 受信時刻), ...]
+            t_send: 対応する要求の送信時刻
+            midpoint: Falseならtime列は受信（読み取り）時刻
+        """
+        samples = 0
+        for payload, t_recv in packets:
+            self._diag_packet_count += 1
+            parsed = parse_values(payload)
+            if parsed:
+                self._unanswered = 0
+                if payload[0] == COMM_GET_VALUES_SELECTIVE:
+                    self._selective_confirmed = True
+                # 書き込み（ここで切り替え後の統計リセットがある）の後に数える
+                self._write_log(parsed, t_send, t_recv, midpoint)
+                self.count += 1
+                samples += 1
+                rtt = t_recv - t_send
+                self._record_rtt(rtt)
+                if self._display is not None:
+                    self._display.update(self.count, parsed, rtt)
+            else:
+                self._diag_parse_fail_count += 1
+                print(f"[DIAG] parse_values failed: payload_len={len(payload)}, "
+                      f"cmd_id={payload[0] if payload else 'N/A'}")
+        return samples
+
+    def _report_empty(self):
+        self._diag_empty_count += 1
+        self._unanswered += 1
+        if (self.selective and not self._selective_confirmed
+                and self._unanswered >= SELECTIVE_FALLBACK_AFTER):
+            self._fallback_to_full()
+        # 5回に1回診断出力（頻度を抑える、ステータス行がある場合はNO DATA表示に任せる）
+        if (self._display is None or self.verbose >= 2) and self._diag_empty_count % 5 == 1:
+            print(f"[DIAG] No data from VESC "
+                  f"(empty={self._diag_empty_count}/{self._diag_read_count}, "
+                  f"buf={len(self._rx)}B)")
+
+    def _fallback_to_full(self):
+        """COMM_GET_VALUES_SELECTIVEに応答しないVESCは全値の要求に切り替える"""
+        self.selective = False
+        self._request_frame = GET_VALUES_FRAME
+        print(f"[Reader] No reply to COMM_GET_VALUES_SELECTIVE after {self._unanswered} requests, "
+              f"falling back to COMM_GET_VALUES")
+
+    def _poll_sleep(self):
+        """従来動作：送信 → 固定0.05秒待機 → 読み取り"""
+        stamp = self._send_request()
+
+        # ロック外で待機（VESC応答待ち＆Dutyコマンド割り込み許可）
+        time.sleep(0.05)
+
+        received, packets = self._read_available()
+        if received:
+            # transportなしの受信時刻は読み取った時刻なので中間時刻にしない
+            self._handle_packets(packets, stamp[0], midpoint=self._transport is not None)
+        else:
+            self._report_empty()
 
-    def _loop(self):
-        """メインループ"""
-        self._init_csv()
+        # インターバル待機
+        time.sleep(max(0, self.interval - 0.05))
+
+    def _poll_event(self):
+        """送信 → 応答完了（またはタイムアウト）まで待機 → 次の周期まで待機"""
+        # タイムアウト後に遅れて届いた応答は破棄（次の要求と取り違えないため）
+        _, late = self._read_available()
+        self._diag_late_count += len(late)
+
+        stamp = self._send_request()
+        samples = 0
 
         while not self._stop_flag.is_set():
-            try:
-                # COMM_GET_VALUES送信（排他制御を最小化）
-                pkt = build_packet(bytes([COMM_GET_VALUES]))
-                with self._serial_lock:
-                    self.ser.write(pkt)
-
-                # ロック外で待機（VESC応答待ち＆Dutyコマンド割り込み許可）
-                time.sleep(0.05)
-
-                # 応答読み取り（ノンブロッキング：ロック時間を最小化）
-                with self._serial_lock:
-                    waiting = self.ser.in_waiting
-                    if waiting > 0:
-                        data = self.ser.read(waiting)
-                    else:
-                        data = b''
-
-                self._diag_read_count += 1
-
-                if data:
-                    # 最初の10回だけ生データをhex dumpで表示
-                    if self._diag_read_count <= 10:
-                        print(f"[RAW] read#{self._diag_read_count}: {len(data)}B: "
-                              f"{data[:40].hex(' ')}"
-                              f"{'...' if len(data) > 40 else ''}")
-
-                    self._buffer += data
-                    packets, self._buffer = extract_packets(self._buffer)
-
-                    # パケットが見つからない場合、バッファの状態を表示
-                    if not packets and self._diag_read_count <= 10:
-                        print(f"[RAW] buffer: {len(self._buffer)}B: "
-                              f"{self._buffer[:40].hex(' ')}"
-                              f"{'...' if len(self._buffer) > 40 else ''}")
-
-                    for payload in packets:
-                        self._diag_packet_count += 1
-                        parsed = parse_getvalues(payload)
-                        if parsed:
-                            self.count += 1
-                            self._write_csv(parsed)
-
-                            # データ表示
-                            print(f"\n--- データ #{self.count} ---")
-                            print(f"Duty比:     {parsed['duty']:.3f}")
-                            print(f"RPM:        {parsed['rpm']}")
-                            print(f"入力電圧:   {parsed['v_in']:.1f}V")
-                            print(f"入力電流:   {parsed['current_in']:.2f}A")
-                            print(f"モーター電流: {parsed['current_motor']:.2f}A")
-                            print(f"FET温度:    {parsed['temp_fet']:.1f}°C")
-                        else:
-                            self._diag_parse_fail_count += 1
-                            print(f"[DIAG] parse_getvalues failed: payload_len={len(payload)}, "
-                                  f"cmd_id={payload[0] if payload else 'N/A'}")
-                else:
-                    self._diag_empty_count += 1
-                    # 5回に1回診断出力（頻度を抑える）
-                    if self._diag_empty_count % 5 == 1:
-                        print(f"[DIAG] No data from VESC "
-                              f"(empty={self._diag_empty_count}/{self._diag_read_count}, "
-                              f"buf={len(self._buffer)}B)")
-
-                # インターバル待機
-                time.sleep(max(0, self.interval - 0.05))
+            _, packets = self._read_available()
+            if packets:
+                samples = self._handle_packets(packets, stamp[0])
+                if samples:
+                    break
+            # 期限は実際に書き込んだ時刻から（transportのキュー待ちを含めない）
+            remaining = stamp[0] + self.response_timeout - time.monotonic()
+            if remaining <= 0:
+                break
+            self._wait_readable(remaining)
+
+        if not samples:
+            self._report_empty()
+
+        # 次の要求まで待機（interval<=0なら即座に次を送信）
+        wait = stamp[0] + self.interval - time.monotonic()
+        if wait > 0:
+            self._stop_flag.wait(wait)
+
+    def _poll_pipelined(self):
+        """
+        最大pipeline_depth個の要求を送信済みに保つ
+
+        - 応答は送信順に要求と対応付ける（GET_VALUESに通番はないため）
+        - 最古の要求がresponse_timeoutを過ぎたら窓全体を失われたもの（lost）とし、
+          最後に送った要求の期限まで次を送らない（遅れた応答が次の要求に
+          対応付けられて時刻がずれるのを防ぐ）
+        - 対応する要求がない応答は遅延（late）として破棄し、
+          その後response_timeoutの間は応答がなくなるまで送信を待つ
+        """
+        now = time.monotonic()
+        inflight = self._inflight
+
+        if inflight and now - inflight[0][0] > self.response_timeout:
+            self._diag_lost_count += len(inflight)
+            self._next_send = max(self._next_send, inflight[-1][0] + self.response_timeout)
+            inflight.clear()
+            self._report_empty()
+
+        # 窓に空きがあり、周期が来ていれば次の要求を送信
+        if len(inflight) < self.pipeline_depth and now >= self._next_send:
+            stamp = self._send_request()
+            inflight.append(stamp)
+            self._next_send = stamp[0] + max(0.0, self.interval)
+            return
 
+        _, packets = self._read_available()
+        for packet in packets:
+            if not inflight:
+                # 破棄した要求の応答: 届かなくなるまで次の送信を延ばす
+                self._diag_late_count += 1
+                self._next_send = max(self._next_send, packet[1] + self.response_timeout)
+                continue
+            self._handle_packets([packet], inflight.popleft()[0])
+        if packets:
+            return
+
+        # 受信・次の送信・最古の要求の期限のうち早いものまで待つ
+        wake = inflight[0][0] + self.response_timeout if inflight else self._next_send
+        if len(inflight) < self.pipeline_depth:
+            wake = min(wake, self._next_send)
+        timeout = wake - time.monotonic()
+        if timeout > 0:
+            self._wait_readable(timeout)
+
+    def _loop(self):
+        """メインループ（ログの開始・終了とは独立して取得を続ける）"""
+        if self.response_wait != "event":
+            poll = self._poll_sleep
+        elif self.pipeline_depth > 1:
+            # 前回セッションの残りの応答を破棄してから開始
+            _, stale = self._read_available()
+            self._diag_late_count += len(stale)
+            poll = self._poll_pipelined
+        else:
+            poll = self._poll_event
+        if self._display is not None:
+            self._display.start()
+        while not self._stop_flag.is_set():
+            if self._stats_session != self._session_id:
+                with self._session_lock:
+                    self._sync_session_stats()
+            try:
+                poll()
             except Exception as e:
                 print(f"[Reader Error] {e}")
                 traceback.print_exc()
                 time.sleep(0.1)
 
-        # 終了処理
-        print(f"[CSV] Closing. samples={self.count}, "
-              f"reads={self._diag_read_count}, empty={self._diag_empty_count}, "
-              f"packets={self._diag_packet_count}, parse_fail={self._diag_parse_fail_count}")
-        if self._csv_file:
-            self._csv_file.close()
+        if self._display is not None:
+            self._display.stop()
 
-    def start(self, csv_filename=None):
-        """
-        ログ取得開始（手動でstop()するまで継続）
-
-        Args:
-            csv_filename: CSVファイルパス（省略時はself.csv_filename）
-        """
+    def start_polling(self):
+        """取得スレッドを起動（ログは開かない、既に動いていれば何もしない）"""
         if self._thread is not None:
-            print("[Reader] Already running, stopping first...")
-            self.stop()
-            time.sleep(0.5)
-
-        if csv_filename:
-            self.csv_filename = csv_filename
-
+            return
         self._reset_state()
         self._stop_flag.clear()
         self._thread = threading.Thread(target=self._loop, daemon=True)
         self._thread.start()
-        print(f"[Reader] Started (continuous)")
+        print("[Reader] Started (polling)")
 
-    def start_temporary(self, duration, csv_filename=None):
+    def open_session(self, csv_filename=None, duration=None):
         """
-        一時的にログ取得を開始（duration秒後に自動停止）
+        ログ開始（前のログがあれば取得を止めずに切り替える）
 
         Args:
-            duration: ログ取得時間（秒）
-            csv_filename: CSVファイルパス（省略時はself.csv_filename）
+            csv_filename: ログファイルパス（省略時はself.csv_filename）
+            duration: 指定するとduration秒後にこのログを閉じる（取得は継続）
         """
-        if self._thread is not None:
-            print("[Reader] Already running, stopping first...")
-            self.stop()
-            time.sleep(0.5)
-
         if csv_filename:
             self.csv_filename = csv_filename
+        writer = self._open_log()
+        self.start_polling()
+        self._cancel_timer()
+
+        with self._session_lock:
+            old = self._log_writer
+            lines = self._summary_lines() if old is not None else []
+            self._log_writer = writer
+            self._start_time = time.time()
+            self._start_mono = time.monotonic()
+            # 統計のリセットは取得スレッドが次の周期の前に行う
+            self._session_id += 1
+            session_id = self._session_id
+
+        if old is not None:
+            self._finish_log(old, lines)
+        print(f"[CSV] Logging to: {self.csv_filename} ({self.log_format})")
+
+        if duration is not None:
+            self._session_timer = threading.Timer(duration, self._close_session,
+                                                  args=(session_id, duration))
+            self._session_timer.daemon = True
+            self._session_timer.start()
+
+    def close_session(self):
+        """ログ終了（取得スレッドは止めない）"""
+        self._cancel_timer()
+        self._close_session()
+
+    def _close_session(self, session_id=None, duration=None):
+        with self._session_lock:
+            writer = self._log_writer
+            # 時間指定の終了は、その間に次のログに切り替わっていれば何もしない
+            if writer is None or (session_id is not None and session_id != self._session_id):
+                return
+            lines = self._summary_lines()
+            self._log_writer = None
+            self._start_mono = None
+        if duration is not None:
+            print(f"[Reader] Session ended after {duration}s")
+        self._finish_log(writer, lines)
+
+    def _cancel_timer(self):
+        if self._session_timer is not None:
+            self._session_timer.cancel()
+            self._session_timer = None
 
-        self._duration = duration
-        self._reset_state()
-        self._stop_flag.clear()
-        self._thread = threading.Thread(target=self._loop, daemon=True)
-        self._thread.start()
+    def start(self, csv_filename=None):
+        """
+        ログ取得開始（手動でclose_session()/stop()するまで継続）
 
-        # タイマースレッド開始
-        def timer_func():
-            time.sleep(duration)
-            if not self._stop_flag.is_set():
-                print(f"[Reader] Auto-stopping after {duration}s")
-                self.stop()
+        Args:
+            csv_filename: CSVファイルパス（省略時はself.csv_filename）
+        """
+        self.open_session(csv_filename)
 
-        self._timer_thread = threading.Thread(target=timer_func, daemon=True)
-        self._timer_thread.start()
+    def start_temporary(self, duration, csv_filename=None):
+        """
+        一時的にログ取得を開始（duration秒後にログを閉じる、取得は継続）
 
-        print(f"[Reader] Started (will auto-stop after {duration}s)")
+        Args:
+            duration: ログ取得時間（秒）
+            csv_filename: CSVファイルパス（省略時はself.csv_filename）
+        """
+        self.open_session(csv_filename, duration=duration)
 
     def stop(self):
-        """読み取り停止"""
+        """ログを閉じて取得スレッドも停止"""
+        self.close_session()
         if self._thread is not None:
             self._stop_flag.set()
             self._thread.join(timeout=3.0)
             self._thread = None
             print("[Reader] Stopped")
 
+    def collect_metrics(self, w):
+        """
+        MetricsServerから呼ばれる（カウンタはセッションをまたいで累積）
+
+        サンプルレートはPrometheus側で rate(vesc_reader_samples_total[1m]) として求める
+        （スクレイプごとにレートを計算すると複数のスクレイパーで区間がずれるため）
+        """
+        with self._session_lock:
+            totals = {name: self._totals[name] + getattr(self, name) for name in _SESSION_COUNTERS}
+            active = self._log_writer is not None
+        w.gauge("vesc_reader_active", "1 while a logging session is running", int(active))
+        w.gauge("vesc_reader_polling", "1 while the polling thread is running",
+                int(self._thread is not None))
+        w.counter("vesc_reader_samples_total", "Valid samples", totals["count"])
+        w.counter("vesc_reader_reads_total", "Receive attempts", totals["_diag_read_count"])
+        w.counter("vesc_reader_empty_reads_total", "Requests with no reply",
+                  totals["_diag_empty_count"])
+        w.counter("vesc_reader_packets_total", "Reply packets", totals["_diag_packet_count"])
+        w.counter("vesc_reader_parse_failures_total", "Replies that could not be parsed",
+                  totals["_diag_parse_fail_count"])
+        w.counter("vesc_reader_late_replies_total", "Replies discarded as late",
+                  totals["_diag_late_count"])
+        w.counter("vesc_reader_lost_requests_total", "Pipelined requests dropped after a reply timeout",
+                  totals["_diag_lost_count"])
+        w.histogram("vesc_reader_rtt_seconds", "Request to reply round-trip time",
+                    self.rtt_histogram)
+        writer = self._log_writer
+        if writer is not None and hasattr(writer, "depth"):
+            w.gauge("vesc_log_queue_depth", "Rows waiting for the log writer thread", writer.depth())
+            w.counter("vesc_log_dropped_rows_total", "Rows dropped because the log queue was full",
+                      writer.dropped_count)
+        # transport使用時は受信統計・送信待ちはtransport側で出す
+        if self._transport is None:
+            collect_rx_metrics(w, self._rx)
+            collect_lock_metrics(w, self._serial_lock, "reader")
+
 
 if __name__ == "__main__":
-    # テスト用
+    # テスト用（python -m src.reader_v2 で実行）
     import serial
     ser = serial.Serial("/dev/serial0", 115200, timeout=0.1)
 
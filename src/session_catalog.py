@@ -0,0 +1,309 @@
+# src/session_catalog.py - セッションログのカタログ（SQLite、ログを閉じたときに登録）
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from src.analysis import ANALYSIS_VERSION, find_logs, load_session, summarize
+
+# make_log_filename() の形式: {mode}_{YYYYMMDD}_{HHMMSS}[_p002].csv[.gz]
+_NAME_RE = re.compile(
+    r"^(?P<mode>[a-z]+?)(?:_(?P<direction>forward|reverse))?"
+    r"_(?P<date>\d{8})_(?P<time>\d{6})(?:_p(?P<part>\d{3}))?\.")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    path            TEXT PRIMARY KEY,
+    file            TEXT NOT NULL,
+    session         TEXT NOT NULL,
+    part            INTEGER NOT NULL,
+    mode            TEXT,
+    direction       TEXT,
+    start_time      REAL,
+    duration        REAL,
+    max_duty        REAL,
+    duty_peak       REAL,
+    samples         INTEGER,
+    peak_current    REAL,
+    peak_current_in REAL,
+    energy_j        REAL,
+    step_response   REAL,
+    rpm_settle_time REAL,
+    anomalies       TEXT NOT NULL DEFAULT '',
+    size            INTEGER,
+    mtime_ns        INTEGER,
+    analysis_version INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_mode_time ON sessions (mode, direction, start_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_time ON sessions (start_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_peak ON sessions (peak_current);
+"""
+
+COLUMNS = ("path", "file", "session", "part", "mode", "direction", "start_time", "duration",
+           "max_duty", "duty_peak", "samples", "peak_current", "peak_current_in", "energy_j",
+           "step_response", "rpm_settle_time", "anomalies", "size", "mtime_ns", "analysis_version")
+
+
+def parse_log_filename(path):
+    """
+    ファイル名からモード・方向・開始時刻を取り出す
+
+    Returns:
+        {"mode", "direction", "start_time", "session", "part"}（形式が違えばmode等はNone）
+    """
+    name = os.path.basename(path)
+    m = _NAME_RE.match(name)
+    if m is None:
+        return {"mode": None, "direction": None, "start_time": None,
+                "session": name.split(".")[0], "part": 1}
+    start = time.mktime(time.strptime(m["date"] + m["time"], "%Y%m%d%H%M%S"))
+    return {
+        "mode": m["mode"],
+        "direction": m["direction"],
+        "start_time": start,
+        "session": name[:m.end("time")],
+        "part": int(m["part"]) if m["part"] else 1,
+    }
+
+
+def _real(value):
+    """NaNはNULLに（infはそのまま: 整定しなかった）"""
+    if value is None or value != value:
+        return None
+    return value
+
+
+class SessionCatalog:
+    """
+    USB_LOG_DIRのセッション一覧（モード・方向・開始時刻・集計値・異常）をSQLiteに保存
+
+    - add(path): ログを読んで集計し登録（同じパスは置き換え）
+    - add_session(paths): BackgroundLogWriterのon_closedからそのまま呼べる
+    - scan(directory): 未登録・変更されたファイルだけ登録（既存ログの取り込み）
+    - query(...): インデックスを使った絞り込み
+
+    接続は操作ごとに開くので、書き込みスレッドやTimerスレッドから呼んでもよい。
+
+    使い方:
+        catalog = SessionCatalog(os.path.join(USB_LOG_DIR, "sessions.db"))
+        # ログを閉じたら別スレッドで登録（src.session_postprocess）
+        reader.on_session_closed = make_session_hook(catalog.db_path, MAX_DUTY)
+        catalog.query(mode="auto", direction="reverse", since=time.time() - 7 * 86400,
+                      min_peak_current=20)
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _row(self, path, max_duty=None):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        summary = summarize(load_session(path), name=os.path.basename(path))
+        meta = parse_log_filename(path)
+        start = meta["start_time"]
+        if start is None:
+            # 形式の違うファイル名は最終更新時刻から推定
+            start = st.st_mtime - (summary["duration"] or 0.0)
+        return {
+            "path": path,
+            "file": os.path.basename(path),
+            "session": meta["session"],
+            "part": meta["part"],
+            "mode": meta["mode"],
+            "direction": meta["direction"],
+            "start_time": start,
+            "duration": _real(summary["duration"]),
+            "max_duty": max_duty,
+            "duty_peak": _real(summary["duty_peak"]),
+            "samples": summary["samples"],
+            "peak_current": _real(summary["current_motor_peak"]),
+            "peak_current_in": _real(summary["current_in_peak"]),
+            "energy_j": _real(summary["energy_j"]),
+            "step_response": _real(summary["step_response_median"]),
+            "rpm_settle_time": _real(summary["rpm_settle_time"]),
+            "anomalies": summary["anomalies"],
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "analysis_version": ANALYSIS_VERSION,
+        }
+
+    def _insert(self, rows):
+        sql = (f"INSERT OR REPLACE INTO sessions ({', '.join(COLUMNS)}) "
+               f"VALUES ({', '.join(':' + c for c in COLUMNS)})")
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(sql, rows)
+            finally:
+                conn.close()
+
+    def add(self, path, max_duty=None):
+        """1ファイルを登録（読めなければValueError等）"""
+        self._insert([self._row(path, max_duty)])
+
+    def add_session(self, paths, max_duty=None):
+        """閉じたセッション（ローテーションした各ファイル）を登録"""
+        rows = []
+        for path in paths:
+            try:
+                rows.append(self._row(path, max_duty))
+            except (ValueError, OSError, RuntimeError, KeyError) as e:
+                print(f"[Catalog] Skipped: {e}")
+        if rows:
+            self._insert(rows)
+            print(f"[Catalog] Added {', '.join(row['file'] for row in rows)}")
+
+    def scan(self, directory, max_duty=None, verbose=True):
+        """
+        ディレクトリ内の未登録・変更されたログを登録
+
+        Returns:
+            登録したファイル数
+        """
+        conn = self._connect()
+        try:
+            known = {row["path"]: row for row in conn.execute(
+                "SELECT path, size, mtime_ns, analysis_version, max_duty FROM sessions")}
+        finally:
+            conn.close()
+
+        rows = []
+        for path in find_logs(directory):
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            old = known.get(path)
+            if old is not None and tuple(old)[1:4] == (st.st_size, st.st_mtime_ns, ANALYSIS_VERSION):
+                continue
+            # 閉じたときに登録されたMAX_DUTYは引き継ぐ
+            duty = old["max_duty"] if old is not None and max_duty is None else max_duty
+            try:
+                rows.append(self._row(path, duty))
+            except (ValueError, OSError, RuntimeError, KeyError) as e:
+                if verbose:
+                    print(f"[Catalog] Skipped: {e}")
+        if rows:
+            self._insert(rows)
+        return len(rows)
+
+    def remove_missing(self):
+        """ファイルがなくなったエントリを削除（削除数を返す）"""
+        conn = self._connect()
+        try:
+            paths = [row["path"] for row in conn.execute("SELECT path FROM sessions")]
+            missing = [(p,) for p in paths if not os.path.exists(p)]
+            with self._lock, conn:
+                conn.executemany("DELETE FROM sessions WHERE path = ?", missing)
+        finally:
+            conn.close()
+        return len(missing)
+
+    def query(self, mode=None, direction=None, since=None, until=None,
+              min_peak_current=None, anomaly=None, limit=None):
+        """
+        条件に合うセッション（開始時刻順、sqlite3.Rowのリスト）
+
+        Args:
+            mode: "manual" / "auto"
+            direction: "forward" / "reverse"
+            since / until: 開始時刻の範囲（UNIX時刻）
+            min_peak_current: current_motorの絶対値の最大がこれ以上（A）
+            anomaly: この異常を含む（"gaps" など、detect_anomalies() 参照）
+        """
+        where = []
+        params = []
+        for column, value in (("mode", mode), ("direction", direction)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("start_time >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("start_time < ?")
+            params.append(until)
+        if min_peak_current is not None:
+            where.append("peak_current >= ?")
+            params.append(min_peak_current)
+        if anomaly is not None:
+            where.append("(',' || anomalies || ',') LIKE ?")
+            params.append(f"%,{anomaly},%")
+
+        sql = "SELECT * FROM sessions"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY start_time"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def count(self):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        finally:
+            conn.close()
+
+
+def _format_rows(rows):
+    lines = []
+    for row in rows:
+        start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["start_time"]))
+        peak = "-" if row["peak_current"] is None else f"{row['peak_current']:.1f}A"
+        energy = "-" if row["energy_j"] is None else f"{row['energy_j']:.0f}J"
+        lines.append(f"{start}  {row['file']:<40} {row['duration'] or 0:7.1f}s  "
+                     f"{row['samples']:6d}  {peak:>7}  {energy:>7}  {row['anomalies']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="セッションログのカタログ（SQLite）")
+    parser.add_argument("db", help="カタログのファイル（例: /media/pi/.../log/sessions.db）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_scan = sub.add_parser("scan", help="ディレクトリ内の未登録・変更されたログを登録")
+    p_scan.add_argument("directory")
+    p_query = sub.add_parser("query", help="セッションを検索")
+    p_query.add_argument("--mode", choices=["manual", "auto"])
+    p_query.add_argument("--direction", choices=["forward", "reverse"])
+    p_query.add_argument("--days", type=float, help="直近N日")
+    p_query.add_argument("--min-peak", type=float, help="peak current_motor（A）の下限")
+    p_query.add_argument("--anomaly", help="gaps / time_reset / missing_values / ...")
+    args = parser.parse_args()
+
+    catalog = SessionCatalog(args.db)
+    if args.command == "scan":
+        t0 = time.perf_counter()
+        added = catalog.scan(args.directory)
+        removed = catalog.remove_missing()
+        print(f"[Catalog] {added} added/updated, {removed} removed, {catalog.count()} total "
+              f"({time.perf_counter() - t0:.2f}s)")
+    else:
+        since = time.time() - args.days * 86400 if args.days is not None else None
+        rows = catalog.query(mode=args.mode, direction=args.direction, since=since,
+                             min_peak_current=args.min_peak, anomaly=args.anomaly)
+        if rows:
+            print(_format_rows(rows))
+        print(f"[Catalog] {len(rows)} sessions")
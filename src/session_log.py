@@ -0,0 +1,694 @@
+# src/session_log.py - セッションログの書き込み（CSV / 固定長バイナリ、圧縮可）とCSV変換
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import traceback
+import zlib
+
+from src.vesc_codec import GETVALUES_FIELDS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# バイナリログ
+BINLOG_MAGIC = b"TSBLOG1\n"
+BINLOG_EXT = ".tslog"
+_HEADER_LEN = struct.Struct("<I")
+
+# VESCの値の名前 → (structフォーマット, 除数)
+_VESC_FIELDS = {name: (fmt, divisor) for name, fmt, divisor in GETVALUES_FIELDS}
+
+# 時刻関連の任意列（秒、セッション開始からの単調増加時刻） → (structフォーマット, 除数)
+# t_send: 要求送信, t_recv: 応答受信, rtt: 往復時間（マイクロ秒で保存）
+TIMING_FIELDS = {
+    "t_send": ("q", 1000000),
+    "t_recv": ("q", 1000000),
+    "rtt": ("i", 1000000),
+}
+_TIMING_DIGITS = 6
+
+# 圧縮形式 → 拡張子（Noneは非圧縮）
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+# ===== 圧縮ストリーム =====
+
+_zstd_warned = False
+
+
+def resolve_compression(compression):
+    """圧縮形式を確定（zstandardがなければzstdの代わりにgzip）"""
+    global _zstd_warned
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"unknown compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        if not _zstd_warned:
+            print("[LOG] zstandard is not installed, using gzip")
+            _zstd_warned = True
+        return "gzip"
+    return compression
+
+
+class _ZstdFrameWriter(io.BufferedIOBase):
+    """flush()のたびにzstdフレームを閉じる書き込みストリーム（閉じたフレームは単独で復元可能）"""
+
+    def __init__(self, path, level=ZSTD_LEVEL):
+        self._raw = open(path, "wb")
+        self._writer = zstandard.ZstdCompressor(level=level).stream_writer(self._raw, closefd=False)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._writer.write(data)
+
+    def flush(self):
+        if not self.closed:
+            self._writer.flush(zstandard.FLUSH_FRAME)
+            self._raw.flush()
+
+    def fileno(self):
+        return self._raw.fileno()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._writer.close()
+        finally:
+            self._raw.close()
+            super().close()
+
+
+def open_output(path, compression=None, text=False):
+    """
+    ログ出力用のファイルを開く
+
+    圧縮時はflush()ごとに区切り（gzipはZ_SYNC_FLUSH、zstdはフレーム終端）を書くので、
+    電源断でも失うのは最後のflush以降のデータだけ。
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if compression is None:
+        return open(path, mode="w", newline="") if text else open(path, mode="wb")
+    if compression == "gzip":
+        binary = gzip.open(path, mode="wb", compresslevel=GZIP_LEVEL)
+    else:
+        binary = _ZstdFrameWriter(path)
+    if text:
+        return io.TextIOWrapper(binary, encoding="utf-8", newline="")
+    return binary
+
+
+class _TolerantReader(io.RawIOBase):
+    """
+    途中で切れた圧縮ファイルを、読めたところまでのデータとして扱う
+
+    少しずつ展開して返すので、ファイルが途中で終わっても展開できた分は失わない
+    （GzipFile.read()はEOFErrorのとき、その呼び出しで展開した分も捨ててしまう）。
+    連結された複数のgzipメンバー / zstdフレームも続けて読む。
+    """
+
+    _CHUNK = 64 * 1024
+
+    def __init__(self, raw, new_decompressor, errors):
+        self._raw = raw
+        self._new_decompressor = new_decompressor
+        self._errors = errors
+        self._dec = new_decompressor()
+        # 今のメンバー/フレームにデータを入れたか（終端前にファイルが終わったら切れている）
+        self._in_member = False
+        self._pending = b""
+        self._pos = 0
+        self._eof = False
+        self.truncated = False
+
+    def readable(self):
+        return True
+
+    def _decompress(self, data):
+        out = []
+        while data:
+            self._in_member = True
+            out.append(self._dec.decompress(data))
+            if not getattr(self._dec, "eof", False):
+                break
+            # メンバー/フレームの終端: 残りは次のメンバーとして展開
+            data = self._dec.unused_data
+            self._dec = self._new_decompressor()
+            self._in_member = False
+        return b"".join(out)
+
+    def _fill(self):
+        while self._pos >= len(self._pending) and not self._eof:
+            data = self._raw.read(self._CHUNK)
+            if not data:
+                self._eof = True
+                if self._in_member:
+                    self._mark_truncated("file ended before the end-of-stream marker")
+                return
+            try:
+                self._pending = self._decompress(data)
+            except self._errors as e:
+                self._eof = True
+                self._pending = b""
+                self._mark_truncated(e)
+            self._pos = 0
+
+    def readinto(self, b):
+        self._fill()
+        n = min(len(b), len(self._pending) - self._pos)
+        b[:n] = self._pending[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def _mark_truncated(self, error):
+        self.truncated = True
+        print(f"[LOG] Compressed log ends early, using data up to the last block ({error})")
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+def open_log(path, mode="rt"):
+    """
+    ログファイルを開く（gzip / zstd / 非圧縮を先頭バイトで判別）
+
+    Args:
+        mode: "rt" = テキスト（csvモジュール用）, "rb" = バイナリ
+    """
+    raw = open(path, "rb")
+    magic = raw.read(len(_ZSTD_MAGIC))
+    raw.seek(0)
+    if magic.startswith(_GZIP_MAGIC):
+        stream = io.BufferedReader(_TolerantReader(raw, lambda: zlib.decompressobj(31), zlib.error))
+    elif magic == _ZSTD_MAGIC:
+        if zstandard is None:
+            raw.close()
+            raise RuntimeError(f"{path}: zstandard is required to read .zst logs")
+        dctx = zstandard.ZstdDecompressor()
+        stream = io.BufferedReader(_TolerantReader(raw, dctx.decompressobj, zstandard.ZstdError))
+    else:
+        stream = raw
+    if "t" in mode:
+        return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    return stream
+
+
+class CsvSessionWriter:
+    """
+    従来と同じCSV形式（time列は経過秒を小数3桁に丸める、時刻関連の列は小数6桁）
+
+    write()はバッファに書くだけ。flush()/fsync()のタイミングは
+    BackgroundLogWriterが決める。
+    """
+
+    def __init__(self, path, fields, compression=None, start_time=None, part=1):
+        self.path = path
+        self.fields = list(fields)
+        self.start_time = time.time() if start_time is None else start_time
+        self.part = part
+        self._file = open_output(path, compression, text=True)
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fields)
+        self._writer.writeheader()
+        self._file.flush()
+
+    def write(self, elapsed, record, timing=None):
+        row = {}
+        for field in self.fields:
+            if field == "time":
+                row["time"] = round(elapsed, 3)
+            elif field in record:
+                row[field] = record[field]
+            elif timing and field in timing:
+                row[field] = round(timing[field], _TIMING_DIGITS)
+        self._writer.writerow(row)
+
+    def flush(self):
+        self._file.flush()
+
+    def fsync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BinarySessionWriter:
+    """
+    固定長バイナリ形式のセッションログ
+
+    ファイル構成:
+        BINLOG_MAGIC
+        uint32(LE) ヘッダ長 + JSONヘッダ（csv_fields・値の型と除数・開始時刻）
+        レコード列: int32 経過ミリ秒 + VESCの生の整数値・時刻列（マイクロ秒）
+                    （リトルエンディアン固定長）
+
+    1行ごとの浮動小数点の文字列化をしないので書き込みが速い（CPU負荷が小さい）。
+    サイズはCSVの約0.6倍（main.pyの7列で22B/行、CSVは約37B/行、test/bench_index.py）。
+    容量を減らすならlog_compressionを併用する（gzipでCSVの1/10以下）。
+    binlog_to_csv() で従来のCSVに変換できる。
+    """
+
+    def __init__(self, path, fields, compression=None, start_time=None, part=1):
+        self.path = path
+        self.fields = list(fields)
+        self.start_time = time.time() if start_time is None else start_time
+        self.part = part
+        # バイナリに入れるのはVESCの値と時刻列（timeは別枠、未知の列はCSV変換時に空欄）
+        self.value_fields = [f for f in self.fields if f in _VESC_FIELDS]
+        self.timing_fields = [f for f in self.fields if f in TIMING_FIELDS]
+        specs = dict(_VESC_FIELDS, **TIMING_FIELDS)
+        self._struct = struct.Struct(
+            "<i" + "".join(specs[f][0] for f in self.value_fields + self.timing_fields))
+
+        header = {
+            "version": 1,
+            "time_unit": 0.001,
+            "csv_fields": self.fields,
+            "fields": [
+                {"name": f, "format": specs[f][0], "divisor": specs[f][1]}
+                for f in self.value_fields + self.timing_fields
+            ],
+            "record_format": self._struct.format,
+            "record_size": self._struct.size,
+            "start_time": self.start_time,
+            "part": part,
+        }
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        self._file = open_output(path, compression)
+        self._file.write(BINLOG_MAGIC + _HEADER_LEN.pack(len(header_bytes)) + header_bytes)
+        self._file.flush()
+
+    def write(self, elapsed, record, timing=None):
+        raw = record.raw_value
+        values = []
+        for field in self.value_fields:
+            try:
+                values.append(raw(field))
+            except KeyError:
+                # 応答に含まれていない値は0
+                values.append(0)
+        for field in self.timing_fields:
+            value = timing.get(field) if timing else None
+            # CSVの列（小数6桁）と同じ精度
+            values.append(0 if value is None else round(round(value, _TIMING_DIGITS) * 1000000))
+        # CSVのtime列（小数3桁）と同じ精度
+        self._file.write(self._struct.pack(round(round(elapsed, 3) * 1000), *values))
+
+    def flush(self):
+        self._file.flush()
+
+    def fsync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+LOG_FORMATS = {
+    "csv": (CsvSessionWriter, ".csv"),
+    "bin": (BinarySessionWriter, BINLOG_EXT),
+}
+
+
+def log_extension(fmt, compression=None):
+    """ログ形式・圧縮形式に対応する拡張子（例: ".csv.gz"）"""
+    return LOG_FORMATS[fmt][1] + COMPRESSIONS[resolve_compression(compression)]
+
+
+def strip_log_extension(path):
+    """ログの拡張子（圧縮の拡張子を含む）を除いたパス"""
+    for ext in COMPRESSIONS.values():
+        if ext and path.endswith(ext):
+            path = path[:-len(ext)]
+            break
+    for _, ext in LOG_FORMATS.values():
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def rotated_path(path, part):
+    """分割ファイル名（1つ目は元の名前、2つ目以降は _p002 などを付ける）"""
+    if part <= 1:
+        return path
+    base = strip_log_extension(path)
+    return f"{base}_p{part:03d}{path[len(base):]}"
+
+
+def open_session_writer(path, fields, fmt="csv", background=True, compression=None,
+                        rotate_bytes=None, rotate_seconds=None, **policy):
+    """
+    ログ形式（"csv" / "bin"）に応じたライターを開く
+
+    compression: None / "gzip" / "zstd"（zstandardがなければgzip）
+    rotate_bytes / rotate_seconds: ファイルサイズ・時間で次のファイル（_p002...）に切り替える
+                                   （background=Trueのみ、time列はセッション開始から連続）
+    background=Trueなら書き込みスレッド付き（BackgroundLogWriter）で返す。
+    policyはBackgroundLogWriterの引数（flush_interval, flush_rows, fsync_interval, queue_size, on_closed）。
+    """
+    try:
+        writer_class = LOG_FORMATS[fmt][0]
+    except KeyError:
+        raise ValueError(f"unknown log format: {fmt}") from None
+    compression = resolve_compression(compression)
+    writer = writer_class(path, fields, compression=compression)
+    if not background:
+        return writer
+
+    def reopen(part):
+        return writer_class(rotated_path(path, part), fields, compression=compression,
+                            start_time=writer.start_time, part=part)
+
+    return BackgroundLogWriter(writer, reopen=reopen, rotate_bytes=rotate_bytes,
+                               rotate_seconds=rotate_seconds, **policy)
+
+
+class BackgroundLogWriter:
+    """
+    書き込みスレッド + 上限付きキューでログを書く
+
+    - write() はキューに積むだけ（満杯なら捨てて数える、呼び出し側は絶対に待たない）
+    - 書き込みスレッドがまとめて書き、flush_interval秒 / flush_rows行ごとにflush
+    - fsync_intervalを指定すると、その間隔でfsync（USBメモリの抜去・電源断対策）
+    - 遅いUSBメモリでもテレメトリ取得のループは止まらない
+    - rotate_bytes / rotate_seconds を超えたら、次の行が来たときにreopen(part)で次のファイルへ切り替え
+      （ファイルを開くのも書き込みスレッドなので取得ループは止まらない。
+      切り替え直後に閉じても中身のないファイルは残らない）
+    - on_closed(paths) は最後のファイルを閉じた後に書き込みスレッドで呼ばれる
+      （close(wait=True)はこれも待つので、閉じたログを読む重い処理は
+      src.session_postprocessのように別スレッドへ渡す）
+
+    使い方:
+        writer = BackgroundLogWriter(CsvSessionWriter(path, fields))
+        writer.write(elapsed, record)
+        writer.close()   # 残りを書いてflush/fsyncしてから閉じる
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, writer, flush_interval=1.0, flush_rows=200,
+                 fsync_interval=None, queue_size=4096,
+                 reopen=None, rotate_bytes=None, rotate_seconds=None, on_closed=None):
+        self.writer = writer
+        self.path = writer.path
+        self.paths = [writer.path]
+        self._reopen = reopen
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self._part_opened = time.monotonic()
+        self._part_rows = 0
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.fsync_interval = fsync_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.on_closed = on_closed
+
+        # 統計
+        self.queued_count = 0
+        self.written_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+        self.max_depth = 0
+        self.flush_count = 0
+        self.flush_sum = 0.0
+        self.flush_max = 0.0
+        self.fsync_count = 0
+        self.fsync_max = 0.0
+
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def write(self, elapsed, record, timing=None):
+        try:
+            self._queue.put_nowait((elapsed, record, timing))
+        except queue.Full:
+            self.dropped_count += 1
+            return
+        self.queued_count += 1
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def depth(self):
+        """キューに残っている行数"""
+        return self._queue.qsize()
+
+    def close(self, timeout=5.0, wait=True):
+        """
+        残りを書き出してからファイルを閉じる
+
+        wait=Falseなら終了要求を積むだけで戻る（書き込みスレッドが閉じる）
+        """
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._queue.put(self._CLOSE, timeout=0.1)
+                break
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    print("[LogWriter] Close timed out (queue full)")
+                    break
+        if wait:
+            self._thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._thread = None
+
+    def stats_line(self):
+        avg = self.flush_sum / self.flush_count * 1000 if self.flush_count else 0.0
+        return (f"rows={self.written_count}/{self.queued_count}, dropped={self.dropped_count}, "
+                f"max_depth={self.max_depth}, flush={self.flush_count} "
+                f"avg={avg:.2f}ms max={self.flush_max * 1000:.2f}ms, "
+                f"fsync={self.fsync_count} max={self.fsync_max * 1000:.2f}ms, "
+                f"files={len(self.paths)}")
+
+    # ===== 書き込みスレッド =====
+
+    def _flush(self, sync):
+        t0 = time.monotonic()
+        if sync:
+            self.writer.fsync()
+            elapsed = time.monotonic() - t0
+            self.fsync_count += 1
+            if elapsed > self.fsync_max:
+                self.fsync_max = elapsed
+        else:
+            self.writer.flush()
+            elapsed = time.monotonic() - t0
+        self.flush_count += 1
+        self.flush_sum += elapsed
+        if elapsed > self.flush_max:
+            self.flush_max = elapsed
+
+    def _rotate_due(self, now, check_size=True):
+        # 1行も書いていないファイルからは切り替えない
+        if self._reopen is None or not self._part_rows:
+            return False
+        if self.rotate_seconds is not None and now - self._part_opened >= self.rotate_seconds:
+            return True
+        # サイズはflush後でないと正しくないので、flush時だけ見る
+        if check_size and self.rotate_bytes is not None:
+            try:
+                return os.path.getsize(self.writer.path) >= self.rotate_bytes
+            except OSError:
+                return False
+        return False
+
+    def _rotate(self, now):
+        """次のファイルを開いてから現在のファイルを閉じる"""
+        try:
+            new = self._reopen(len(self.paths) + 1)
+        except Exception as e:
+            # 開けなければ今のファイルに書き続ける
+            self.error_count += 1
+            self._reopen = None
+            print(f"[LogWriter Error] rotate: {e} (rotation disabled)")
+            return False
+        old = self.writer
+        self.writer = new
+        self.paths.append(new.path)
+        self._part_opened = now
+        self._part_rows = 0
+        if self.fsync_interval:
+            old.fsync()
+        old.close()
+        print(f"[LogWriter] Rotated to {new.path}")
+        return True
+
+    def _next_timeout(self, unflushed, unsynced, next_flush, next_fsync):
+        """次にflush/fsyncが必要になるまでの時間（不要ならNone）"""
+        deadlines = []
+        if unflushed:
+            deadlines.append(next_flush)
+        if unsynced and next_fsync is not None:
+            deadlines.append(next_fsync)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _loop(self):
+        now = time.monotonic()
+        next_flush = now + self.flush_interval
+        next_fsync = now + self.fsync_interval if self.fsync_interval else None
+        unflushed = 0
+        unsynced = False
+        closing = False
+        # 切り替えは次の行を書く直前に行う（閉じる直前に空のファイルを作らない）
+        rotate_pending = False
+        while not closing:
+            timeout = self._next_timeout(unflushed, unsynced, next_flush, next_fsync)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            # 溜まっている分をまとめて書く
+            while item is not None:
+                if item is self._CLOSE:
+                    closing = True
+                    break
+                if rotate_pending or self._rotate_due(time.monotonic(), check_size=False):
+                    rotate_pending = False
+                    try:
+                        if self._rotate(time.monotonic()):
+                            unsynced = False
+                    except Exception as e:
+                        self.error_count += 1
+                        print(f"[LogWriter Error] rotate: {e}")
+                try:
+                    self.writer.write(*item)
+                    self.written_count += 1
+                    self._part_rows += 1
+                    unflushed += 1
+                except Exception as e:
+                    self.error_count += 1
+                    if self.error_count == 1:
+                        print(f"[LogWriter Error] {e}")
+                        traceback.print_exc()
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            now = time.monotonic()
+            flush = closing or unflushed >= self.flush_rows or (unflushed and now >= next_flush)
+            sync = next_fsync is not None and (unflushed or unsynced) and (closing or now >= next_fsync)
+            if not (flush or sync):
+                continue
+            try:
+                self._flush(sync)
+            except Exception as e:
+                self.error_count += 1
+                print(f"[LogWriter Error] flush: {e}")
+            unflushed = 0
+            unsynced = next_fsync is not None and not sync
+            next_flush = now + self.flush_interval
+            if sync:
+                next_fsync = now + self.fsync_interval
+
+            if not closing and self._rotate_due(now):
+                rotate_pending = True
+
+        try:
+            self.writer.close()
+        except Exception as e:
+            print(f"[LogWriter Error] close: {e}")
+        if self.on_closed is not None:
+            try:
+                self.on_closed(list(self.paths))
+            except Exception as e:
+                print(f"[LogWriter Error] on_closed: {e}")
+
+
+# ===== バイナリログの読み込み・変換 =====
+
+def read_binlog_header(f):
+    """ファイル先頭からヘッダを読む（fは位置がレコード先頭に進む）"""
+    magic = f.read(len(BINLOG_MAGIC))
+    if magic != BINLOG_MAGIC:
+        raise ValueError("not a binary session log")
+    (length,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+    return json.loads(f.read(length).decode("utf-8"))
+
+
+def iter_binlog(path):
+    """
+    バイナリログを読む（圧縮されていても可）
+
+    Yields:
+        header（最初の1回）の後、(経過ミリ秒, 生の整数値タプル)
+    """
+    with open_log(path, "rb") as f:
+        header = read_binlog_header(f)
+        yield header
+        record = struct.Struct(header["record_format"])
+        while True:
+            chunk = f.read(record.size * 1024)
+            if not chunk:
+                break
+            # 電源断などで途中までしか書かれていない末尾レコードは捨てる
+            usable = len(chunk) - len(chunk) % record.size
+            for values in record.iter_unpack(chunk[:usable]):
+                yield values[0], values[1:]
+            if usable < len(chunk):
+                break
+
+
+def binlog_to_csv(src, dst=None):
+    """
+    バイナリログを従来のCSV（VESCReaderが書くものと同じ内容）に変換
+
+    Returns:
+        (出力ファイルパス, 行数)
+    """
+    if dst is None:
+        dst = strip_log_extension(src) + ".csv"
+
+    records = iter_binlog(src)
+    header = next(records)
+    csv_fields = header["csv_fields"]
+    names = [f["name"] for f in header["fields"]]
+    divisors = [f["divisor"] for f in header["fields"]]
+
+    rows = 0
+    with open(dst, mode="w", newline="") as out:
+        writer = csv.DictWriter(out, fieldnames=csv_fields)
+        writer.writeheader()
+        time_unit = header["time_unit"]
+        for ticks, raw in records:
+            row = {"time": round(ticks * time_unit, 3)} if "time" in csv_fields else {}
+            for name, divisor, value in zip(names, divisors, raw):
+                row[name] = value if divisor is None else value / divisor
+            writer.writerow(row)
+            rows += 1
+    return dst, rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="バイナリセッションログ(.tslog / .tslog.gz)をCSVに変換")
+    parser.add_argument("files", nargs="+", help="変換する.tslogファイル")
+    args = parser.parse_args()
+
+    for path in args.files:
+        dst, rows = binlog_to_csv(path)
+        print(f"{path} -> {dst} ({rows} rows)")
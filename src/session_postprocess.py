@@ -0,0 +1,89 @@
+# src/session_postprocess.py - ログを閉じた後の処理（時刻インデックス・カタログ登録・ピラミッド作成）
+import queue
+import sqlite3
+import threading
+
+
+class SessionPostProcessor:
+    """
+    閉じたログの後処理を専用スレッドで順に行う
+
+    on_closed（書き込みスレッド）からはキューに積むだけで戻るので、
+    close_session()・open_session()の切り替えやモーター停止が
+    ログの読み込み・集計（長いログでは数秒）を待たない。
+    """
+
+    def __init__(self, hooks):
+        self.hooks = hooks
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def __call__(self, paths):
+        self._queue.put(list(paths))
+
+    def join(self):
+        """積まれた処理がすべて終わるまで待つ"""
+        self._queue.join()
+
+    def _loop(self):
+        while True:
+            paths = self._queue.get()
+            for name, hook in self.hooks:
+                try:
+                    hook(paths)
+                except Exception as e:
+                    print(f"[PostProcess Error] {name}: {e}")
+            self._queue.task_done()
+
+
+def make_session_hook(catalog_db=None, max_duty=None, pyramid_levels=None, index_interval=None):
+    """
+    VESCReader.on_session_closed に設定するコールバックを作る
+
+    処理はSessionPostProcessorのスレッドで行うので、ログのclose()は待たされない。
+    NumPyがない・DBが開けない等の場合はその処理だけ無効にする。
+
+    Args:
+        catalog_db: セッションカタログ（SQLite）のパス。Noneで登録しない
+        max_duty: カタログに記録するMAX_DUTY
+        pyramid_levels: ピラミッドの区間（秒）のリスト。None/空で作らない
+        index_interval: 時刻インデックスの間隔（秒）。Noneで作らない
+
+    Returns:
+        SessionPostProcessor（callable(paths)）。何も有効でなければNone
+    """
+    hooks = []
+    if index_interval:
+        # 標準ライブラリだけで動くので最初に（カタログ・ピラミッドが無効でも作る）
+        from src.log_index import build_index
+
+        def build_indexes(paths):
+            for path in paths:
+                try:
+                    build_index(path, index_interval)
+                except (ValueError, OSError, RuntimeError) as e:
+                    print(f"[Index] Skipped {path}: {e}")
+
+        hooks.append(("index", build_indexes))
+
+    if catalog_db is not None:
+        try:
+            from src.session_catalog import SessionCatalog
+            catalog = SessionCatalog(catalog_db)
+        except (ImportError, OSError, sqlite3.Error) as e:
+            print(f"[Catalog] Disabled: {e}")
+        else:
+            hooks.append(("catalog", lambda paths: catalog.add_session(paths, max_duty=max_duty)))
+
+    if pyramid_levels:
+        try:
+            from src.log_pyramid import build_pyramids
+        except ImportError as e:
+            print(f"[Pyramid] Disabled: {e}")
+        else:
+            hooks.append(("pyramid", lambda paths: build_pyramids(paths, pyramid_levels)))
+
+    if not hooks:
+        return None
+    return SessionPostProcessor(hooks)
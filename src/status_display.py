@@ -0,0 +1,132 @@
+# src/status_display.py - 最新値を一定周期で1行表示（サンプルごとのprintをやめる）
+import sys
+import threading
+import time
+
+# 表示する値と書式（値がない場合は表示しない）
+STATUS_FORMATS = [
+    ("duty", "duty={:.3f}"),
+    ("rpm", "rpm={:.0f}"),
+    ("v_in", "{:.1f}V"),
+    ("current_in", "Iin={:.2f}A"),
+    ("current_motor", "Imot={:.2f}A"),
+    ("temp_fet", "FET={:.1f}C"),
+]
+
+
+class StatusDisplay:
+    """
+    最新のテレメトリをメモリに保持し、別スレッドで一定周期（rate Hz）に1行表示する
+
+    - update() は参照を置き換えるだけなので、取得ループは端末の速さに左右されない
+    - 端末（tty）では同じ行を上書き、ファイルやjournalへの出力では
+      log_interval秒ごとに1行（常時ポーリングでもログを埋め尽くさない）
+    - stale_after秒以上サンプルが来なければ NO DATA と表示
+    - 出力先は表示のたびにsys.stdoutを見る（redirect_stdoutが効く）
+
+    使い方:
+        display = StatusDisplay(rate=4.0)
+        display.start()
+        display.update(count, parsed, rtt)
+        display.stop()
+    """
+
+    def __init__(self, rate=4.0, stream=None, stale_after=0.5, log_interval=60.0):
+        self.rate = rate
+        self._stream = stream
+        self.stale_after = stale_after
+        self.log_interval = log_interval
+
+        # (サンプル数, 値, RTT, 受信時刻) をまとめて置き換える
+        self._latest = None
+        # レート計算用の通算サンプル数（countはセッションごとに0に戻るので使わない）
+        self._received = 0
+        self._stop_flag = threading.Event()
+        self._thread = None
+        self._last_received = 0
+        self._last_render = None
+
+    @property
+    def stream(self):
+        return self._stream if self._stream is not None else sys.stdout
+
+    def _is_tty(self):
+        stream = self.stream
+        try:
+            return stream.isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def update(self, count, values, rtt=None):
+        """最新サンプルを登録（取得スレッドから呼ぶ）"""
+        self._latest = (count, values, rtt, time.monotonic())
+        self._received += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._latest = None
+        self._last_received = self._received
+        self._last_render = time.monotonic()
+        self._stop_flag.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_flag.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+        tty = self._is_tty()
+        self._render(tty)
+        if tty:
+            self._write("\n")
+
+    def format_line(self, now=None):
+        """表示する1行を作る"""
+        now = time.monotonic() if now is None else now
+        latest = self._latest
+        if latest is None:
+            return "[STATUS] waiting for data..."
+
+        count, values, rtt, t_recv = latest
+        elapsed = now - self._last_render
+        rate = (self._received - self._last_received) / elapsed if elapsed > 0 else 0.0
+
+        parts = [f"[STATUS] #{count}"]
+        for name, fmt in STATUS_FORMATS:
+            if name in values:
+                parts.append(fmt.format(values[name]))
+        parts.append(f"{rate:.1f}/s")
+        if rtt is not None:
+            parts.append(f"rtt={rtt * 1000:.1f}ms")
+        if now - t_recv > self.stale_after:
+            parts.append(f"NO DATA {now - t_recv:.1f}s")
+        return " ".join(parts)
+
+    def _write(self, text):
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def _render(self, tty):
+        now = time.monotonic()
+        received = self._received
+        line = self.format_line(now)
+        self._last_received = received
+        self._last_render = now
+        if tty:
+            # 行頭に戻って行末まで消去してから書く
+            self._write("\r\x1b[K" + line)
+        else:
+            self._write(line + "\n")
+
+    def _loop(self):
+        period = 1.0 / self.rate
+        while not self._stop_flag.wait(period):
+            tty = self._is_tty()
+            if tty or time.monotonic() - self._last_render >= self.log_interval:
+                self._render(tty)
@@ -0,0 +1,258 @@
+# src/transport.py - シリアルポート専有スレッド + 優先度付き送信キュー
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+import traceback
+
+from src.metrics import collect_rx_metrics
+from src.vesc_codec import FrameDecoder
+
+# 送信優先度（小さいほど先に送信）
+PRIO_STOP = 0       # 停止・安全系フレーム
+PRIO_COMMAND = 1    # Duty/電流指令
+PRIO_POLL = 2       # テレメトリ要求（空き時間に送信）
+
+PRIORITY_NAMES = {PRIO_STOP: "stop", PRIO_COMMAND: "command", PRIO_POLL: "poll"}
+
+
+class SerialTransport:
+    """
+    シリアルポートを1スレッドで専有する送受信クラス
+
+    - send(frame, priority) でキューに積み、I/Oスレッドが優先度順に書き込む
+    - 受信はFrameDecoderで分解し、コマンドIDごとの購読者に配送する
+    - DutyController/Readerがserial_lockを奪い合う必要がなくなる
+
+    使い方:
+        transport = SerialTransport(ser)
+        transport.subscribe(COMM_GET_VALUES, callback)  # callback(payload, t_recv)
+        transport.start()
+        transport.send(frame, PRIO_COMMAND)
+        transport.send(frame, PRIO_POLL, on_sent=callback)  # 実際に書き込んだ時刻を受け取る
+    """
+
+    def __init__(self, ser, poll_timeout=0.05):
+        self.ser = ser
+        self.poll_timeout = poll_timeout
+        self.rx = FrameDecoder()
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._queue_lock = threading.Lock()
+        self._subscribers = {}
+
+        self._stop_flag = threading.Event()
+        self._thread = None
+        self._wake_r = None
+        self._wake_w = None
+
+        # 統計（優先度ごと：送信数・キュー待ち時間の合計/最大）
+        self.sent_count = {p: 0 for p in PRIORITY_NAMES}
+        self.dropped_count = {p: 0 for p in PRIORITY_NAMES}
+        self.wait_sum = {p: 0.0 for p in PRIORITY_NAMES}
+        self.wait_max = {p: 0.0 for p in PRIORITY_NAMES}
+        self.unrouted_count = 0
+
+    # ===== 外部API（任意のスレッドから呼べる） =====
+
+    def subscribe(self, cmd_id, callback):
+        """
+        コマンドIDの応答を購読（callbackはI/Oスレッドで呼ばれるので短く保つ）
+
+        Args:
+            cmd_id: ペイロード先頭のコマンドID
+            callback: callback(payload, t_recv) t_recvはtime.monotonic()
+        """
+        self._subscribers.setdefault(cmd_id, []).append(callback)
+
+    def unsubscribe(self, cmd_id, callback):
+        callbacks = self._subscribers.get(cmd_id, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def send(self, frame, priority=PRIO_COMMAND, on_sent=None):
+        """
+        フレームを送信キューに積む
+
+        Args:
+            on_sent: on_sent(t_write) 書き込み直後にI/Oスレッドで呼ばれる
+                     （t_writeはtime.monotonic()、キュー待ちを含まない送信時刻）
+        """
+        with self._queue_lock:
+            heapq.heappush(self._queue, (priority, next(self._seq), time.monotonic(), frame, on_sent))
+        self._wake()
+
+    def discard_pending(self, min_priority=PRIO_COMMAND):
+        """
+        未送信のフレームのうち優先度がmin_priority以下（数値が以上）のものを破棄
+
+        停止フレーム（PRIO_STOP）はデフォルトでは破棄しない。
+        reset_output_buffer()の代わりに使う（受信中のテレメトリは捨てない）。
+        """
+        with self._queue_lock:
+            kept = []
+            for item in self._queue:
+                if item[0] >= min_priority:
+                    self.dropped_count[item[0]] += 1
+                else:
+                    kept.append(item)
+            heapq.heapify(kept)
+            self._queue = kept
+
+    def pending(self):
+        """未送信フレーム数"""
+        with self._queue_lock:
+            return len(self._queue)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_flag.clear()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        # パイプが詰まっても制御スレッドのsend()が止まらないように
+        os.set_blocking(self._wake_w, False)
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        print("[Transport] Started")
+
+    def stop(self, timeout=3.0):
+        """I/Oスレッド停止（キューに残ったフレームは送信してから終了）"""
+        if self._thread is None:
+            return
+        self._stop_flag.set()
+        self._wake()
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            # I/Oスレッドがまだパイプを使うので閉じない（再度stop()で待てる）
+            print(f"[Transport] I/O thread did not stop within {timeout}s")
+            return
+        self._thread = None
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        self._wake_r = self._wake_w = None
+        print(f"[Transport] Stopped. {self.stats_line()}")
+
+    def stats_line(self):
+        parts = []
+        for prio, name in PRIORITY_NAMES.items():
+            n = self.sent_count[prio]
+            avg = self.wait_sum[prio] / n * 1000 if n else 0.0
+            parts.append(f"{name}: sent={n} dropped={self.dropped_count[prio]} "
+                         f"wait avg={avg:.2f}ms max={self.wait_max[prio] * 1000:.2f}ms")
+        return ", ".join(parts) + (f", crc_fail={self.rx.crc_fail_count}, "
+                                   f"unrouted={self.unrouted_count}")
+
+    def collect_metrics(self, w):
+        """MetricsServerから呼ばれる（送信キューの待ち時間がserial_lockの待ちに相当）"""
+        w.gauge("vesc_transport_pending", "Frames waiting in the send queue", self.pending())
+        for prio, name in PRIORITY_NAMES.items():
+            w.counter("vesc_transport_sent_total", "Frames written to the serial port",
+                      self.sent_count[prio], priority=name)
+            w.counter("vesc_transport_dropped_total", "Queued frames discarded before sending",
+                      self.dropped_count[prio], priority=name)
+            w.counter("vesc_transport_queue_wait_seconds_total", "Time frames spent in the send queue",
+                      self.wait_sum[prio], priority=name)
+            w.gauge("vesc_transport_queue_wait_max_seconds", "Longest time a frame spent in the send queue",
+                    self.wait_max[prio], priority=name)
+        w.counter("vesc_transport_unrouted_total", "Received frames with no subscriber",
+                  self.unrouted_count)
+        collect_rx_metrics(w, self.rx)
+
+    # ===== I/Oスレッド =====
+
+    def _wake(self):
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b"\0")
+            except BlockingIOError:
+                pass  # 既に起床データが溜まっている
+            except OSError:
+                pass
+
+    def _pop(self):
+        with self._queue_lock:
+            if self._queue:
+                return heapq.heappop(self._queue)
+        return None
+
+    def _write_pending(self):
+        """キューが空になるまで優先度順に書き込む（1フレームごとに受信も確認）"""
+        while True:
+            item = self._pop()
+            if item is None:
+                return
+            priority, _, t_enqueue, frame, on_sent = item
+            self.ser.write(frame)
+            t_write = time.monotonic()
+            if on_sent is not None:
+                on_sent(t_write)
+            wait = t_write - t_enqueue
+            self.sent_count[priority] += 1
+            self.wait_sum[priority] += wait
+            if wait > self.wait_max[priority]:
+                self.wait_max[priority] = wait
+            # 停止フレームの連続送信中も応答を受信時刻どおりに受け取る
+            self._read_available()
+
+    def _read_available(self):
+        waiting = self.ser.in_waiting
+        if waiting <= 0:
+            return
+        if not self.rx.readinto(self.ser, waiting):
+            return
+        t_recv = time.monotonic()
+        for payload in self.rx.decode():
+            callbacks = self._subscribers.get(payload[0])
+            if not callbacks:
+                self.unrouted_count += 1
+                continue
+            for callback in callbacks:
+                try:
+                    callback(payload, t_recv)
+                except Exception as e:
+                    print(f"[Transport] subscriber error: {e}")
+
+    def _wait(self):
+        """受信データ・送信要求・停止のいずれかまで待つ"""
+        try:
+            fd = self.ser.fileno()
+        except Exception:
+            fd = None
+        if fd is None:
+            # fdが取れないポートは短い間隔でポーリング
+            time.sleep(0.002)
+            return
+        try:
+            ready, _, _ = select.select([fd, self._wake_r], [], [], self.poll_timeout)
+        except (OSError, ValueError):
+            time.sleep(0.002)
+            return
+        if self._wake_r in ready:
+            try:
+                while os.read(self._wake_r, 64):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _loop(self):
+        while not self._stop_flag.is_set():
+            try:
+                self._write_pending()
+                self._read_available()
+                if self.pending():
+                    continue
+                self._wait()
+            except Exception as e:
+                print(f"[Transport Error] {e}")
+                traceback.print_exc()
+                time.sleep(0.1)
+
+        # 終了前に残りのフレーム（停止指令など）を送信
+        try:
+            self._write_pending()
+        except Exception as e:
+            print(f"[Transport Error] {e}")
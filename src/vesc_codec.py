@@ -0,0 +1,570 @@
+# src/vesc_codec.py - VESC UARTパケットのエンコード/デコード共通モジュール
+import struct
+
+COMM_GET_VALUES = 4
+COMM_SET_DUTY = 5
+COMM_SET_CURRENT = 6
+COMM_GET_VALUES_SELECTIVE = 50
+
+
+# CRC16計算（CRC-CCITT/XModem: poly 0x1021, init 0）
+def _make_crc16_table():
+    poly = 0x1021
+    table = []
+    for i in range(256):
+        crc = 0
+        c = i << 8
+        for _ in range(8):
+            if (crc ^ c) & 0x8000:
+                crc = ((crc << 1) ^ poly) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+            c = (c << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+CRC16_TABLE = _make_crc16_table()
+
+
+def crc16_py(data: bytes) -> int:
+    """テーブル方式の純Python実装（フォールバック・検証用）"""
+    crc = 0
+    for b in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[((crc >> 8) ^ b) & 0xFF]
+    return crc & 0xFFFF
+
+
+try:
+    from binascii import crc_hqx as _crc_hqx
+except ImportError:
+    _crc_hqx = None
+
+
+def crc16_c(data: bytes) -> int:
+    """binascii.crc_hqx（C実装）によるCRC16"""
+    return _crc_hqx(data, 0)
+
+
+def _select_crc16():
+    """C実装が純Python実装と一致する場合のみ採用"""
+    if _crc_hqx is None:
+        return crc16_py, "python"
+    samples = (b"123456789", bytes(range(256)), bytes([COMM_GET_VALUES]))
+    try:
+        if all(crc16_c(s) == crc16_py(s) for s in samples):
+            return crc16_c, "binascii"
+    except Exception:
+        pass
+    return crc16_py, "python"
+
+
+crc16, CRC16_BACKEND = _select_crc16()
+
+
+def build_packet(payload: bytes) -> bytes:
+    if len(payload) < 256:
+        header = bytes([0x02, len(payload)])
+    else:
+        header = bytes([0x03, (len(payload) >> 8) & 0xFF, len(payload) & 0xFF])
+    crc = crc16(payload)
+    crc_bytes = bytes([(crc >> 8) & 0xFF, crc & 0xFF])
+    return header + payload + crc_bytes + bytes([0x03])
+
+
+# ===== コマンドフレーム =====
+# pyvescのSetDutyCycle/SetCurrent + encode()と同一のバイト列を生成する
+
+_CMD_INT32 = struct.Struct('>Bi')
+
+
+def encode_duty_raw(duty_int):
+    """SetDutyCycle相当（duty_int: ±100000 = ±100%）"""
+    return build_packet(_CMD_INT32.pack(COMM_SET_DUTY, duty_int))
+
+
+def encode_duty(duty):
+    """Duty指令フレーム（duty: %）"""
+    return encode_duty_raw(int(duty * 1000))
+
+
+def encode_current(current):
+    """電流指令フレーム（current: A）"""
+    return build_packet(_CMD_INT32.pack(COMM_SET_CURRENT, int(current * 1000)))
+
+
+# 固定フレーム（一度だけエンコード）
+GET_VALUES_FRAME = build_packet(bytes([COMM_GET_VALUES]))
+DUTY_ZERO_FRAME = encode_duty_raw(0)
+CURRENT_ZERO_FRAME = encode_current(0)
+
+
+class DutyFrameTable:
+    """
+    量子化したDuty指令フレームの事前エンコード表
+
+    - -max_duty〜+max_duty を resolution[%] 刻みでエンコードしておく
+    - frame(duty) は最も近い刻みのフレームを返す（範囲外はその場でエンコード）
+    """
+
+    def __init__(self, max_duty, resolution=0.1):
+        self.resolution = resolution
+        # 1刻みあたりのduty_int（0.1% → 100）
+        self._unit = int(round(resolution * 1000))
+        self._scale = 1.0 / resolution
+        self._offset = int(round(abs(max_duty) * self._scale))
+        self._frames = [
+            encode_duty_raw((i - self._offset) * self._unit)
+            for i in range(2 * self._offset + 1)
+        ]
+
+    def __len__(self):
+        return len(self._frames)
+
+    def frame(self, duty):
+        """duty[%]に対応するフレーム"""
+        i = int(round(duty * self._scale)) + self._offset
+        if 0 <= i < len(self._frames):
+            return self._frames[i]
+        return encode_duty(duty)
+
+
+# 受け付ける最大ペイロード長（VESCのPACKET_MAX_PL_LEN相当）
+MAX_PAYLOAD_LEN = 512
+
+
+def scan_packets(view, max_payload=MAX_PAYLOAD_LEN):
+    """
+    memoryview上でパケットを走査（バッファのコピーなし）
+
+    長さ0・max_payload超のヘッダはFrameDecoderと同じく偽スタートとして
+    1バイト進める（0x03の後の長さ次第で最大64KB待ち続けないように）
+
+    Returns:
+        (packets, consumed, skipped)
+        packets: ペイロード（bytes）のリスト
+        consumed: 先頭から処理済みのバイト数（不完全パケットの手前まで）
+        skipped: consumedのうちパケットとして使われなかったバイト数
+    """
+    packets = []
+    used = 0
+    n = len(view)
+    i = 0
+    while i < n:
+        start_byte = view[i]
+        if start_byte == 0x02 or start_byte == 0x03:
+            header_len = start_byte
+            if i + header_len > n:
+                break
+            if header_len == 2:
+                length = view[i + 1]
+            else:
+                length = (view[i + 1] << 8) | view[i + 2]
+            if length == 0 or length > max_payload:
+                i += 1
+                continue
+            packet_len = header_len + length + 2 + 1
+            if i + packet_len > n:
+                break
+            if view[i + packet_len - 1] == 0x03:
+                body = i + header_len
+                payload = view[body:body + length]
+                crc_received = (view[body + length] << 8) | view[body + length + 1]
+                if crc16(payload) == crc_received:
+                    packets.append(bytes(payload))
+                    used += packet_len
+                    i += packet_len
+                else:
+                    i += 1
+            else:
+                i += 1
+        else:
+            i += 1
+    return packets, i, i - used
+
+
+def extract_packets(buf: bytes):
+    packets, consumed, _ = scan_packets(memoryview(buf))
+    return packets, bytes(buf[consumed:])
+
+
+# 受信バッファサイズ（GET_VALUES応答は80B弱なので十分な余裕）
+RX_BUFFER_SIZE = 4096
+class RxRingBuffer:
+    """
+    固定長の受信バッファ（bytearray + memoryview）
+
+    - ser.readinto() で直接書き込み、読み取りごとのbytes再確保をしない
+    - 処理済み位置を進めるだけで、前詰めは空き不足時のみ
+    - 容量を超えた場合は古いデータから破棄（overflow_count/discarded_bytesに記録）
+    """
+
+    def __init__(self, size=RX_BUFFER_SIZE):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+        # 診断カウンタ
+        self.overflow_count = 0
+        self.discarded_bytes = 0
+        self.skipped_bytes = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def capacity(self):
+        return len(self._buf)
+
+    def clear(self):
+        """未処理データを破棄（カウンタはリセットしない）"""
+        self._start = 0
+        self._end = 0
+
+    def reset(self):
+        """未処理データとカウンタをリセット"""
+        self.clear()
+        self.overflow_count = 0
+        self.discarded_bytes = 0
+        self.skipped_bytes = 0
+
+    def view(self):
+        """未処理データのmemoryview（次の書き込みまで有効）"""
+        return self._view[self._start:self._end]
+
+    def _reserve(self, n):
+        """末尾にnバイトの空きを確保し、実際に確保できたバイト数を返す"""
+        size = len(self._buf)
+        n = min(n, size)
+        if self._start == self._end:
+            self._start = self._end = 0
+        if self._end + n <= size:
+            return n
+
+        # 空き不足 → 古いデータを破棄してから前詰め
+        pending = self._end - self._start
+        overflow = pending + n - size
+        if overflow > 0:
+            self._discard(overflow)
+            pending -= overflow
+        self._buf[:pending] = self._view[self._start:self._end].tobytes()
+        self._start = 0
+        self._end = pending
+        return n
+
+    def _discard(self, n):
+        """オーバーフロー時に先頭nバイトを破棄"""
+        self._start += n
+        self.overflow_count += 1
+        self.discarded_bytes += n
+
+    def readinto(self, ser, n):
+        """シリアルから最大nバイトを直接バッファへ読み込む"""
+        n = self._reserve(n)
+        if n <= 0:
+            return 0
+        got = ser.readinto(self._view[self._end:self._end + n]) or 0
+        self._end += got
+        return got
+
+    def feed(self, data):
+        """任意のバイト列を追加（シリアル以外の入力用）"""
+        data = memoryview(data)
+        while len(data) > 0:
+            n = self._reserve(len(data))
+            self._view[self._end:self._end + n] = data[:n]
+            self._end += n
+            data = data[n:]
+
+    def extract(self):
+        """完全なパケットを取り出し、処理済み部分を解放"""
+        if self._start == self._end:
+            return []
+        packets, consumed, skipped = scan_packets(self._view[self._start:self._end])
+        self._start += consumed
+        self.skipped_bytes += skipped
+        return packets
+
+
+class FrameDecoder(RxRingBuffer):
+    """
+    再開可能なストリーミングパケットデコーダ（ステートマシン）
+
+    - ショート(0x02, 長さ1B)・ロング(0x03, 長さ2B)の両方に対応
+    - ヘッダ解析済みの状態を保持し、不完全なパケットを毎回先頭から再走査しない
+    - パケット以外のバイトはbytearray.find()でまとめて読み飛ばす
+    - feed()/readinto()で追加 → decode()で完成したペイロードを順次返す
+    """
+
+    def __init__(self, size=RX_BUFFER_SIZE, max_payload=MAX_PAYLOAD_LEN):
+        super().__init__(size)
+        self.max_payload = min(max_payload, size - 6)
+        # 先頭パケット候補の全長（0 = ヘッダ未解析）
+        self._frame_len = 0
+        self._header_len = 0
+
+        self.packet_count = 0
+        self.crc_fail_count = 0
+        self.oversize_count = 0
+
+    def clear(self):
+        super().clear()
+        self._frame_len = 0
+
+    def reset(self):
+        super().reset()
+        self.packet_count = 0
+        self.crc_fail_count = 0
+        self.oversize_count = 0
+
+    def _discard(self, n):
+        super()._discard(n)
+        # 先頭が破棄されたので候補を解析し直す
+        self._frame_len = 0
+
+    def _skip(self, n):
+        self._start += n
+        self.skipped_bytes += n
+        self._frame_len = 0
+
+    def decode(self):
+        """完成したペイロード（bytes）を順次返すジェネレータ"""
+        buf = self._buf
+        while self._start < self._end:
+            start = self._start
+            end = self._end
+
+            if self._frame_len == 0:
+                # スタートバイト探索（0x02/0x03以外はまとめて破棄）
+                first = buf[start]
+                if first != 0x02 and first != 0x03:
+                    short = buf.find(b'\x02', start, end)
+                    long_ = buf.find(b'\x03', start, end)
+                    nxt = min(p for p in (short, long_, end) if p >= 0)
+                    self._skip(nxt - start)
+                    continue
+
+                # ヘッダ解析
+                header_len = first
+                if end - start < header_len:
+                    return
+                if header_len == 2:
+                    length = buf[start + 1]
+                else:
+                    length = (buf[start + 1] << 8) | buf[start + 2]
+                if length == 0 or length > self.max_payload:
+                    # 空/長すぎるパケットは偽スタートとみなす
+                    if length:
+                        self.oversize_count += 1
+                    self._skip(1)
+                    continue
+                frame_len = header_len + length + 3
+                self._header_len = header_len
+                self._frame_len = frame_len
+
+            frame_len = self._frame_len
+            if end - start < frame_len:
+                # 不完全 → 状態を保持したまま次のfeedを待つ
+                return
+
+            body = start + self._header_len
+            tail = start + frame_len
+            if buf[tail - 1] == 0x03:
+                payload = self._view[body:tail - 3]
+                crc_received = (buf[tail - 3] << 8) | buf[tail - 2]
+                if crc16(payload) == crc_received:
+                    self._start = tail
+                    self._frame_len = 0
+                    self.packet_count += 1
+                    yield payload.tobytes()
+                    continue
+                self.crc_fail_count += 1
+
+            # 偽スタートバイト → 1バイト進めて再同期
+            self._skip(1)
+
+    def extract(self):
+        """完成したペイロードをリストで取り出す"""
+        return list(self.decode())
+
+
+# GET_VALUES応答のフィールド定義（VESC 6.x、コマンドIDの後ろから順に）
+# (名前, structフォーマット, 除数) 除数がNoneのフィールドは整数のまま
+GETVALUES_FIELDS = (
+    ('temp_fet', 'h', 10.0),
+    ('temp_motor', 'h', 10.0),
+    ('current_motor', 'i', 100.0),
+    ('current_in', 'i', 100.0),
+    ('id', 'i', 100.0),
+    ('iq', 'i', 100.0),
+    ('duty', 'h', 1000.0),
+    ('rpm', 'i', None),
+    ('v_in', 'h', 10.0),
+    ('amp_hours', 'i', 10000.0),
+    ('amp_hours_charged', 'i', 10000.0),
+    ('watt_hours', 'i', 10000.0),
+    ('watt_hours_charged', 'i', 10000.0),
+    ('tachometer', 'i', None),
+    ('tachometer_abs', 'i', None),
+    ('fault_code', 'B', None),
+    ('pid_pos', 'i', 1000000.0),
+    ('controller_id', 'B', None),
+    ('temp_mos1', 'h', 10.0),
+    ('temp_mos2', 'h', 10.0),
+    ('temp_mos3', 'h', 10.0),
+    ('vd', 'i', 1000.0),
+    ('vq', 'i', 1000.0),
+    ('status', 'B', None),
+)
+
+# ファームウェアにより応答が途中で終わるため、区切り位置ごとにレイアウトを用意
+# （watt_hours_charged / tachometer_abs / fault_code / pid_pos / controller_id /
+#   temp_mos3 / vq / status まで）
+_GETVALUES_CUTS = (13, 15, 16, 17, 18, 21, 23, 24)
+
+# 旧実装と同じ最小ペイロード長
+GETVALUES_MIN_LEN = 46
+
+# COMM_GET_VALUES_SELECTIVEのマスクビット（GETVALUES_FIELDSと同じ順）
+# temp_mos1〜3 と vd/vq はそれぞれ1ビットでまとめて要求される
+GETVALUES_FIELD_BITS = tuple(range(18)) + (18, 18, 18, 19, 19, 20)
+
+
+class GetValuesLayout:
+    """フィールド列に対応するプリコンパイル済みstructとスケール情報"""
+
+    def __init__(self, fields):
+        self.names = tuple(f[0] for f in fields)
+        self.divisors = tuple(f[2] for f in fields)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.struct = struct.Struct('>' + ''.join(f[1] for f in fields))
+        self.size = self.struct.size
+
+
+# サイズの大きい順（長い応答から優先的にマッチ）
+GETVALUES_LAYOUTS = tuple(
+    GetValuesLayout(GETVALUES_FIELDS[:cut]) for cut in reversed(_GETVALUES_CUTS)
+)
+
+
+class GetValues:
+    """
+    GET_VALUES応答のレコード
+
+    生の整数値をタプルのまま保持し、スケーリングは参照時に行う。
+    parsed['duty'] / 'rpm' in parsed など従来のdictと同じ形で参照できる。
+    """
+
+    __slots__ = ('raw', 'layout')
+
+    def __init__(self, raw, layout):
+        self.raw = raw
+        self.layout = layout
+
+    def __getitem__(self, name):
+        i = self.layout.index[name]
+        divisor = self.layout.divisors[i]
+        if divisor is None:
+            return self.raw[i]
+        return self.raw[i] / divisor
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, name):
+        return name in self.layout.index
+
+    def __len__(self):
+        return len(self.raw)
+
+    def get(self, name, default=None):
+        if name in self.layout.index:
+            return self[name]
+        return default
+
+    def keys(self):
+        return self.layout.names
+
+    def raw_value(self, name):
+        """スケーリング前の整数値"""
+        return self.raw[self.layout.index[name]]
+
+    def as_dict(self):
+        return {name: self[name] for name in self.layout.names}
+
+    def __repr__(self):
+        return f"GetValues({self.as_dict()!r})"
+
+
+def parse_getvalues(payload):
+    """GET_VALUESペイロードをGetValuesに変換（失敗時はNone）"""
+    try:
+        offset = 1 if payload[0] == COMM_GET_VALUES else 0
+        available = len(payload) - offset
+        if available < GETVALUES_MIN_LEN:
+            return None
+        for layout in GETVALUES_LAYOUTS:
+            if layout.size <= available:
+                return GetValues(layout.struct.unpack_from(payload, offset), layout)
+        return None
+    except Exception:
+        return None
+
+
+# ===== COMM_GET_VALUES_SELECTIVE =====
+
+# 応答ヘッダ（コマンドID + マスク）
+_SELECTIVE_HEADER = struct.Struct('>BI')
+
+# マスク → レイアウトのキャッシュ
+_selective_layouts = {}
+
+
+def selective_mask(fields):
+    """フィールド名のリストから要求マスクを生成（VESCにない名前は無視）"""
+    wanted = set(fields)
+    mask = 0
+    for (name, _fmt, _div), bit in zip(GETVALUES_FIELDS, GETVALUES_FIELD_BITS):
+        if name in wanted:
+            mask |= 1 << bit
+    return mask
+
+
+def selective_layout(mask):
+    """マスクに対応するレイアウト（初回のみstructをコンパイル）"""
+    layout = _selective_layouts.get(mask)
+    if layout is None:
+        fields = [f for f, bit in zip(GETVALUES_FIELDS, GETVALUES_FIELD_BITS)
+                  if mask & (1 << bit)]
+        layout = GetValuesLayout(fields)
+        _selective_layouts[mask] = layout
+    return layout
+
+
+def encode_get_values_selective(mask):
+    """COMM_GET_VALUES_SELECTIVE要求フレーム"""
+    return build_packet(_SELECTIVE_HEADER.pack(COMM_GET_VALUES_SELECTIVE, mask))
+
+
+def parse_getvalues_selective(payload):
+    """COMM_GET_VALUES_SELECTIVE応答をGetValuesに変換（失敗時はNone）"""
+    try:
+        cmd, mask = _SELECTIVE_HEADER.unpack_from(payload, 0)
+        if cmd != COMM_GET_VALUES_SELECTIVE:
+            return None
+        layout = selective_layout(mask)
+        if len(payload) - _SELECTIVE_HEADER.size < layout.size:
+            return None
+        return GetValues(layout.struct.unpack_from(payload, _SELECTIVE_HEADER.size), layout)
+    except Exception:
+        return None
+
+
+def parse_values(payload):
+    """GET_VALUES / GET_VALUES_SELECTIVE のどちらの応答も変換"""
+    if payload and payload[0] == COMM_GET_VALUES_SELECTIVE:
+        return parse_getvalues_selective(payload)
+    return parse_getvalues(payload)
@@ -0,0 +1,332 @@
+# src/vesc_emulator.py - 擬似端末(PTY)上のソフトウェアVESC（実機なしでの計測用）
+import heapq
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+from src.vesc_codec import (
+    COMM_GET_VALUES,
+    COMM_GET_VALUES_SELECTIVE,
+    COMM_SET_CURRENT,
+    COMM_SET_DUTY,
+    GETVALUES_LAYOUTS,
+    FrameDecoder,
+    build_packet,
+    selective_layout,
+)
+
+_INT32 = struct.Struct('>i')
+_SELECTIVE_HEADER = struct.Struct('>BI')
+
+
+class MotorModel:
+    """
+    Duty/電流指令 → RPM・電流の簡易モーターモデル
+
+    - RPMは目標値（duty × 電圧 × erpm_per_volt）へ一次遅れ（tau）で追従
+    - モーター電流 = (duty × 電圧 - 逆起電力) / 巻線抵抗
+    - 電流指令中は惰性で減速（coast_tau、0A指令相当の扱い）
+    """
+
+    def __init__(self, v_in=20.2, erpm_per_volt=1500.0, resistance=0.08,
+                 tau=0.4, coast_tau=1.5, current_limit=60.0, temp_ambient=25.0):
+        self.v_in = v_in
+        self.erpm_per_volt = erpm_per_volt
+        self.resistance = resistance
+        self.tau = tau
+        self.coast_tau = coast_tau
+        self.current_limit = current_limit
+        self.temp_ambient = temp_ambient
+
+        self.duty = 0.0
+        self.duty_now = 0.0
+        self.current_cmd = None   # Noneの間はDuty制御
+        self.rpm = 0.0
+        self.current_motor = 0.0
+        self.current_in = 0.0
+        self.temp_fet = temp_ambient
+        self.temp_motor = temp_ambient
+        self.tachometer = 0.0
+        self.tachometer_abs = 0.0
+        self.amp_hours = 0.0
+        self.amp_hours_charged = 0.0
+        self.watt_hours = 0.0
+        self.watt_hours_charged = 0.0
+
+    def set_duty(self, duty):
+        """duty: -1.0〜1.0"""
+        self.duty = max(-1.0, min(1.0, duty))
+        self.current_cmd = None
+
+    def set_current(self, current):
+        """current: A（0Aはフリーラン）"""
+        self.current_cmd = current
+
+    def step(self, dt):
+        if dt <= 0:
+            return
+        if self.current_cmd is None:
+            target = self.duty * self.v_in * self.erpm_per_volt
+            alpha = 1.0 - math.exp(-dt / self.tau)
+            back_emf = self.rpm / self.erpm_per_volt
+            current = (self.duty * self.v_in - back_emf) / self.resistance
+            current = max(-self.current_limit, min(self.current_limit, current))
+            duty_now = self.duty
+        else:
+            target = 0.0
+            alpha = 1.0 - math.exp(-dt / self.coast_tau)
+            current = self.current_cmd
+            duty_now = self.rpm / self.erpm_per_volt / self.v_in
+        self.rpm += (target - self.rpm) * alpha
+        self.current_motor = current
+        self.current_in = current * abs(duty_now)
+        self.duty_now = duty_now
+
+        # 積算値・温度
+        self.tachometer += self.rpm / 60.0 * dt * 6
+        self.tachometer_abs += abs(self.rpm) / 60.0 * dt * 6
+        ah = self.current_in * dt / 3600.0
+        if ah >= 0:
+            self.amp_hours += ah
+            self.watt_hours += ah * self.v_in
+        else:
+            self.amp_hours_charged -= ah
+            self.watt_hours_charged -= ah * self.v_in
+        heat = self.current_motor ** 2 * self.resistance
+        self.temp_fet += (self.temp_ambient + heat * 0.05 - self.temp_fet) * min(1.0, dt / 30.0)
+        self.temp_motor += (self.temp_ambient + heat * 0.1 - self.temp_motor) * min(1.0, dt / 60.0)
+
+    def values(self):
+        """GETVALUES_FIELDSの名前 → スケーリング後の値"""
+        return {
+            'temp_fet': self.temp_fet,
+            'temp_motor': self.temp_motor,
+            'current_motor': self.current_motor,
+            'current_in': self.current_in,
+            'id': 0.0,
+            'iq': self.current_motor,
+            'duty': self.duty_now,
+            'rpm': self.rpm,
+            'v_in': self.v_in,
+            'amp_hours': self.amp_hours,
+            'amp_hours_charged': self.amp_hours_charged,
+            'watt_hours': self.watt_hours,
+            'watt_hours_charged': self.watt_hours_charged,
+            'tachometer': self.tachometer,
+            'tachometer_abs': self.tachometer_abs,
+            'temp_mos1': self.temp_fet,
+            'temp_mos2': self.temp_fet,
+            'temp_mos3': self.temp_fet,
+        }
+
+
+def _to_raw(layout, values):
+    """スケーリング後の値 → 応答に詰める整数列"""
+    raw = []
+    for name, divisor in zip(layout.names, layout.divisors):
+        value = values.get(name, 0)
+        raw.append(int(round(value * divisor)) if divisor is not None else int(round(value)))
+    return raw
+
+
+class VESCEmulator:
+    """
+    擬似端末上でVESCのUARTプロトコルを話すエミュレータ
+
+    - COMM_GET_VALUES / COMM_GET_VALUES_SELECTIVE に応答
+    - COMM_SET_DUTY / COMM_SET_CURRENT をモデルに反映
+    - 応答遅延・ジッタ・バイト欠落・ビット化けを設定可能
+    - supports_selective=False でSELECTIVE非対応の旧ファームウェアを再現（無応答）
+    - baudrateを指定すると送信バイト数に応じた転送時間も再現
+
+    使い方:
+        emu = VESCEmulator(latency=0.002)
+        port = emu.start()          # /dev/pts/N
+        ser = serial.Serial(port, 115200, timeout=0.1)
+        ... VESCReader / VESCDutyController をそのまま使う ...
+        emu.stop()
+    """
+
+    def __init__(self, model=None, latency=0.001, jitter=0.0, byte_loss=0.0,
+                 corruption=0.0, baudrate=115200, seed=None, supports_selective=True):
+        self.model = model if model is not None else MotorModel()
+        self.latency = latency
+        self.jitter = jitter
+        self.byte_loss = byte_loss
+        self.corruption = corruption
+        self.baudrate = baudrate
+        self.supports_selective = supports_selective
+        self._rng = random.Random(seed)
+
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._stop_flag = threading.Event()
+
+        # 送信予定（送信時刻, 通番, データ）
+        self._outbox = []
+        self._seq = 0
+        self._tx_free_at = 0.0
+
+        # 統計
+        self.requests = 0
+        self.commands = 0
+        self.unknown = 0
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+        self.bytes_corrupted = 0
+
+    def start(self):
+        """PTYを開いてスレッド開始、クライアントが開くポートのパスを返す"""
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop_flag.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_flag.set()
+        self._thread.join(timeout=1.0)
+        self._thread = None
+        os.close(self._master)
+        os.close(self._slave)
+        self._master = self._slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats_line(self):
+        return (f"requests={self.requests}, commands={self.commands}, unknown={self.unknown}, "
+                f"sent={self.bytes_sent}B, dropped={self.bytes_dropped}B, "
+                f"corrupted={self.bytes_corrupted}B")
+
+    # ===== 応答生成 =====
+
+    def _reply_payload(self, payload):
+        cmd = payload[0]
+        if cmd == COMM_GET_VALUES:
+            self.requests += 1
+            layout = GETVALUES_LAYOUTS[0]
+            raw = _to_raw(layout, self.model.values())
+            return bytes([COMM_GET_VALUES]) + layout.struct.pack(*raw)
+        if cmd == COMM_GET_VALUES_SELECTIVE and len(payload) >= 5 and self.supports_selective:
+            self.requests += 1
+            mask = struct.unpack_from('>I', payload, 1)[0]
+            layout = selective_layout(mask)
+            raw = _to_raw(layout, self.model.values())
+            return _SELECTIVE_HEADER.pack(COMM_GET_VALUES_SELECTIVE, mask) + layout.struct.pack(*raw)
+        if cmd == COMM_SET_DUTY and len(payload) >= 5:
+            self.commands += 1
+            self.model.set_duty(_INT32.unpack_from(payload, 1)[0] / 100000.0)
+            return None
+        if cmd == COMM_SET_CURRENT and len(payload) >= 5:
+            self.commands += 1
+            self.model.set_current(_INT32.unpack_from(payload, 1)[0] / 1000.0)
+            return None
+        self.unknown += 1
+        return None
+
+    def _schedule(self, frame, now):
+        """遅延・ジッタ・転送時間を加えて送信キューへ"""
+        send_at = now + self.latency
+        if self.jitter:
+            send_at += self._rng.uniform(0, self.jitter)
+        if self.baudrate:
+            # 前の応答の転送が終わってから（8N1で1バイト10ビット）
+            send_at = max(send_at, self._tx_free_at)
+            self._tx_free_at = send_at + len(frame) * 10.0 / self.baudrate
+        heapq.heappush(self._outbox, (send_at, self._seq, frame))
+        self._seq += 1
+
+    def _impair(self, frame):
+        """バイト欠落・ビット化けを適用"""
+        if not self.byte_loss and not self.corruption:
+            return frame
+        out = bytearray()
+        rng = self._rng
+        for b in frame:
+            if self.byte_loss and rng.random() < self.byte_loss:
+                self.bytes_dropped += 1
+                continue
+            if self.corruption and rng.random() < self.corruption:
+                b ^= 1 << rng.randrange(8)
+                self.bytes_corrupted += 1
+            out.append(b)
+        return bytes(out)
+
+    def _flush_outbox(self, now):
+        while self._outbox and self._outbox[0][0] <= now:
+            _, _, frame = heapq.heappop(self._outbox)
+            data = self._impair(frame)
+            if data:
+                os.write(self._master, data)
+                self.bytes_sent += len(data)
+
+    def _loop(self):
+        decoder = FrameDecoder()
+        last = time.monotonic()
+        while not self._stop_flag.is_set():
+            now = time.monotonic()
+            timeout = 0.01
+            if self._outbox:
+                timeout = max(0.0, min(timeout, self._outbox[0][0] - now))
+            try:
+                ready, _, _ = select.select([self._master], [], [], timeout)
+            except (OSError, ValueError):
+                break
+
+            now = time.monotonic()
+            self.model.step(now - last)
+            last = now
+
+            if ready:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError:
+                    break
+                decoder.feed(data)
+                for payload in decoder.decode():
+                    reply = self._reply_payload(payload)
+                    if reply is not None:
+                        self._schedule(build_packet(reply), now)
+            self._flush_outbox(now)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PTY上のソフトウェアVESC")
+    parser.add_argument("--latency", type=float, default=0.001, help="応答遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延の揺らぎ（秒）")
+    parser.add_argument("--loss", type=float, default=0.0, help="バイト欠落率")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="ビット化け率（1バイトあたり）")
+    parser.add_argument("--baud", type=int, default=115200, help="転送時間の計算に使うボーレート（0で無効）")
+    args = parser.parse_args()
+
+    emu = VESCEmulator(latency=args.latency, jitter=args.jitter, byte_loss=args.loss,
+                       corruption=args.corrupt, baudrate=args.baud)
+    port = emu.start()
+    print(f"VESC emulator on {port} (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            m = emu.model
+            print(f"duty={m.duty:.3f} rpm={m.rpm:.0f} I={m.current_motor:.2f}A | {emu.stats_line()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emu.stop()
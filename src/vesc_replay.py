@@ -0,0 +1,132 @@
+# src/vesc_replay.py - 記録済みCSV（log/*.csv）を再生するVESCエミュレータ
+import bisect
+import csv
+
+from src.session_log import open_log
+from src.vesc_emulator import VESCEmulator
+
+# CSVに列がない場合の値
+DEFAULT_VALUES = {
+    'temp_fet': 25.0,
+    'temp_motor': 25.0,
+}
+
+
+class ReplayModel:
+    """
+    記録済みセッションCSVの値を時刻で線形補間して返すモデル（MotorModel互換）
+
+    - speed: 再生速度（2.0なら2倍速）
+    - loop: 末尾まで再生したら先頭に戻る（Falseなら最後の値を保持）
+    - Duty/電流指令は記録するだけで値には影響しない
+    """
+
+    def __init__(self, csv_path, speed=1.0, loop=True):
+        self.csv_path = csv_path
+        self.speed = speed
+        self.loop = loop
+        self.t = 0.0
+
+        self.times, self.columns = self._load(csv_path)
+        self.t0 = self.times[0]
+        self.duration = self.times[-1] - self.t0
+
+        # 受け取った指令（確認用）
+        self.duty = 0.0
+        self.current_cmd = None
+
+    @staticmethod
+    def _load(csv_path):
+        with open_log(csv_path) as f:
+            reader = csv.DictReader(f)
+            if not reader.fieldnames or "time" not in reader.fieldnames:
+                raise ValueError(f"{csv_path}: 'time' column not found")
+            names = [n for n in reader.fieldnames if n != "time"]
+            times = []
+            columns = {n: [] for n in names}
+            for row in reader:
+                try:
+                    t = float(row["time"])
+                except (TypeError, ValueError):
+                    continue
+                times.append(t)
+                for n in names:
+                    try:
+                        columns[n].append(float(row[n]))
+                    except (TypeError, ValueError):
+                        columns[n].append(columns[n][-1] if columns[n] else 0.0)
+        if len(times) < 2:
+            raise ValueError(f"{csv_path}: need at least 2 rows")
+        return times, columns
+
+    def set_duty(self, duty):
+        self.duty = duty
+        self.current_cmd = None
+
+    def set_current(self, current):
+        self.current_cmd = current
+
+    def step(self, dt):
+        self.t += dt * self.speed
+
+    def _position(self):
+        """再生位置（CSVのtime列の値）"""
+        t = self.t
+        if self.duration > 0:
+            if self.loop:
+                t %= self.duration
+            else:
+                t = min(t, self.duration)
+        return self.t0 + t
+
+    def values(self):
+        t = self._position()
+        times = self.times
+        i = bisect.bisect_right(times, t)
+        if i <= 0:
+            i, frac = 1, 0.0
+        elif i >= len(times):
+            i, frac = len(times) - 1, 1.0
+        else:
+            span = times[i] - times[i - 1]
+            frac = (t - times[i - 1]) / span if span > 0 else 1.0
+
+        values = dict(DEFAULT_VALUES)
+        for name, col in self.columns.items():
+            a = col[i - 1]
+            values[name] = a + (col[i] - a) * frac
+        return values
+
+
+def start_replay(csv_path, speed=1.0, loop=True, **emulator_kwargs):
+    """再生エミュレータを起動して返す（emu.portを開いて使う）"""
+    emu = VESCEmulator(model=ReplayModel(csv_path, speed=speed, loop=loop), **emulator_kwargs)
+    emu.start()
+    return emu
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="記録済みCSVを再生するVESCエミュレータ")
+    parser.add_argument("csv", help="再生するCSV（log/0g.csv など、.csv.gzも可）")
+    parser.add_argument("--speed", type=float, default=1.0, help="再生速度（倍）")
+    parser.add_argument("--once", action="store_true", help="ループせず最後の値を保持")
+    parser.add_argument("--latency", type=float, default=0.001, help="応答遅延（秒）")
+    parser.add_argument("--baud", type=int, default=115200, help="転送時間の計算に使うボーレート（0で無効）")
+    args = parser.parse_args()
+
+    emu = start_replay(args.csv, speed=args.speed, loop=not args.once,
+                       latency=args.latency, baudrate=args.baud)
+    model = emu.model
+    print(f"Replaying {args.csv} ({model.duration:.1f}s x{args.speed}) on {emu.port} "
+          f"(Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"t={model._position():.2f}s | {emu.stats_line()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emu.stop()
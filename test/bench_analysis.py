@@ -0,0 +1,180 @@
+# test/bench_analysis.py - セッションログの読み込み・集計の確認とベンチマーク（log/*.csvを使用）
+import csv
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.analysis import find_logs, load_session, summarize, summarize_dir
+from src.analysis_cache import AnalysisCache
+from src.session_log import BinarySessionWriter, open_output
+from src.vesc_codec import GETVALUES_FIELDS, GetValues, GetValuesLayout
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log")
+FIXTURES = ["0g", "500g", "1000g", "1500g", "2000g", "2500g", "3000g", "3500g", "4000g"]
+COPIES = 40  # 9ファイル x 40 = 360セッション
+
+
+def csv_module_load(path):
+    """比較用: csvモジュールで1行ずつ読む"""
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return {k: np.array([float(r[k]) for r in rows]) for k in rows[0]}
+
+
+def write_binlog(src, dst, compression=None, cut=None):
+    """
+    CSVフィクスチャと同じ内容の.tslogを作る
+
+    cutを指定すると、全行を書いてflushした時点（閉じる前）のファイルをcutにコピーする
+    （flush後に電源が切れたログ）
+    """
+    data = load_session(src)
+    names = [n for n in data.dtype.names if n != "time"]
+    layout = GetValuesLayout([f for f in GETVALUES_FIELDS if f[0] in names])
+    writer = BinarySessionWriter(dst, list(data.dtype.names), compression=compression)
+    for row in data:
+        raw = tuple(int(round(row[n] * d)) if d else int(row[n]) for n, d in zip(layout.names, layout.divisors))
+        writer.write(row["time"], GetValues(raw, layout))
+    if cut is not None:
+        writer.flush()
+        shutil.copyfile(dst, cut)
+    writer.close()
+
+
+def write_cut_csv(src, dst, compression):
+    """全行を書いてflushした時点（閉じる前）の圧縮CSVを作る"""
+    tmp = dst + ".writing"
+    with open(src, "rb") as f:
+        body = f.read()
+    out = open_output(tmp, compression)
+    out.write(body)
+    out.flush()
+    shutil.copyfile(tmp, dst)
+    out.close()
+    os.remove(tmp)
+
+
+def check_fixtures(tmp):
+    for name in FIXTURES:
+        src = os.path.join(LOG_DIR, f"{name}.csv")
+        data = load_session(src)
+        expected = csv_module_load(src)
+        for col, values in expected.items():
+            assert np.array_equal(data[col], values), (name, col)
+
+        # gzip圧縮・途中で切れたログ・バイナリログも同じ値になること
+        gz = os.path.join(tmp, f"{name}.csv.gz")
+        with open(src, "rb") as f, gzip.open(gz, "wb") as out:
+            shutil.copyfileobj(f, out)
+        assert np.array_equal(load_session(gz), data), name
+
+        cut = os.path.join(tmp, f"{name}_cut.csv")
+        with open(src, "rb") as f:
+            body = f.read()
+        with open(cut, "wb") as out:
+            out.write(body[:-5])
+        assert np.array_equal(load_session(cut), data[:-1]), name
+
+        # flush後に切れた圧縮ログ（gzipの終端なし）は全行読めること
+        cut_gz = os.path.join(tmp, f"{name}_cut.csv.gz")
+        write_cut_csv(src, cut_gz, "gzip")
+        assert np.array_equal(load_session(cut_gz), data), name
+
+        tslog = os.path.join(tmp, f"{name}.tslog")
+        write_binlog(src, tslog)
+        assert np.array_equal(load_session(tslog), data), name
+
+        cut_tslog = os.path.join(tmp, f"{name}_cut.tslog.gz")
+        write_binlog(src, os.path.join(tmp, f"{name}.tslog.gz"), compression="gzip", cut=cut_tslog)
+        assert np.array_equal(load_session(cut_tslog), data), name
+
+        s = summarize(data, name)
+        assert s["samples"] == len(expected["time"])
+        assert s["current_motor_peak"] == np.abs(expected["current_motor"]).max()
+        assert s["energy_j"] > 0 and s["duty_steps"] > 0
+        print(f"  {name:<6} peak={s['current_motor_peak']:6.2f}A  energy={s['energy_j']:6.1f}J  "
+              f"response={s['step_response_median'] * 1000:5.0f}ms  OK")
+
+
+def bench_dir(tmp):
+    bench = os.path.join(tmp, "bench")
+    os.makedirs(bench)
+    for i in range(COPIES):
+        for name in FIXTURES:
+            src = os.path.join(LOG_DIR, f"{name}.csv")
+            dst = os.path.join(bench, f"{name}_{i:03d}.csv")
+            if i % 2:
+                with open(src, "rb") as f, gzip.open(dst + ".gz", "wb") as out:
+                    shutil.copyfileobj(f, out)
+            else:
+                shutil.copy(src, dst)
+
+    t0 = time.perf_counter()
+    summaries = summarize_dir(bench)
+    elapsed = time.perf_counter() - t0
+    rows = sum(s["samples"] for s in summaries)
+    print(f"  {len(summaries)} sessions ({rows} rows, half gzip) in {elapsed:.3f}s "
+          f"= {elapsed / len(summaries) * 1000:.2f} ms/session")
+    return bench, summaries
+
+
+def bench_cache(tmp, bench, expected):
+    paths = find_logs(bench)
+    cache_dir = os.path.join(tmp, "cache")
+
+    for label in ("cold", "warm"):
+        t0 = time.perf_counter()
+        with AnalysisCache(cache_dir) as cache:
+            summaries = cache.summarize_files(paths)
+        elapsed = time.perf_counter() - t0
+        assert _same(summaries, expected)
+        print(f"  {label:<8} {elapsed:.3f}s  {cache.stats_line()}")
+    assert cache.miss_count == 0
+
+    # 1ファイルだけ追記 → そのファイルだけ再解析
+    with open(paths[0], "a") as f:
+        f.write("9.999,0.0,20.2,0.0,0.0\n")
+    t0 = time.perf_counter()
+    with AnalysisCache(cache_dir) as cache:
+        summaries = cache.summarize_files(paths)
+    print(f"  {'modified':<8} {time.perf_counter() - t0:.3f}s  {cache.stats_line()}")
+    assert cache.miss_count == 1 and summaries[0]["samples"] == expected[0]["samples"] + 1
+
+    # キャッシュした配列は元の読み込みと同じ
+    with AnalysisCache(cache_dir) as cache:
+        assert np.array_equal(cache.load(paths[1]), load_session(paths[1]))
+
+    # サイズ上限を小さくすると古いものから削除
+    with AnalysisCache(os.path.join(tmp, "small"), max_bytes=20 * 1024) as cache:
+        cache.summarize_files(paths)
+        print(f"  {'20KiB':<8} {cache.stats_line()}")
+        assert cache.total_bytes() <= 20 * 1024 and cache.evict_count > 0
+
+
+def _same(a, b):
+    """NaNを含む集計結果の比較"""
+    def numbers(s):
+        return [v for v in s.values() if not isinstance(v, str)]
+    return all(np.allclose(numbers(x), numbers(y), equal_nan=True) and x["anomalies"] == y["anomalies"]
+               for x, y in zip(a, b))
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        print("Fixtures (csv / csv.gz / truncated csv, csv.gz, tslog.gz / tslog):")
+        check_fixtures(tmp)
+        print("Directory summary:")
+        bench, summaries = bench_dir(tmp)
+        print("Cache:")
+        bench_cache(tmp, bench, summaries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# test/bench_batch.py - 並列一括処理の確認とベンチマーク（log/*.csvを使用）
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.analysis import find_logs, load_session, resample, summarize_files
+from src.analysis_batch import summarize_parallel
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log")
+FIXTURES = ["0g", "500g", "1000g", "1500g", "2000g", "2500g", "3000g", "3500g", "4000g"]
+COPIES = 120  # 9ファイル x 120 = 1080セッション
+
+
+def check_resample():
+    data = load_session(os.path.join(LOG_DIR, "3000g.csv"))
+    out = resample(data, 0.01)
+    assert np.allclose(np.diff(out["time"]), 0.01)
+    assert out["time"][0] == data["time"][0] and abs(out["time"][-1] - data["time"][-1]) < 0.01
+    # 線形補間なので元の値の範囲を超えない
+    for name in ("duty", "current_motor", "current_in"):
+        assert data[name].min() - 1e-9 <= out[name].min() and out[name].max() <= data[name].max() + 1e-9
+
+
+def main():
+    check_resample()
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(COPIES):
+            for name in FIXTURES:
+                shutil.copy(os.path.join(LOG_DIR, f"{name}.csv"), os.path.join(tmp, f"{name}_{i:03d}.csv"))
+        # 読めないファイルも混ぜる
+        open(os.path.join(tmp, "broken.csv"), "w").close()
+        paths = find_logs(tmp)
+
+        t0 = time.perf_counter()
+        serial = summarize_files(paths, verbose=False)
+        elapsed = time.perf_counter() - t0
+        print(f"serial          {len(serial)} sessions in {elapsed:.2f}s ({len(paths) / elapsed:.0f} files/s)")
+
+        cpus = os.cpu_count() or 1
+        for workers in sorted({1, 2, cpus}):
+            summaries, stats = summarize_parallel(paths, workers=workers, verbose=False)
+            assert [s["file"] for s in summaries] == [s["file"] for s in serial]
+            assert all(np.allclose([v for v in a.values() if not isinstance(v, str)],
+                                   [v for v in b.values() if not isinstance(v, str)], equal_nan=True)
+                       for a, b in zip(summaries, serial))
+            assert stats.failed == 1
+            print(f"workers={workers:<3}     {stats.stats_line()}")
+
+        summaries, stats = summarize_parallel(paths, resample_dt=0.01, verbose=False)
+        print(f"resample=10ms   {stats.stats_line()}")
+        print(f"(cpu_count={cpus})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# test/bench_catalog.py - セッションカタログの登録・検索の確認（log/*.csvとエミュレータを使用）
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.analysis import summarize_dir
+from src.reader_v2 import VESCReader
+from src.session_catalog import SessionCatalog, parse_log_filename
+from src.session_postprocess import make_session_hook
+from src.vesc_emulator import VESCEmulator
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log")
+FIXTURES = ["0g", "500g", "1000g", "1500g", "2000g", "2500g", "3000g", "3500g", "4000g"]
+MODES = ["manual", "auto_forward", "auto_reverse"]
+DAYS = 120
+CSV_FIELDS = ["time", "duty", "rpm", "v_in", "current_in", "current_motor", "temp_fet"]
+
+
+def make_logs(directory):
+    """フィクスチャをmake_log_filename()形式の名前でDAYS日分コピー（1日9セッション）"""
+    now = time.time()
+    for day in range(DAYS):
+        for i, name in enumerate(FIXTURES):
+            t = now - day * 86400 - i * 600
+            mode = MODES[(day + i) % len(MODES)]
+            dst = os.path.join(directory, f"{mode}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(t))}.csv")
+            shutil.copy(os.path.join(LOG_DIR, f"{name}.csv"), dst)
+
+
+def check_filenames():
+    meta = parse_log_filename("/x/auto_reverse_20261017_101530_p002.csv.gz")
+    assert (meta["mode"], meta["direction"], meta["part"]) == ("auto", "reverse", 2)
+    assert meta["session"] == "auto_reverse_20261017_101530"
+    meta = parse_log_filename("manual_20261017_101530.tslog")
+    assert (meta["mode"], meta["direction"], meta["part"]) == ("manual", None, 1)
+    assert parse_log_filename("3000g.csv")["mode"] is None
+
+
+def bench_query(tmp):
+    logs = os.path.join(tmp, "logs")
+    os.makedirs(logs)
+    make_logs(logs)
+    catalog = SessionCatalog(os.path.join(tmp, "sessions.db"))
+
+    t0 = time.perf_counter()
+    added = catalog.scan(logs)
+    print(f"  scan      {added} sessions in {time.perf_counter() - t0:.2f}s")
+    t0 = time.perf_counter()
+    assert catalog.scan(logs) == 0
+    print(f"  rescan    0 changed in {time.perf_counter() - t0:.3f}s")
+
+    # 「先週のauto_reverseでpeak current > 20A」
+    since = time.time() - 7 * 86400
+    t0 = time.perf_counter()
+    rows = catalog.query(mode="auto", direction="reverse", since=since, min_peak_current=20)
+    elapsed = time.perf_counter() - t0
+
+    # 比較: ディレクトリを走査して全ファイルを読む
+    t0 = time.perf_counter()
+    expected = [s for s in summarize_dir(logs, verbose=False)
+                if s["file"].startswith("auto_reverse_")
+                and parse_log_filename(s["file"])["start_time"] >= since
+                and s["current_motor_peak"] >= 20]
+    scan_elapsed = time.perf_counter() - t0
+    assert sorted(r["file"] for r in rows) == sorted(s["file"] for s in expected)
+    print(f"  query     {len(rows)} rows in {elapsed * 1000:.2f}ms "
+          f"(directory scan: {scan_elapsed * 1000:.0f}ms)")
+
+    conn = catalog._connect()
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM sessions WHERE mode = ? AND direction = ? "
+        "AND start_time >= ? AND peak_current >= ?", ("auto", "reverse", since, 20)))
+    conn.close()
+    assert "USING INDEX" in plan, plan
+    print(f"  plan      {plan}")
+
+
+def check_close_hook(tmp):
+    """VESCReaderのセッション終了で登録されること（エミュレータ使用）"""
+    catalog = SessionCatalog(os.path.join(tmp, "live.db"))
+    path = os.path.join(tmp, "live", time.strftime("auto_forward_%Y%m%d_%H%M%S.csv"))
+    with VESCEmulator(latency=0.001) as emu:
+        ser = serial.Serial(emu.port, 115200, timeout=0.1)
+        reader = VESCReader(ser, interval=0.02, csv_filename=path, csv_fields=CSV_FIELDS, verbose=0)
+        reader.on_session_closed = make_session_hook(catalog.db_path, 40)
+        with redirect_stdout(io.StringIO()):
+            reader.open_session(path)
+            time.sleep(1.0)
+            t0 = time.perf_counter()
+            reader.close_session()
+            t_close = time.perf_counter() - t0
+            reader.on_session_closed.join()
+            reader.stop()
+        ser.close()
+    rows = catalog.query(mode="auto", direction="forward")
+    assert len(rows) == 1 and rows[0]["samples"] > 10 and rows[0]["max_duty"] == 40, [dict(r) for r in rows]
+    print(f"  close     {rows[0]['file']} samples={rows[0]['samples']} registered on close "
+          f"(close_session {t_close * 1000:.1f}ms)")
+
+
+def main():
+    check_filenames()
+    with tempfile.TemporaryDirectory() as tmp:
+        print("Catalog:")
+        bench_query(tmp)
+        check_close_hook(tmp)
+
+
+if __name__ == "__main__":
+    main()
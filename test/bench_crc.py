@@ -0,0 +1,33 @@
+# test/bench_crc.py - CRC16実装の一致確認とベンチマーク（実機不要）
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.vesc_codec import CRC16_BACKEND, crc16_c, crc16_py
+
+N = 20000
+
+
+def main():
+    print(f"selected backend: {CRC16_BACKEND}")
+
+    # ランダムなペイロードで両実装が一致することを確認
+    rng = random.Random(0)
+    for _ in range(2000):
+        data = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 600)))
+        assert crc16_c(data) == crc16_py(data), data.hex()
+        assert crc16_c(memoryview(data)) == crc16_py(data)
+    print("crc16_c == crc16_py: OK")
+
+    # GET_VALUES応答相当（74B）
+    payload = bytes(rng.getrandbits(8) for _ in range(74))
+    for label, func in (("python", crc16_py), ("binascii", crc16_c)):
+        sec = min(timeit.repeat(lambda: func(payload), number=N, repeat=5))
+        print(f"{label:<9} {sec / N * 1e6:7.2f} us/74B")
+
+
+if __name__ == "__main__":
+    main()
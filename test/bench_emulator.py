@@ -0,0 +1,76 @@
+# test/bench_emulator.py - エミュレータ上でReader/DutyControllerを計測（実機不要）
+import io
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.duty_forward_revers import VESCDutyController
+from src.reader_v2 import VESCReader
+from src.vesc_emulator import VESCEmulator
+
+CSV_FIELDS = ["time", "duty", "rpm", "v_in", "current_in", "current_motor", "temp_fet"]
+DURATION = 3.0
+
+
+def bench_reader(port, label, **kwargs):
+    """DURATION秒間ログを取り、サンプルレートとRTTを表示"""
+    ser = serial.Serial(port, 115200, timeout=0.1)
+    with tempfile.TemporaryDirectory() as tmp:
+        reader = VESCReader(ser, csv_filename=os.path.join(tmp, "bench.csv"),
+                            csv_fields=CSV_FIELDS, **kwargs)
+        with redirect_stdout(io.StringIO()):
+            reader.start()
+            time.sleep(DURATION)
+            reader.stop()
+    ser.close()
+    rtt = reader._rtt_sum / reader._rtt_count * 1000 if reader._rtt_count else float("nan")
+    assert reader.count > 0, label
+    print(f"{label:<32} {reader.count / DURATION:7.1f} samples/s  "
+          f"rtt={rtt:5.2f}ms  empty={reader._diag_empty_count}")
+
+
+def bench_stop(port):
+    """_complete_stop()の所要時間"""
+    ser = serial.Serial(port, 115200, timeout=0.1)
+    duty = VESCDutyController(ser, max_duty=40)
+    with redirect_stdout(io.StringIO()):
+        t0 = time.monotonic()
+        duty._complete_stop()
+        elapsed = time.monotonic() - t0
+    ser.close()
+    print(f"{'_complete_stop':<32} {elapsed:7.3f} s")
+
+
+def main():
+    with VESCEmulator(latency=0.001, jitter=0.0005) as emu:
+        print(f"emulator: {emu.port}")
+        bench_reader(emu.port, "sleep (interval=0.05)", interval=0.05)
+        bench_reader(emu.port, "event (interval=0)", interval=0, response_wait="event")
+        bench_reader(emu.port, "event+selective (interval=0)", interval=0,
+                     response_wait="event", selective=True)
+        bench_reader(emu.port, "pipeline=3+selective", interval=0,
+                     response_wait="event", selective=True, pipeline_depth=3)
+        bench_stop(emu.port)
+        print(emu.stats_line())
+
+    with VESCEmulator(latency=0.001, jitter=0.002, byte_loss=0.001, corruption=0.001,
+                      seed=1) as emu:
+        bench_reader(emu.port, "event, lossy link", interval=0, response_wait="event",
+                     selective=True)
+        print(emu.stats_line())
+
+    # SELECTIVE非対応のファームウェア → COMM_GET_VALUESに切り替わって取得できること
+    with VESCEmulator(latency=0.001, supports_selective=False) as emu:
+        bench_reader(emu.port, "selective unsupported", interval=0, response_wait="event",
+                     selective=True)
+        print(emu.stats_line())
+
+
+if __name__ == "__main__":
+    main()
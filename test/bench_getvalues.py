@@ -0,0 +1,104 @@
+# test/bench_getvalues.py - GET_VALUESデコードのベンチマーク（実機不要）
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.vesc_codec import COMM_GET_VALUES, GETVALUES_FIELDS, parse_getvalues
+
+# main.pyのCSV_FIELDSのうちVESCの値
+LOGGED_FIELDS = ["duty", "rpm", "v_in", "current_in", "current_motor", "temp_fet"]
+N = 100000
+
+
+def legacy_parse_getvalues(payload):
+    """従来実装（フィールドごとにスライス + struct.unpack、dict生成）"""
+    try:
+        if payload[0] == COMM_GET_VALUES:
+            payload = payload[1:]
+        if len(payload) < 46:
+            return None
+
+        offset = 0
+        temp_fet = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
+        offset += 2
+        temp_motor = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
+        offset += 2
+        current_motor = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
+        offset += 4
+        current_in = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
+        offset += 4
+        id_val = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
+        offset += 4
+        iq_val = struct.unpack('>i', payload[offset:offset+4])[0] / 100.0
+        offset += 4
+        duty_now = struct.unpack('>h', payload[offset:offset+2])[0] / 1000.0
+        offset += 2
+        rpm = struct.unpack('>i', payload[offset:offset+4])[0]
+        offset += 4
+        v_in = struct.unpack('>h', payload[offset:offset+2])[0] / 10.0
+        offset += 2
+        amp_hours = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
+        offset += 4
+        amp_hours_charged = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
+        offset += 4
+        watt_hours = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
+        offset += 4
+        watt_hours_charged = struct.unpack('>i', payload[offset:offset+4])[0] / 10000.0
+        offset += 4
+
+        return {
+            'temp_fet': temp_fet,
+            'temp_motor': temp_motor,
+            'current_motor': current_motor,
+            'current_in': current_in,
+            'duty': duty_now,
+            'rpm': rpm,
+            'v_in': v_in,
+            'amp_hours': amp_hours,
+            'amp_hours_charged': amp_hours_charged,
+            'watt_hours': watt_hours,
+            'watt_hours_charged': watt_hours_charged,
+        }
+    except Exception:
+        return None
+
+
+def make_payload():
+    """VESC 6.x相当のダミー応答（コマンドID付き）"""
+    values = [253, 301, 1234, 567, -12, 1180, 400, 5210, 202, 15, 0, 310, 0,
+              48211, 48790, 0, 0, 0, 251, 249, 250, 8070, 1520, 0]
+    fmt = '>B' + ''.join(f[1] for f in GETVALUES_FIELDS)
+    return struct.pack(fmt, COMM_GET_VALUES, *values)
+
+
+def bench(label, func, payload):
+    def run():
+        parsed = func(payload)
+        for field in LOGGED_FIELDS:
+            parsed[field]
+
+    sec = min(timeit.repeat(run, number=N, repeat=5))
+    print(f"{label:<10} {sec / N * 1e6:6.2f} us/sample")
+    return sec
+
+
+def main():
+    payload = make_payload()
+
+    # 同じ値が得られることを確認
+    old = legacy_parse_getvalues(payload)
+    new = parse_getvalues(payload)
+    for key, value in old.items():
+        assert new[key] == value, (key, new[key], value)
+    print(f"payload: {len(payload)}B, fields: {len(new)}")
+
+    t_old = bench("legacy", legacy_parse_getvalues, payload)
+    t_new = bench("struct", parse_getvalues, payload)
+    print(f"speedup:   x{t_old / t_new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
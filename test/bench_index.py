@@ -0,0 +1,102 @@
+# test/bench_index.py - 時刻インデックスによる区間読み出しの確認とベンチマーク
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.analysis import load_session, load_window
+from src.log_index import build_index, index_path, open_index, read_window
+from src.session_log import BinarySessionWriter
+from src.vesc_codec import GETVALUES_FIELDS, GetValues, GetValuesLayout
+
+CSV_FIELDS = ["time", "duty", "rpm", "v_in", "current_in", "current_motor", "temp_fet"]
+HOURS = 3
+RATE = 50  # Hz
+WINDOWS = [(0.0, 5.0), (3600.0, 3605.0), (HOURS * 3600 - 5.0, HOURS * 3600.0), (5000.02, 5000.02)]
+
+
+def make_log(path):
+    """manualモードの長いログ（RATE HzでHOURS時間）"""
+    n = HOURS * 3600 * RATE
+    rng = np.random.default_rng(1)
+    t = np.round(np.arange(n) / RATE + 0.01, 3)
+    duty = np.round(np.clip(np.cumsum(rng.normal(0, 0.001, n)), -0.4, 0.4), 3)
+    cols = [t, duty, np.round(duty * 30000), np.full(n, 24.1),
+            np.round(np.abs(duty) * 5, 2), np.round(duty * 40, 2), np.full(n, 31.5)]
+    np.savetxt(path, np.column_stack(cols), delimiter=",", fmt="%.10g",
+               header=",".join(CSV_FIELDS), comments="")
+    return n
+
+
+def make_binlog(src, dst):
+    data = load_session(src)
+    layout = GetValuesLayout([f for f in GETVALUES_FIELDS if f[0] in data.dtype.names])
+    writer = BinarySessionWriter(dst, CSV_FIELDS)
+    names = layout.names
+    divisors = layout.divisors
+    for row in data:
+        raw = tuple(int(round(row[n] * d)) if d else int(row[n]) for n, d in zip(names, divisors))
+        writer.write(row["time"], GetValues(raw, layout))
+    writer.close()
+
+
+def check(path, full):
+    for t0, t1 in WINDOWS:
+        window = load_window(path, t0, t1)
+        m = (full["time"] >= t0) & (full["time"] <= t1)
+        assert np.array_equal(window, full[m]), (path, t0, t1, len(window), m.sum())
+    rows = list(read_window(path, 3600.0, 3601.0))
+    m = (full["time"] >= 3600.0) & (full["time"] <= 3601.0)
+    assert [r["time"] for r in rows] == list(full["time"][m])
+
+
+def bench(label, path):
+    t0 = time.perf_counter()
+    full = load_session(path)
+    t_full = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    index = build_index(path)
+    t_build = time.perf_counter() - t0
+    check(path, full)
+
+    t0 = time.perf_counter()
+    for _ in range(10):
+        window = load_window(path, 3600.0, 3605.0, index=open_index(path))
+    t_window = (time.perf_counter() - t0) / 10
+    print(f"  {label:<10} {os.path.getsize(path) / 1e6:6.1f}MB  full load {t_full * 1000:7.1f}ms  "
+          f"index build {t_build * 1000:7.1f}ms ({os.path.getsize(index_path(path)) / 1e3:.0f}KB)  "
+          f"5s window {t_window * 1000:6.2f}ms ({len(window)} rows)")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "manual_20261017_101530.csv")
+        rows = make_log(csv_path)
+        print(f"{HOURS}h at {RATE}Hz = {rows} rows")
+
+        gz_path = os.path.join(tmp, "manual_20261017_111530.csv.gz")
+        with open(csv_path, "rb") as f, gzip.open(gz_path, "wb") as out:
+            shutil.copyfileobj(f, out)
+        bin_path = os.path.join(tmp, "manual_20261017_121530.tslog")
+        make_binlog(csv_path, bin_path)
+
+        bench("csv", csv_path)
+        bench("csv.gz", gz_path)
+        bench("tslog", bin_path)
+
+        # ログが変わったらインデックスを作り直す
+        with open(csv_path, "a") as f:
+            f.write(f"{HOURS * 3600 + 1},0,0,24.1,0,0,31.5\n")
+        assert open_index(csv_path, build=False) is None
+        assert load_window(csv_path, HOURS * 3600, HOURS * 3600 + 2)["time"].tolist() == [HOURS * 3600 + 1]
+        print("windows / stale rebuild: OK")
+
+
+if __name__ == "__main__":
+    main()
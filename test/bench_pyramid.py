@@ -0,0 +1,122 @@
+# test/bench_pyramid.py - 概観用ピラミッドの確認とベンチマーク（長いmanualログを生成して使用）
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.analysis import load_session
+from src.log_index import build_index, index_path
+from src.log_pyramid import PyramidReader, build_pyramid, pyramid_path
+from src.session_catalog import SessionCatalog
+from src.session_postprocess import make_session_hook
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log")
+HOURS = 2
+LOG_INTERVAL = 0.1
+
+
+def make_manual_log(path):
+    """main.pyのmanualモード相当（LOG_INTERVAL周期でHOURS時間）のログ"""
+    n = int(HOURS * 3600 / LOG_INTERVAL)
+    rng = np.random.default_rng(0)
+    t = np.round(np.arange(n) * LOG_INTERVAL + 0.05, 3)
+    duty = np.round(np.clip(np.cumsum(rng.normal(0, 0.002, n)), -0.4, 0.4), 3)
+    rpm = np.round(duty * 30000 + rng.normal(0, 50, n))
+    current = np.round(duty * 40 + rng.normal(0, 1, n), 2)
+    with open(path, "w") as f:
+        f.write("time,duty,rpm,current_motor\n")
+        f.writelines(f"{a},{b},{c:.0f},{d}\n" for a, b, c, d in zip(t, duty, rpm, current))
+    return n
+
+
+def check_levels(path):
+    data = load_session(path)
+    with PyramidReader(path) as reader:
+        for seconds in reader.levels:
+            level = reader.level(seconds)
+            assert level["count"].sum() == len(data)
+            # いくつかの区間を元データと照合
+            for i in np.linspace(0, len(level) - 1, 7).astype(int):
+                m = (data["time"] >= level["time"][i]) & (data["time"] < level["time"][i] + seconds)
+                assert level["count"][i] == m.sum()
+                for col in ("rpm", "current_motor"):
+                    assert level[f"{col}_min"][i] == data[col][m].min()
+                    assert level[f"{col}_max"][i] == data[col][m].max()
+                    assert np.isclose(level[f"{col}_mean"][i], data[col][m].mean())
+
+
+def bench_reads(path, rows):
+    t0 = time.perf_counter()
+    load_session(path)
+    full = time.perf_counter() - t0
+    print(f"  full load          {rows} rows  {full * 1000:7.1f}ms")
+
+    with PyramidReader(path) as reader:
+        cases = [
+            ("overview 1000px", None, None, 1000),
+            ("overview 300px", None, None, 300),
+            ("10min range 500px", 600, 1200, 500),
+            ("1min zoom 500px", 600, 660, 500),
+        ]
+        for label, t0_, t1_, width in cases:
+            t0 = time.perf_counter()
+            level, data = reader.read(t0_, t1_, width=width, columns=["rpm"])
+            elapsed = time.perf_counter() - t0
+            print(f"  {label:<18} level={level:>4g}s {len(data):6d} rows "
+                  f"({len(data) / rows:6.1%})  {elapsed * 1000:7.1f}ms")
+            assert len(data) >= min(width, (t1_ or HOURS * 3600) - (t0_ or 0)) or level == 0
+
+
+def check_stale(path):
+    pyr = pyramid_path(path)
+    with open(path, "a") as f:
+        f.write(f"{HOURS * 3600 + 1}.0,0.0,0,0.0\n")
+    with PyramidReader(path, build=False) as reader:
+        assert reader.meta is None  # 古いピラミッドは使わない
+    mtime = os.path.getmtime(pyr)
+    with PyramidReader(path) as reader:
+        assert reader.meta is not None and reader.meta["rows"] == HOURS * 36000 + 1
+    assert os.path.getmtime(pyr) >= mtime
+
+
+def check_hook(tmp):
+    """main.pyと同じ設定で、閉じたログがインデックス・カタログ・ピラミッドに反映されること"""
+    logs = os.path.join(tmp, "hook")
+    os.makedirs(logs)
+    paths = [os.path.join(logs, "manual_20261017_101530.csv"),
+             os.path.join(logs, "manual_20261017_101530_p002.csv")]
+    for path in paths:
+        shutil.copy(os.path.join(LOG_DIR, "4000g.csv"), path)
+    hook = make_session_hook(os.path.join(logs, "sessions.db"), 40, (1.0, 10.0, 60.0), 5.0)
+    hook(paths)
+    hook.join()
+    assert all(os.path.exists(pyramid_path(p)) and os.path.exists(index_path(p)) for p in paths)
+    rows = SessionCatalog(os.path.join(logs, "sessions.db")).query(mode="manual")
+    assert [r["part"] for r in rows] == [1, 2]
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "manual_20261017_101530.csv")
+        rows = make_manual_log(path)
+        t0 = time.perf_counter()
+        pyr = build_pyramid(path)
+        # 拡大表示用の時刻インデックス（実機ではどちらもログを閉じたときに作る）
+        build_index(path)
+        print(f"build: {time.perf_counter() - t0:.2f}s, log {os.path.getsize(path) / 1e6:.1f}MB "
+              f"-> pyramid {os.path.getsize(pyr) / 1e6:.2f}MB")
+        check_levels(path)
+        print("Reads:")
+        bench_reads(path, rows)
+        check_stale(path)
+        check_hook(tmp)
+        print("levels / stale rebuild / post-close hook: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
+import os
 import serial
 import time
 import sys
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.vesc_codec import crc16
+
 PORT = "/dev/serial0"
 BAUD = 115200
 
@@ -66,7 +70,7 @@ def test_get_values(ser):
     
     # パケット作成
     payload = bytes([0x04])  # COMM_GET_VALUES
-    crc = calculate_crc16(payload)
+    crc = crc16(payload)
     packet = bytes([0x02, len(payload)]) + payload + bytes([(crc >> 8) & 0xFF, crc & 0xFF, 0x03])
     
     print("送信パケット:")
@@ -101,19 +105,6 @@ def test_get_values(ser):
         print("3. ボーレート設定を確認 (デフォルト: 115200)")
         print("4. VESCの電源が入っているか確認")
 
-def calculate_crc16(data):
-    """CRC16計算"""
-    poly = 0x1021
-    crc = 0
-    for b in data:
-        crc ^= b << 8
-        for _ in range(8):
-            if crc & 0x8000:
-                crc = ((crc << 1) ^ poly) & 0xFFFF
-            else:
-                crc = (crc << 1) & 0xFFFF
-    return crc
-
 def analyze_packet(data):
     """パケット構造を解析"""
     print("\n--- パケット解析 ---")
@@ -137,7 +128,7 @@ def analyze_packet(data):
                 
                 payload = data[2:2+length]
                 crc_received = (data[2+length] << 8) | data[2+length+1]
-                crc_calculated = calculate_crc16(payload)
+                crc_calculated = crc16(payload)
                 
                 print(f"\nCRCチェック:")
                 print(f"  受信CRC: 0x{crc_received:04x}")